@@ -0,0 +1,106 @@
+'''
+Benchmark of clearing the temp files of a big install.
+Makes a made up game folder with materials, models and maps, and as many custom folders as asked
+(each with its own materials and models), with .cache files where the game leaves them.
+Then compares the os.walk loop the updater used before with cleanup.find_temp_files and
+cleanup.delete_temp_files, and checks they find the same files.
+The files stay in the OS's cache between runs, on a cold disk the old walk is much slower still.
+Usage: python benchmarks/bench_cleanup.py [custom folders] [files per asset folder] [runs]
+'''
+import os
+import sys
+import time
+import tempfile
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' ) )
+import cleanup
+
+def make_assets( path: str, files: int ) -> None:
+    '''
+    Fill path with files empty files, 50 to a folder, like materials or models.
+    '''
+    for number in range( files ):
+        folder = os.path.join( path, f'folder{number // 50}' )
+        if number % 50 == 0:
+            os.makedirs( folder )
+        open( os.path.join( folder, f'file{number}.vtf' ), 'wb' ).close()
+
+def make_caches( game_path: str, custom_folders: int ) -> None:
+    '''
+    (Re)make the temp files: the verify cache, the map sound caches and a sound cache per custom folder.
+    '''
+    with open( os.path.join( game_path, 'verify_hashes.cache' ), 'wb' ) as file:
+        file.write( bytes( 100000 ) )
+    for number in range( 20 ):
+        with open( os.path.join( game_path, 'maps', 'soundcache', f'map{number}.cache' ), 'wb' ) as file:
+            file.write( bytes( 5000 ) )
+    for number in range( custom_folders ):
+        with open( os.path.join( game_path, 'custom', f'addon{number}', 'sound', 'sound.cache' ), 'wb' ) as file:
+            file.write( bytes( 1000 ) )
+        open( os.path.join( game_path, 'custom', f'addon{number}', 'download.tmp' ), 'wb' ).close()
+
+def make_game( game_path: str, custom_folders: int, files: int ) -> None:
+    '''
+    Make the made up install.
+    '''
+    make_assets( os.path.join( game_path, 'materials' ), files )
+    make_assets( os.path.join( game_path, 'models' ), files )
+    os.makedirs( os.path.join( game_path, 'maps', 'soundcache' ) )
+    for number in range( custom_folders ):
+        addon_path = os.path.join( game_path, 'custom', f'addon{number}' )
+        make_assets( os.path.join( addon_path, 'materials' ), files // 10 )
+        make_assets( os.path.join( addon_path, 'models' ), files // 10 )
+        os.makedirs( os.path.join( addon_path, 'sound' ) )
+    make_caches( game_path, custom_folders )
+
+def find_with_walk( game_path: str ) -> list:
+    '''
+    The temp files the way the updater used to look for them.
+    '''
+    found = []
+    for root, __, files in os.walk( game_path ):
+        for tmp_file in files:
+            if tmp_file.endswith( '.cache' ) or tmp_file.endswith( '.tmp' ):
+                found.append( os.path.join( root, tmp_file ) )
+    return found
+
+def delete_with_walk( game_path: str ) -> None:
+    '''
+    The old cleanup.
+    '''
+    for path in find_with_walk( game_path ):
+        os.remove( path )
+
+def best_time( function, game_path: str, custom_folders: int, runs: int, remake: bool ) -> float:
+    '''
+    Fastest of several runs, in seconds. With remake, the temp files are made again before every run.
+    '''
+    times = []
+    for _ in range( runs ):
+        if remake:
+            make_caches( game_path, custom_folders )
+        start = time.perf_counter()
+        function( game_path )
+        times.append( time.perf_counter() - start )
+    return min( times )
+
+def main() -> None:
+    custom_folders = int( sys.argv[1] if len( sys.argv ) > 1 else 200 )
+    files = int( sys.argv[2] if len( sys.argv ) > 2 else 20000 )
+    runs = int( sys.argv[3] if len( sys.argv ) > 3 else 5 )
+    with tempfile.TemporaryDirectory() as path:
+        game_path = os.path.join( path, 'pf2' )
+        make_game( game_path, custom_folders, files )
+        found = cleanup.find_temp_files( game_path )
+        assert sorted( find_with_walk( game_path ) ) == sorted( path for path, _ in found ), 'They found different files'
+        total = sum( len( names ) for _, _, names in os.walk( game_path ) )
+        print( f'{total} files, {len( found )} temp files ({sum( size for _, size in found ) / 1e6:.1f} MB)' )
+
+        old = best_time( find_with_walk, game_path, custom_folders, runs, False )
+        new = best_time( cleanup.find_temp_files, game_path, custom_folders, runs, False )
+        print( f'Finding:   os.walk {old * 1e3:8.1f} ms  scandir {new * 1e3:7.1f} ms  {old / new:5.1f}x' )
+        old = best_time( delete_with_walk, game_path, custom_folders, runs, True )
+        new = best_time( cleanup.delete_temp_files, game_path, custom_folders, runs, True )
+        print( f'Deleting:  os.walk {old * 1e3:8.1f} ms  scandir {new * 1e3:7.1f} ms  {old / new:5.1f}x' )
+
+if __name__ == '__main__':
+    main()
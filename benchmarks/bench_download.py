@@ -0,0 +1,103 @@
+'''
+Benchmark of the download paths against a local server.
+Compares the old download loop (1 KiB iter_content chunks with a progress update per chunk)
+with net.download_file (single connection) and net.download_segmented (several connections),
+printing MB/s and CPU% for each.
+Then checks that net.download_file resumes a download the server cut at 40% with a Range request,
+and that the resumed file is the one on the server.
+Usage: python benchmarks/bench_download.py [size in MB] [per-connection speed limit in MB/s, 0 for none]
+'''
+import os
+import sys
+import time
+import hashlib
+import tempfile
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' ) )
+import requests
+from tqdm import tqdm
+import server
+import vars
+import net
+import telemetry
+
+def old_download_loop( url: str, path: str ) -> bool:
+    '''
+    The download loop the updater used before net.py.
+    '''
+    response = requests.get( url, stream=True, timeout=10 )
+    total_size = int( response.headers.get( 'content-length', 0 ) )
+    with open( path, 'wb' ) as handle, tqdm( total=total_size, unit='iB', unit_scale=True ) as bar:
+        for chunk in response.iter_content( chunk_size=1*1024 ):
+            size = handle.write( chunk )
+            bar.update( size )
+    return response.status_code == 200
+
+def measure( name: str, function, url: str, path: str, size: int ) -> None:
+    '''
+    Run one download and print its throughput and CPU use.
+    '''
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    assert function( url, path ), f'{name} failed'
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    assert os.path.getsize( path ) == size
+    os.remove( path )
+    print( f'{name:<24} {size / wall / 1e6:8.1f} MB/s {cpu / wall * 100:6.1f}% CPU {wall:6.2f}s', file=sys.stderr )
+
+def hash_file( path: str ) -> str:
+    sha256 = hashlib.sha256()
+    with open( path, 'rb' ) as file:
+        while chunk := file.read( 1024 * 1024 ):
+            sha256.update( chunk )
+    return sha256.hexdigest()
+
+def check_resume( root: str, size: int ) -> None:
+    '''
+    Download with the server cutting the connection at 40%, then again with the server fixed.
+    The second call has to continue from the cut (per the .part.json sidecar) and end up with the server's file.
+    '''
+    cut = size * 2 // 5
+    path = os.path.join( root, 'resumed.tar.gz' )
+    httpd = server.serve( root, cut_after=cut )
+    url = f'http://127.0.0.1:{httpd.server_port}/latest.tar.gz'
+    retries, telemetry_on = vars.HTTP_RETRIES, vars.TELEMETRY
+    # Give up at the first cut, and count the bytes without writing telemetry
+    vars.HTTP_RETRIES = 0
+    vars.TELEMETRY = False
+    try:
+        assert not net.download_file( url, path ), 'The download finished even though it was cut'
+        # The last chunk read before the cut may be lost
+        kept = os.path.getsize( path + '.part' ) if os.path.exists( path + '.part' ) else 0
+        assert 0 < kept <= cut and os.path.exists( path + '.part.json' ), 'The cut download left nothing to resume'
+        httpd.handler.cut_after = 0
+        with telemetry.phase( 'resume' ) as phase:
+            assert net.download_file( url, path ), 'The resumed download failed'
+        assert phase.downloaded == size - kept, f'The download started over ({phase.downloaded} bytes) instead of resuming'
+        assert hash_file( path ) == hash_file( os.path.join( root, 'latest.tar.gz' ) ), 'The resumed file doesn\'t match the server\'s'
+        assert not os.path.exists( path + '.part.json' )
+        print( f'resume after a cut at 40%: ok, {( size - kept ) / 1e6:.1f} MB downloaded the second time', file=sys.stderr )
+    finally:
+        vars.HTTP_RETRIES, vars.TELEMETRY = retries, telemetry_on
+        httpd.shutdown()
+
+def main() -> None:
+    size = int( sys.argv[1] if len( sys.argv ) > 1 else 256 ) * 1024 * 1024
+    rate_limit = int( float( sys.argv[2] if len( sys.argv ) > 2 else 0 ) * 1e6 )
+    with tempfile.TemporaryDirectory() as root:
+        # Random data so nothing along the way can compress it.
+        with open( os.path.join( root, 'latest.tar.gz' ), 'wb' ) as file:
+            for _ in range( size // ( 1024 * 1024 ) ):
+                file.write( os.urandom( 1024 * 1024 ) )
+        process, port = server.serve_process( root, rate_limit=rate_limit )
+        url = f'http://127.0.0.1:{port}/latest.tar.gz'
+        path = os.path.join( root, 'downloaded.tar.gz' )
+
+        measure( 'old loop (1 KiB chunks)', old_download_loop, url, path, size )
+        measure( 'net.download_file', net.download_file, url, path, size )
+        measure( 'net.download_segmented', net.download_segmented, url, path, size )
+        process.terminate()
+        check_resume( root, size )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+'''
+Benchmark of reading the list of changed files out of the bundled patches.
+Compares unidiff.PatchSet( metadata_only=True ), which the updater used before,
+with patchscan.scan_patch, checks they agree and prints the time of each.
+Usage: python benchmarks/bench_patchscan.py [runs]
+'''
+import os
+import sys
+import glob
+import time
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' ) )
+import unidiff
+import manifest
+import patchscan
+
+def scan_with_unidiff( patch_path: str ) -> list:
+    '''
+    The changed files the way the updater used to get them.
+    '''
+    with open( patch_path, 'r' ) as file:
+        diff_file = unidiff.PatchSet( file, metadata_only=True )
+    return [ ( changed_file.path, operation ) for operation, files in ( ( manifest.OP_MODIFIED, diff_file.modified_files ),
+                                                                       ( manifest.OP_REMOVED, diff_file.removed_files ),
+                                                                       ( manifest.OP_ADDED, diff_file.added_files ) )
+             for changed_file in files ]
+
+def best_time( function, patch_path: str, runs: int ) -> float:
+    '''
+    Fastest of several runs, in seconds.
+    '''
+    times = []
+    for _ in range( runs ):
+        start = time.perf_counter()
+        function( patch_path )
+        times.append( time.perf_counter() - start )
+    return min( times )
+
+def main() -> None:
+    runs = int( sys.argv[1] if len( sys.argv ) > 1 else 20 )
+    root = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' )
+    for patch_path in sorted( glob.glob( os.path.join( root, '*.patch' ) ) ):
+        expected = scan_with_unidiff( patch_path )
+        scanned = patchscan.scan_patch( patch_path )
+        # Same files, same operations, same order within each operation.
+        assert sorted( expected, key=lambda entry: entry[1] ) == sorted( scanned, key=lambda entry: entry[1] ), f'{patch_path} differs'
+
+        old = best_time( scan_with_unidiff, patch_path, runs )
+        new = best_time( patchscan.scan_patch, patch_path, runs )
+        print( f'{os.path.basename( patch_path ):<20} {len( scanned ):4} files  unidiff {old * 1e3:7.2f} ms  patchscan {new * 1e3:6.2f} ms  {old / new:5.1f}x' )
+
+if __name__ == '__main__':
+    main()
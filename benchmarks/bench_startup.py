@@ -0,0 +1,119 @@
+'''
+Benchmark of starting the updater.
+Prints the modules that take longest to import (python -X importtime), and the time from launching
+the updater to its menu showing up, once before the Steam path is cached and then with it cached.
+Steam's registry.vdf is faked in a temporary home folder, so this runs the same on any machine.
+With a history file, the results are appended to it as a line of JSON and compared with the last ones,
+so startup can be tracked over releases. A built executable can be timed instead of src/main.py.
+Usage: python benchmarks/bench_startup.py [runs] [history file] [executable]
+'''
+import os
+import sys
+import json
+import time
+import tempfile
+import platform
+import subprocess
+
+SOURCE_PATH = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' )
+# Modules listed in the import breakdown.
+TOP_MODULES = 15
+
+def make_environment( home_path: str ) -> dict:
+    '''
+    Environment with a home folder holding a fake Steam registry.vdf, and the updater's cache in it too.
+    '''
+    os.makedirs( os.path.join( home_path, '.steam' ), exist_ok=True )
+    with open( os.path.join( home_path, '.steam', 'registry.vdf' ), 'w', encoding='utf-8' ) as file:
+        file.write( '"Registry"\n{\n\t"HKCU"\n\t{\n\t\t"Software"\n\t\t{\n\t\t\t"Valve"\n\t\t\t{\n\t\t\t\t"Steam"\n\t\t\t\t{\n' )
+        # Steam's file is long, the path is somewhere in the middle
+        for number in range( 2000 ):
+            file.write( f'\t\t\t\t\t"Setting{number}"\t\t"{number}"\n' )
+        file.write( '\t\t\t\t\t"SourceModInstallPath"\t\t"/home/bench/.steam/steam/steamapps/sourcemods"\n' )
+        file.write( '\t\t\t\t}\n\t\t\t}\n\t\t}\n\t}\n}\n' )
+    environment = dict( os.environ )
+    environment['HOME'] = home_path
+    environment['XDG_CACHE_HOME'] = os.path.join( home_path, '.cache' )
+    # Otherwise the menu sits in a buffer until the updater exits
+    environment['PYTHONUNBUFFERED'] = '1'
+    return environment
+
+def import_breakdown( environment: dict ) -> tuple:
+    '''
+    Milliseconds to import main, and the slowest modules as ( name, milliseconds ) by cumulative time.
+    '''
+    result = subprocess.run( [ sys.executable, '-X', 'importtime', '-c', 'import main' ], cwd=SOURCE_PATH,
+                             env=environment, capture_output=True, text=True, check=True )
+    modules = []
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith( 'import time:' ) or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len( 'import time:' ):].split( '|' )
+        milliseconds = int( cumulative ) / 1e3
+        modules.append( ( name.rstrip(), milliseconds ) )
+        if name.strip() == 'main':
+            total = milliseconds
+    modules.sort( key=lambda module: module[1], reverse=True )
+    return total, modules[:TOP_MODULES]
+
+def time_to_menu( command: list, environment: dict ) -> float:
+    '''
+    Seconds from launching the updater to its menu showing up. Picks Exit right after.
+    '''
+    start = time.perf_counter()
+    process = subprocess.Popen( command, cwd=SOURCE_PATH, env=environment, text=True,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL )
+    for line in process.stdout:
+        if 'Welcome' in line:
+            break
+    elapsed = time.perf_counter() - start
+    process.communicate( '7\n' )
+    return elapsed
+
+def main() -> None:
+    runs = int( sys.argv[1] if len( sys.argv ) > 1 else 10 )
+    history_path = sys.argv[2] if len( sys.argv ) > 2 else None
+    command = [ os.path.abspath( sys.argv[3] ) ] if len( sys.argv ) > 3 else [ sys.executable, 'main.py' ]
+
+    with tempfile.TemporaryDirectory() as home_path:
+        environment = make_environment( home_path )
+        cache_path = os.path.join( home_path, '.cache' )
+        # Once so the .pyc files exist, we don't want to time compiling
+        time_to_menu( command, environment )
+
+        total, modules = import_breakdown( environment )
+        print( f'import main: {total:.1f} ms, slowest modules (cumulative):' )
+        for name, milliseconds in modules:
+            print( f'    {milliseconds:8.1f} ms  {name}' )
+
+        cold = []
+        warm = []
+        for _ in range( runs ):
+            subprocess.run( [ sys.executable, '-c', 'import shutil, sys; shutil.rmtree( sys.argv[1], ignore_errors=True )', cache_path ], check=True )
+            cold.append( time_to_menu( command, environment ) )
+            warm.append( time_to_menu( command, environment ) )
+    record = { 'date': time.strftime( '%Y-%m-%d %H:%M:%S' ),
+               'python': platform.python_version(),
+               'command': os.path.basename( command[-1] ),
+               'import_ms': round( total, 1 ),
+               'menu_cold_ms': round( min( cold ) * 1e3, 1 ),
+               'menu_warm_ms': round( min( warm ) * 1e3, 1 ),
+               'modules': [ [ name.strip(), round( milliseconds, 1 ) ] for name, milliseconds in modules ] }
+    print( f'Time to menu: {record["menu_cold_ms"]} ms without the Steam path cached, {record["menu_warm_ms"]} ms with it (best of {runs})' )
+
+    if history_path:
+        previous = None
+        if os.path.exists( history_path ):
+            with open( history_path, 'r' ) as file:
+                lines = [ line for line in file if line.strip() ]
+            if lines:
+                previous = json.loads( lines[-1] )
+        if previous:
+            print( f'Last run ({previous["date"]}): import {previous["import_ms"]} ms, '
+                   f'menu {previous["menu_cold_ms"]} ms / {previous["menu_warm_ms"]} ms' )
+        with open( history_path, 'a' ) as file:
+            file.write( json.dumps( record ) + '\n' )
+
+if __name__ == '__main__':
+    main()
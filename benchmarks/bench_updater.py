@@ -0,0 +1,253 @@
+'''
+End to end benchmark of the updater, on made up builds (see synthetic.py) served from a local server.
+Makes an old and a new build of the asked size, publishes the new one and the update between them,
+then times each phase, best of the asked runs:
+    download                 util.download(), latest.tar.gz to disk
+    extract                  util.extract(), into the staging folder
+    install                  util.install_build(), the extracted build swapped in as the game
+    update                   util.update_to_latest() from the old build, fetching only the changed files
+    continue_update          util.continue_update() of an update interrupted before its Added phase
+    delete_all_temp_files    util.delete_all_temp_files()
+The phases that change the game start from the old build, and the game is checked against the new build after them.
+Results are printed, and written as JSON with --output. With --baseline (the JSON of an earlier run), a phase
+more than --tolerance slower than in the baseline is a regression and the benchmark exits with 1.
+--save-baseline writes this run as the baseline instead.
+With --telemetry, the updater's own telemetry (see telemetry.py) of every run is written to that file.
+Usage: python benchmarks/bench_updater.py [--size MB] [--runs N] [--patch] [--output results.json]
+                                          [--baseline baseline.json] [--tolerance 0.25] [--save-baseline]
+                                          [--telemetry telemetry.jsonl] [--verbose]
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' ) )
+import vars
+from vars import UpdateCode
+import util
+import manifest
+import server
+import synthetic
+
+OLD_VERSION = '0.7.3'
+NEW_VERSION = '0.7.4'
+# Phases, in the order they run.
+PHASES = ( 'download', 'extract', 'install', 'update', 'continue_update', 'delete_all_temp_files' )
+# Temp files left in the game for delete_all_temp_files.
+TEMP_FILES = 200
+# Slowdowns smaller than this many seconds are noise, not regressions.
+MIN_REGRESSION_SECONDS = 0.05
+
+class Bench:
+    '''
+    The folders of one benchmark run: the builds, the server's folder, and the game with its working folder.
+    '''
+    def __init__( self, root: str, quiet: bool ):
+        self.old_build = os.path.join( root, 'old' )
+        self.new_build = os.path.join( root, 'new' )
+        self.server_path = os.path.join( root, 'server' )
+        # The updater downloads into the folder it runs from
+        self.work_path = os.path.join( root, 'work' )
+        self.game_path = os.path.join( root, 'sourcemods', 'pf2' )
+        self.quiet = quiet
+
+    def install_old( self ) -> None:
+        '''
+        Start over from the old build installed, and nothing else left around.
+        '''
+        for path in ( self.game_path, util.get_sibling_path( '.old' ), util.get_staging_path() ):
+            util.delete_folder_if_exists( path )
+        # Nothing left over from the download phase, the update starts from what a player has
+        util.delete_file_if_exists( vars.FILE_NAME )
+        shutil.copytree( os.path.join( self.old_build, 'pf2' ), self.game_path )
+
+    def check_new( self ) -> None:
+        '''
+        Make sure the game is now the new build.
+        '''
+        changes = manifest.make_manifest( os.path.join( self.new_build, 'pf2' ), self.game_path, NEW_VERSION, NEW_VERSION )
+        if changes.files:
+            raise AssertionError( f'The game isn\'t the new build, {len( changes.files )} files differ, like {changes.files[0].path}' )
+
+    def run( self, function ):
+        '''
+        Run one of the updater's functions, without its output unless we're verbose. Returns what it returned and the seconds it took.
+        '''
+        with open( os.devnull, 'w' ) as devnull, contextlib.ExitStack() as stack:
+            if self.quiet:
+                stack.enter_context( contextlib.redirect_stdout( devnull ) )
+                stack.enter_context( contextlib.redirect_stderr( devnull ) )
+            start = time.perf_counter()
+            result = function()
+            return result, time.perf_counter() - start
+
+    def check_for_update( self, expected: UpdateCode ) -> None:
+        result, _ = self.run( util.check_for_update )
+        if result != expected:
+            raise AssertionError( f'check_for_update() said {result}, not {expected}' )
+
+    def download( self ) -> float:
+        util.delete_file_if_exists( vars.FILE_NAME )
+        result, seconds = self.run( util.download )
+        assert result and os.path.getsize( vars.FILE_NAME ) == os.path.getsize( os.path.join( self.server_path, vars.FILE_NAME ) ), 'download() failed'
+        return seconds
+
+    def extract( self ) -> float:
+        util.delete_folder_if_exists( util.get_staging_path() )
+        result, seconds = self.run( util.extract )
+        assert result, 'extract() failed'
+        return seconds
+
+    def install( self ) -> float:
+        # Keep the staging folder extract() made
+        util.delete_folder_if_exists( self.game_path )
+        shutil.copytree( os.path.join( self.old_build, 'pf2' ), self.game_path )
+        result, seconds = self.run( util.install_build )
+        assert result, 'install_build() failed'
+        self.check_new()
+        util.delete_folder_if_exists( util.get_sibling_path( '.old' ) )
+        return seconds
+
+    def update( self ) -> float:
+        self.install_old()
+        self.check_for_update( UpdateCode.UPDATE_YES )
+        result, seconds = self.run( util.update_to_latest )
+        assert result, 'update_to_latest() failed'
+        self.check_new()
+        return seconds
+
+    def continue_update( self ) -> float:
+        self.install_old()
+        self.check_for_update( UpdateCode.UPDATE_YES )
+        # Stop the update before it adds the new files
+        apply_phase = util.apply_phase
+        def interrupted_apply_phase( name: str, *args ) -> None:
+            if name == 'Added':
+                raise KeyboardInterrupt
+            apply_phase( name, *args )
+        util.apply_phase = interrupted_apply_phase
+        try:
+            self.run( util.update_to_latest )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            util.apply_phase = apply_phase
+        self.check_for_update( UpdateCode.UPDATE_INTERRUPTED )
+
+        result, seconds = self.run( util.continue_update )
+        assert result, 'continue_update() failed'
+        self.check_new()
+        return seconds
+
+    def delete_all_temp_files( self ) -> float:
+        self.install_old()
+        synthetic.make_temp_files( self.game_path, TEMP_FILES )
+        result, seconds = self.run( util.delete_all_temp_files )
+        assert result and result.files == TEMP_FILES + 2, 'delete_all_temp_files() missed some files'
+        return seconds
+
+def compare( results: dict, baseline: dict, tolerance: float ) -> list:
+    '''
+    Print each phase next to the baseline. Returns the phases that regressed.
+    '''
+    regressions = []
+    for phase in PHASES:
+        seconds = results['phases'][phase]
+        base = baseline['phases'].get( phase )
+        if base is None:
+            print( f'{phase:<24} {seconds:8.3f} s' )
+            continue
+        regressed = seconds > base * ( 1 + tolerance ) and seconds - base > MIN_REGRESSION_SECONDS
+        if regressed:
+            regressions.append( phase )
+        print( f'{phase:<24} {seconds:8.3f} s  baseline {base:8.3f} s  {( seconds / base - 1 ) * 100 if base else 0:+6.1f}%{"  REGRESSION" if regressed else ""}' )
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser( description='End to end benchmark of the updater against a local server.' )
+    parser.add_argument( '--size', type=int, default=64, help='Size of the made up builds in MB' )
+    parser.add_argument( '--runs', type=int, default=3, help='Runs of each phase, the fastest counts' )
+    parser.add_argument( '--patch', action='store_true', help='Publish the update as a patch instead of a manifest' )
+    parser.add_argument( '--output', help='Write the results to this JSON file' )
+    parser.add_argument( '--baseline', help='Compare with the results in this JSON file' )
+    parser.add_argument( '--tolerance', type=float, default=0.25, help='How much slower than the baseline a phase can be' )
+    parser.add_argument( '--save-baseline', action='store_true', help='Write the results as the baseline instead of comparing' )
+    parser.add_argument( '--telemetry', help='Write the updater\'s telemetry to this file' )
+    parser.add_argument( '--verbose', action='store_true', help='Show the updater\'s output' )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        bench = Bench( root, not args.verbose )
+        print( f'Making two {args.size} MB builds...' )
+        synthetic.make_build( bench.old_build, OLD_VERSION, args.size * 1024 * 1024, 0 )
+        synthetic.make_build( bench.new_build, NEW_VERSION, args.size * 1024 * 1024, 1 )
+        server_files = synthetic.publish( bench.server_path, bench.old_build, bench.new_build, OLD_VERSION, NEW_VERSION, args.patch )
+
+        process, port = server.serve_process( bench.server_path )
+        old_path = os.getcwd()
+        try:
+            url = f'http://127.0.0.1:{port}/'
+            vars.DEBUG = False
+            # Every download has to come from the server, not the artifact cache
+            vars.ARTIFACT_CACHE = False
+            # Only write telemetry where we're told to
+            vars.TELEMETRY = bool( args.telemetry )
+            vars.TELEMETRY_PATH = os.path.abspath( args.telemetry ) if args.telemetry else ''
+            vars.WEBSITE_URL = vars.PATCH_URL = url
+            vars.FILE_URL = url + vars.FILE_NAME
+            vars.DELTA_URL = url + 'deltas/{}-{}/'
+            vars.GAME_PATH = bench.game_path
+            # We delete the old build ourselves, not in the background while the next phase is timed
+            vars.KEEP_OLD_BUILD = True
+            os.makedirs( bench.work_path )
+            os.chdir( bench.work_path )
+            bench.install_old()
+
+            phases = { phase: [] for phase in PHASES }
+            for _ in range( args.runs ):
+                for phase in PHASES:
+                    phases[phase].append( getattr( bench, phase )() )
+        finally:
+            os.chdir( old_path )
+            process.terminate()
+            process.wait()
+
+    results = { 'date': time.strftime( '%Y-%m-%d %H:%M:%S' ),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'size_mb': args.size,
+                'patch': args.patch,
+                'runs': args.runs,
+                'server_files': server_files,
+                'phases': { phase: round( min( times ), 4 ) for phase, times in phases.items() } }
+
+    if args.output:
+        with open( args.output, 'w' ) as file:
+            json.dump( results, file, indent=1 )
+
+    baseline = None
+    if args.baseline and not args.save_baseline and os.path.exists( args.baseline ):
+        with open( args.baseline, 'r' ) as file:
+            baseline = json.load( file )
+        if ( baseline['size_mb'], baseline['patch'] ) != ( args.size, args.patch ):
+            print( f'The baseline was made with --size {baseline["size_mb"]}{" --patch" if baseline["patch"] else ""}, run with the same options.' )
+            sys.exit( 2 )
+    regressions = compare( results, baseline or { 'phases': {} }, args.tolerance )
+
+    if args.save_baseline:
+        if not args.baseline:
+            parser.error( '--save-baseline needs --baseline' )
+        with open( args.baseline, 'w' ) as file:
+            json.dump( results, file, indent=1 )
+        print( f'Saved as the baseline in {args.baseline}' )
+    elif regressions:
+        print( f'{len( regressions )} phases are more than {args.tolerance * 100:.0f}% slower than the baseline.' )
+        sys.exit( 1 )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''
+Benchmark of reading version.txt out of pf2_misc_dir.vpk.
+Compares vpk.open(...).get_file(), which the updater used before, with vpkdir.read_file and
+vpkdir.read_file_cached (what repeated update checks cost), on a made up VPK with as many files as asked.
+The last file of the VPK is timed too, it's the worst case for vpkdir.
+Usage: python benchmarks/bench_vpkversion.py [files in the VPK] [runs]
+'''
+import os
+import sys
+import time
+import tempfile
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' ) )
+import vpk
+import vpkdir
+
+# Extensions the made up files get, version.txt is listed with the .txt ones.
+EXTENSIONS = ( 'vmt', 'res', 'txt', 'cfg', 'wav' )
+
+def make_vpk( path: str, files: int ) -> str:
+    '''
+    Make a VPK with version.txt and files small files spread over folders. Returns the path of its _dir.vpk.
+    '''
+    source_path = os.path.join( path, 'source' )
+    for number in range( files ):
+        folder = os.path.join( source_path, 'materials', f'folder{number % 200}' )
+        os.makedirs( folder, exist_ok=True )
+        with open( os.path.join( folder, f'file{number}.{EXTENSIONS[number % len( EXTENSIONS )]}' ), 'wb' ) as file:
+            file.write( os.urandom( 64 ) )
+    with open( os.path.join( source_path, 'version.txt' ), 'w' ) as file:
+        file.write( 'version=0.7.3' )
+    dir_path = os.path.join( path, 'pf2_misc_dir.vpk' )
+    vpk.new( source_path ).save( dir_path )
+    return dir_path
+
+def read_with_vpk( dir_path: str, path: str ) -> bytes:
+    '''
+    A file the way the updater used to read version.txt.
+    '''
+    with vpk.open( dir_path ) as vpkfile:
+        return vpkfile.get_file( path ).read()
+
+def best_time( function, dir_path: str, path: str, runs: int ) -> float:
+    '''
+    Fastest of several runs, in seconds.
+    '''
+    times = []
+    for _ in range( runs ):
+        start = time.perf_counter()
+        function( dir_path, path )
+        times.append( time.perf_counter() - start )
+    return min( times )
+
+def main() -> None:
+    files = int( sys.argv[1] if len( sys.argv ) > 1 else 20000 )
+    runs = int( sys.argv[2] if len( sys.argv ) > 2 else 10 )
+    with tempfile.TemporaryDirectory() as path:
+        dir_path = make_vpk( path, files )
+        # The last file of the directory is the worst case, the whole tree is walked to find it
+        last_path = list( vpk.open( dir_path ) )[-1]
+        print( f'{files} files, directory of {os.path.getsize( dir_path ) / 1e6:.1f} MB' )
+        for file_path in ( 'version.txt', last_path ):
+            assert read_with_vpk( dir_path, file_path ) == vpkdir.read_file( dir_path, file_path ) == vpkdir.read_file_cached( dir_path, file_path )
+            old = best_time( read_with_vpk, dir_path, file_path, runs )
+            new = best_time( vpkdir.read_file, dir_path, file_path, runs )
+            cached = best_time( vpkdir.read_file_cached, dir_path, file_path, runs )
+            print( f'{file_path}:' )
+            print( f'    vpk.open    {old * 1e3:8.2f} ms' )
+            print( f'    read_file   {new * 1e3:8.2f} ms  {old / new:6.1f}x' )
+            print( f'    cached      {cached * 1e3:8.3f} ms  {old / cached:6.0f}x' )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+'''
+Local stand-in for dl.prefortress.com used by the benchmarks.
+Serves a folder over HTTP with Range, If-Range and ETag support like the real server,
+can cut every connection after a number of bytes to simulate a flaky network,
+and can cap the speed of each connection like a CDN does.
+'''
+import os
+import re
+import sys
+import time
+import socket
+import threading
+import subprocess
+import http.server
+
+class RangeRequestHandler( http.server.SimpleHTTPRequestHandler ):
+    '''
+    SimpleHTTPRequestHandler that understands byte ranges.
+    '''
+    protocol_version = 'HTTP/1.1'
+    # Cut the connection after sending this many bytes of a response (0 to never cut).
+    cut_after = 0
+    # Max bytes per second per connection (0 for no limit).
+    rate_limit = 0
+
+    def log_message( self, *args ) -> None:
+        # Keep the benchmark output clean.
+        pass
+
+    def do_HEAD( self ) -> None:
+        self.send_file( send_body=False )
+
+    def do_GET( self ) -> None:
+        self.send_file( send_body=True )
+
+    def send_file( self, send_body: bool ) -> None:
+        path = self.translate_path( self.path )
+        if not os.path.isfile( path ):
+            self.send_error( 404 )
+            return
+
+        stat = os.stat( path )
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+        start, end = 0, size - 1
+        status = 200
+
+        # Only honor the range if the file didn't change since the client's validator.
+        byte_range = self.headers.get( 'Range' )
+        if_range = self.headers.get( 'If-Range' )
+        if byte_range and ( if_range is None or if_range == etag ):
+            match = re.match( r'bytes=(\d+)-(\d*)$', byte_range )
+            start = int( match.group( 1 ) )
+            if match.group( 2 ):
+                end = min( int( match.group( 2 ) ), size - 1 )
+            if start >= size:
+                self.send_response( 416 )
+                self.send_header( 'Content-Range', f'bytes */{size}' )
+                self.send_header( 'Content-Length', '0' )
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response( status )
+        self.send_header( 'Content-Length', str( end - start + 1 ) )
+        self.send_header( 'ETag', etag )
+        self.send_header( 'Accept-Ranges', 'bytes' )
+        if status == 206:
+            self.send_header( 'Content-Range', f'bytes {start}-{end}/{size}' )
+        self.end_headers()
+        if not send_body:
+            return
+
+        with open( path, 'rb' ) as file:
+            file.seek( start )
+            left = end - start + 1
+            sent = 0
+            started = time.perf_counter()
+            while left:
+                data = file.read( min( 256 * 1024, left ) )
+                # Simulate the connection dropping.
+                if self.cut_after and sent + len( data ) > self.cut_after:
+                    self.wfile.write( data[:self.cut_after - sent] )
+                    self.wfile.flush()
+                    self.close_connection = True
+                    self.connection.shutdown( socket.SHUT_RDWR )
+                    return
+                self.wfile.write( data )
+                left -= len( data )
+                sent += len( data )
+                # Slow down to the speed limit.
+                if self.rate_limit:
+                    ahead = sent / self.rate_limit - ( time.perf_counter() - started )
+                    if ahead > 0:
+                        time.sleep( ahead )
+
+def serve( root: str, cut_after: int = 0, rate_limit: int = 0 ) -> http.server.ThreadingHTTPServer:
+    '''
+    Serve the root folder on a random local port in a background thread.
+    The URL is f'http://127.0.0.1:{server.server_port}/'
+    cut_after and rate_limit can be changed while it runs, on server.handler.
+    '''
+    handler = type( 'Handler', ( RangeRequestHandler, ), { 'cut_after': cut_after, 'rate_limit': rate_limit } )
+    server = http.server.ThreadingHTTPServer( ( '127.0.0.1', 0 ), lambda *args: handler( *args, directory=root ) )
+    server.handler = handler
+    server.daemon_threads = True
+    threading.Thread( target=server.serve_forever, daemon=True ).start()
+    return server
+
+def serve_process( root: str, cut_after: int = 0, rate_limit: int = 0 ) -> tuple:
+    '''
+    Serve the root folder from a separate process so the server's CPU time doesn't count against whatever we're measuring.
+    Returns ( process, port ). Terminate the process when done.
+    '''
+    process = subprocess.Popen( [ sys.executable, os.path.abspath( __file__ ), root, str( cut_after ), str( rate_limit ) ],
+                                stdout=subprocess.PIPE, text=True )
+    port = int( process.stdout.readline() )
+    return process, port
+
+if __name__ == '__main__':
+    # Print the port and serve until killed.
+    httpd = serve( sys.argv[1], int( sys.argv[2] ), int( sys.argv[3] ) )
+    print( httpd.server_port, flush=True )
+    threading.Event().wait()
@@ -0,0 +1,183 @@
+'''
+Made up Pre-Fortress 2 builds for the benchmarks, so they don't need the real game or its servers.
+A build has what the updater looks at: gameinfo.txt, the binaries in bin/, maps/*.bsp, a multi-chunk
+pf2_misc VPK holding version.txt, and a lot of small files.
+Every file's contents come from its name and its revision. Revision 0 is the old build, in revision 1
+some of the files change (VPK entries keep their size and place), a few are removed and a few are added.
+publish() lays out a folder like the download server, with everything an update from one build to the other needs.
+'''
+import os
+import sys
+import json
+import zlib
+import random
+import struct
+import tarfile
+from platform import system
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' ) )
+import vars
+import pack
+import manifest
+import util
+
+# Share of a build's size in each kind of file, the rest is small files.
+MAP_SHARE = 0.4
+VPK_SHARE = 0.4
+BINARY_SHARE = 0.1
+# Files of each kind.
+MAPS = 8
+VPK_ENTRIES = 2000
+SMALL_FILE_SIZE = 4096
+# Chunks the VPK is split in.
+VPK_CHUNKS = 8
+# Files that are only in the old build, and only in the new one.
+REMOVED_FILES = 5
+ADDED_FILES = 5
+
+# Same layout as a real VPK directory, version 1.
+VPK_HEADER = struct.Struct( '<III' )
+VPK_ENTRY = struct.Struct( '<IHHIIH' )
+
+def make_data( name: str, revision: int, size: int ) -> bytes:
+    '''
+    Contents of a file: half random, half zeros, so a build compresses about like the real one.
+    '''
+    generator = random.Random( f'{name}:{revision}' )
+    half = size // 2
+    return generator.randbytes( half ) + bytes( size - half )
+
+def get_revision( name: str, revision: int, changed: float ) -> int:
+    '''
+    Revision of a file in a build: the build's own for the changed share of the files, 0 for the rest.
+    '''
+    return revision if zlib.crc32( name.encode() ) % 1000 < changed * 1000 else 0
+
+def write_file( path: str, data: bytes ) -> None:
+    '''
+    Write data to path, making its folder if needed.
+    '''
+    os.makedirs( os.path.dirname( path ), exist_ok=True )
+    with open( path, 'wb' ) as file:
+        file.write( data )
+
+def write_vpk( dir_path: str, entries: dict, embedded: dict, chunk_size: int ) -> None:
+    '''
+    Write a multi-chunk VPK: entries ( path: data ) go in the chunks in order of path, embedded ones in the _dir.vpk.
+    '''
+    # extension: folder: [ ( name, crc32, archive index, offset, length ) ]
+    tree = {}
+    chunks = [ bytearray() ]
+    embedded_data = bytearray()
+    for path in sorted( entries ) + sorted( embedded ):
+        data = entries.get( path, embedded.get( path ) )
+        folder, _, name = path.rpartition( '/' )
+        name, _, extension = name.rpartition( '.' )
+        if path in embedded:
+            location = ( 0x7fff, len( embedded_data ) )
+            embedded_data += data
+        else:
+            if len( chunks[-1] ) + len( data ) > chunk_size and chunks[-1]:
+                chunks.append( bytearray() )
+            location = ( len( chunks ) - 1, len( chunks[-1] ) )
+            chunks[-1] += data
+        tree.setdefault( extension, {} ).setdefault( folder or ' ', [] ).append( ( name, zlib.crc32( data ) ) + location + ( len( data ), ) )
+
+    tree_data = bytearray()
+    for extension, folders in tree.items():
+        tree_data += extension.encode() + b'\0'
+        for folder, files in folders.items():
+            tree_data += folder.encode() + b'\0'
+            for name, crc32, archive_index, offset, length in files:
+                tree_data += name.encode() + b'\0' + VPK_ENTRY.pack( crc32, 0, archive_index, offset, length, 0xffff )
+            tree_data += b'\0'
+        tree_data += b'\0'
+    tree_data += b'\0'
+
+    write_file( dir_path, VPK_HEADER.pack( 0x55aa1234, 1, len( tree_data ) ) + tree_data + embedded_data )
+    for archive_index, chunk in enumerate( chunks ):
+        write_file( dir_path[:-len( 'dir.vpk' )] + f'{archive_index:03d}.vpk', chunk )
+
+def make_build( build_path: str, version: str, size: int, revision: int = 0, changed: float = 0.1 ) -> None:
+    '''
+    Make a build of about size bytes in build_path/pf2. Revision 0 is the old build, revision 1 the new one
+    with the changed share of its files different.
+    '''
+    game_path = os.path.join( build_path, 'pf2' )
+    binary = '.dll' if system() == 'Windows' else '.so'
+
+    def add( path: str, file_size: int ) -> None:
+        write_file( os.path.join( game_path, *path.split( '/' ) ), make_data( path, get_revision( path, revision, changed ), file_size ) )
+
+    write_file( os.path.join( game_path, 'gameinfo.txt' ), b'"GameInfo"\n{\n\tgame "Pre-Fortress 2"\n}\n' )
+    for name in ( 'server', 'client' ):
+        add( f'bin/{name}{binary}', int( size * BINARY_SHARE / 2 ) )
+    for number in range( MAPS ):
+        add( 'maps/ctf_2fort.bsp' if number == 0 else f'maps/map{number}.bsp', int( size * MAP_SHARE / MAPS ) )
+    for number in range( int( size * ( 1 - MAP_SHARE - VPK_SHARE - BINARY_SHARE ) / SMALL_FILE_SIZE ) ):
+        add( f'materials/folder{number // 100}/file{number}.vmt', SMALL_FILE_SIZE )
+    if revision == 0:
+        for number in range( REMOVED_FILES ):
+            add( f'cfg/old{number}.cfg', SMALL_FILE_SIZE )
+    else:
+        for number in range( ADDED_FILES ):
+            add( f'cfg/new{number}.cfg', SMALL_FILE_SIZE )
+
+    entry_size = int( size * VPK_SHARE / VPK_ENTRIES )
+    entries = { f'scripts/folder{number // 50}/file{number}.txt': make_data( f'vpk:{number}', get_revision( f'vpk:{number}', revision, changed ), entry_size )
+                for number in range( VPK_ENTRIES ) }
+    write_vpk( os.path.join( game_path, 'pf2_misc_dir.vpk' ), entries, { 'version.txt': f'version={version}'.encode() },
+               max( 1, entry_size * VPK_ENTRIES // VPK_CHUNKS ) )
+
+def make_temp_files( game_path: str, count: int ) -> None:
+    '''
+    Leave .cache and .tmp files where the game does.
+    '''
+    for number in range( count ):
+        write_file( os.path.join( game_path, 'maps', 'soundcache', f'map{number}.cache' ), bytes( 1000 ) )
+    write_file( os.path.join( game_path, 'sound', 'sound.cache' ), bytes( 10000 ) )
+    write_file( os.path.join( game_path, 'download.tmp' ), bytes( 1000 ) )
+
+def get_patch_name( old_version: str, new_version: str ) -> str:
+    '''
+    Name the updater asks for the patch between two versions, like pf2_073-074.patch
+    '''
+    return f'pf2_0{util.get_version_num( old_version )}-0{util.get_version_num( new_version )}.patch'
+
+def write_patch( patch_path: str, changes: manifest.Manifest ) -> None:
+    '''
+    Write a patch like diff -ruN between the two builds would, headers only (every file here is binary).
+    '''
+    old_root = f'pf2_{changes.old_version}/pf2'
+    new_root = f'pf2_{changes.new_version}/pf2'
+    with open( patch_path, 'w' ) as file:
+        for change in changes.files:
+            folder, _, name = change.path.rpartition( '/' )
+            if change.operation == manifest.OP_MODIFIED:
+                file.write( f'Binary files {old_root}/{change.path} and {new_root}/{change.path} differ\n' )
+            elif change.operation == manifest.OP_ADDED:
+                file.write( f'Only in {new_root}/{folder}: {name}\n' if folder else f'Only in {new_root}: {name}\n' )
+            else:
+                file.write( f'Only in {old_root}/{folder}: {name}\n' if folder else f'Only in {old_root}: {name}\n' )
+
+def publish( server_path: str, old_build: str, new_build: str, old_version: str, new_version: str, with_patch: bool = False ) -> dict:
+    '''
+    Lay out server_path like the download server for an update from old_build to new_build (folders holding pf2/):
+    version.txt, latest.tar.gz, latest.pack and its index, and the update's manifest, or its patch with with_patch.
+    Returns the size of each file.
+    '''
+    os.makedirs( server_path, exist_ok=True )
+    with open( os.path.join( server_path, 'version.txt' ), 'w' ) as file:
+        file.write( new_version )
+    with tarfile.open( os.path.join( server_path, vars.FILE_NAME ), 'w:gz', compresslevel=6 ) as file:
+        file.add( os.path.join( new_build, 'pf2' ), arcname='pf2' )
+    index = pack.make_pack( new_build, os.path.join( server_path, 'latest.pack' ), new_version )
+    with open( os.path.join( server_path, vars.INDEX_FILE_NAME ), 'w' ) as file:
+        json.dump( index, file, separators=( ',', ':' ) )
+
+    changes = manifest.make_manifest( os.path.join( old_build, 'pf2' ), os.path.join( new_build, 'pf2' ), old_version, new_version )
+    patch_name = get_patch_name( old_version, new_version )
+    if with_patch:
+        write_patch( os.path.join( server_path, patch_name ), changes )
+    else:
+        manifest.save_manifest( changes, os.path.join( server_path, patch_name.replace( '.patch', '.manifest.json' ) ) )
+    return { name: os.path.getsize( os.path.join( server_path, name ) ) for name in os.listdir( server_path ) }
@@ -0,0 +1,351 @@
+'''
+Cache of the big files the updater downloads (latest.tar.gz, patches and their manifests), so installing,
+reinstalling or repairing again doesn't download them again.
+Files are kept in vars.ARTIFACT_CACHE_PATH under objects/, named after their SHA-256, and index.json maps
+<name>@<version> to a file with its size, hash, the server's ETag and when it was last used.
+The cache is kept under vars.ARTIFACT_CACHE_SIZE bytes by deleting the least recently used files first.
+A cached file is checked against its hash before it's reused, unless it's unchanged (same size, mtime and inode)
+since it was last checked, and against the server's size and ETag when we can reach the server.
+vars.SHARED_CACHE_PATH can point at another machine's cache (on NFS, say). It's only read from:
+what we don't have, we copy from it (checking the hash) before going to the server.
+Several updaters can use the same cache: index.json is only read, changed and written back while holding index.lock,
+and files are put in objects/ under that lock too, so one updater's eviction never deletes a file another one just stored.
+'''
+import os
+import json
+import time
+import hashlib
+import contextlib
+import vars
+import telemetry
+import message as message
+
+# Format version of index.json. Bump it when the format changes.
+INDEX_VERSION = 1
+# Seconds after which a .part file left in objects/ is taken for a dead store. Younger ones may still be
+# written by another updater sharing the cache.
+PART_MAX_AGE = 60 * 60
+# Seconds to wait for another updater to let go of index.lock before giving up.
+INDEX_LOCK_TIMEOUT = 30
+# Seconds after which index.lock is taken for one left by an updater that died holding it. It's only held for moments.
+INDEX_LOCK_MAX_AGE = 120
+
+def get_key( name: str, version: str ) -> str:
+    '''
+    Key of a file in the index.
+    '''
+    return f'{name}@{version}'
+
+def get_object_path( cache_path: str, sha256: str ) -> str:
+    '''
+    Where a file with this hash is kept.
+    '''
+    return os.path.join( cache_path, 'objects', sha256[:2], sha256 )
+
+def load_index( cache_path: str ) -> dict:
+    '''
+    Entries of a cache's index.json. Empty if there's no index, or not one we understand.
+    '''
+    try:
+        with open( os.path.join( cache_path, 'index.json' ), 'r' ) as file:
+            index = json.load( file )
+        if index.get( 'format' ) == INDEX_VERSION:
+            return index['entries']
+    except FileNotFoundError:
+        pass
+    except Exception:
+        message.print_exception_error_dbg()
+    return {}
+
+def save_index( cache_path: str, entries: dict ) -> None:
+    '''
+    Write index.json, replacing the old one in one step.
+    '''
+    index_path = os.path.join( cache_path, 'index.json' )
+    with open( index_path + '.part', 'w' ) as file:
+        json.dump( { 'format': INDEX_VERSION, 'entries': entries }, file, indent=1 )
+    os.replace( index_path + '.part', index_path )
+
+@contextlib.contextmanager
+def lock_index( cache_path: str ):
+    '''
+    Hold index.lock of a cache, around reading, changing and writing back its index.json.
+    '''
+    os.makedirs( cache_path, exist_ok=True )
+    lock_path = os.path.join( cache_path, 'index.lock' )
+    deadline = time.monotonic() + INDEX_LOCK_TIMEOUT
+    while True:
+        try:
+            os.close( os.open( lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY ) )
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime( lock_path ) > INDEX_LOCK_MAX_AGE:
+                    os.remove( lock_path )
+                    continue
+            except FileNotFoundError:
+                # Let go of just now
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError( f'{lock_path} is held by another updater' )
+            time.sleep( 0.05 )
+    try:
+        yield
+    finally:
+        os.remove( lock_path )
+
+def get_part_path( object_path: str ) -> str:
+    '''
+    Where a file is written before it's put in objects/, unique to this process.
+    '''
+    return f'{object_path}.{os.getpid()}.part'
+
+def get_stat_key( path: str ) -> list:
+    '''
+    What tells us a file is unchanged since it was hashed.
+    '''
+    stat = os.stat( path )
+    return [ stat.st_size, stat.st_mtime_ns, stat.st_ino ]
+
+def copy_and_hash( source: str, dest: str ) -> str:
+    '''
+    Copy source to dest, hashing it on the way. Returns the SHA-256.
+    '''
+    sha256 = hashlib.sha256()
+    with open( source, 'rb' ) as source_file, open( dest, 'wb' ) as dest_file:
+        while chunk := source_file.read( 1024 * 1024 ):
+            sha256.update( chunk )
+            dest_file.write( chunk )
+    return sha256.hexdigest()
+
+def link_or_copy( source: str, dest: str ) -> None:
+    '''
+    Put a copy of source at dest, replacing whatever is there. Hardlinked when we can, the files are never written in place.
+    '''
+    import fileops
+    part_path = dest + '.part'
+    if os.path.exists( part_path ):
+        os.remove( part_path )
+    try:
+        os.link( source, part_path )
+    except OSError:
+        fileops.copy_file( source, part_path )
+    os.replace( part_path, dest )
+
+def get_remote_info( url: str ) -> tuple:
+    '''
+    Size and ETag of a file on the server, ( -1, '' ) if we couldn't ask.
+    '''
+    import net
+    try:
+        with net.head( url ) as response:
+            response.raise_for_status()
+            return int( response.headers.get( 'Content-Length', -1 ) ), response.headers.get( 'ETag', '' )
+    except Exception:
+        message.print_exception_error_dbg()
+        return -1, ''
+
+def is_current( entry: dict, url: str ) -> bool:
+    '''
+    False if the server has a different file than the cached one under the same name and version.
+    Also True if we couldn't ask, the cached file is still the one that was published for that version.
+    '''
+    if not url:
+        return True
+    size, etag = get_remote_info( url )
+    if size >= 0 and size != entry['size']:
+        return False
+    return not ( etag and entry['etag'] and etag != entry['etag'] )
+
+def check_object( entry: dict, object_path: str ) -> bool:
+    '''
+    Make sure a cached file is still what we stored. It's only hashed again if it changed on disk since the last check.
+    '''
+    import manifest
+    try:
+        stat_key = get_stat_key( object_path )
+    except FileNotFoundError:
+        return False
+    if stat_key[0] != entry['size']:
+        return False
+    if stat_key == entry.get( 'checked' ):
+        return True
+    if manifest.hash_file( object_path ) != entry['sha256']:
+        return False
+    entry['checked'] = stat_key
+    return True
+
+def copy_from_shared( key: str, cache_path: str, url: str ) -> dict:
+    '''
+    Copy a file from the shared cache into ours, checking its hash, and add it to our index. Returns its entry,
+    None if the shared cache doesn't have it, or has an outdated one.
+    '''
+    shared_entry = load_index( vars.SHARED_CACHE_PATH ).get( key )
+    if not shared_entry or shared_entry['size'] > vars.ARTIFACT_CACHE_SIZE or not is_current( shared_entry, url ):
+        return None
+    shared_path = get_object_path( vars.SHARED_CACHE_PATH, shared_entry['sha256'] )
+    object_path = get_object_path( cache_path, shared_entry['sha256'] )
+    part_path = get_part_path( object_path )
+    os.makedirs( os.path.dirname( object_path ), exist_ok=True )
+    try:
+        if copy_and_hash( shared_path, part_path ) != shared_entry['sha256']:
+            raise ValueError( f'{shared_path} doesn\'t match its hash' )
+        with lock_index( cache_path ):
+            os.replace( part_path, object_path )
+            entry = dict( shared_entry, checked=get_stat_key( object_path ) )
+            entries = load_index( cache_path )
+            entries[key] = entry
+            save_index( cache_path, entries )
+    except Exception:
+        message.print_exception_error_dbg()
+        if os.path.exists( part_path ):
+            os.remove( part_path )
+        return None
+    return entry
+
+def is_cached( name: str, version: str ) -> bool:
+    '''
+    True if our cache has name at version. It can still turn out damaged or outdated once it's fetched.
+    '''
+    return vars.ARTIFACT_CACHE and bool( version ) and get_key( name, version ) in load_index( vars.ARTIFACT_CACHE_PATH )
+
+def fetch( name: str, version: str, dest: str, url: str = None ) -> bool:
+    '''
+    Put the cached copy of name at version at dest, from our cache or from the shared one.
+    With url, the server is asked if its file is still the one we have.
+    False if there's no good copy, download it then.
+    '''
+    if not vars.ARTIFACT_CACHE or not version:
+        return False
+    cache_path = vars.ARTIFACT_CACHE_PATH
+    key = get_key( name, version )
+    with telemetry.phase( 'cache_fetch', file=name ) as phase:
+        try:
+            entry = load_index( cache_path ).get( key )
+            source = 'local'
+            if entry and not ( check_object( entry, get_object_path( cache_path, entry['sha256'] ) ) and is_current( entry, url ) ):
+                # Damaged or outdated, forget about it, unless it was replaced since
+                with lock_index( cache_path ):
+                    entries = load_index( cache_path )
+                    if entries.get( key, {} ).get( 'sha256' ) == entry['sha256']:
+                        del entries[key]
+                        remove_unused( cache_path, entries, entry['sha256'] )
+                        save_index( cache_path, entries )
+                entry = None
+            if not entry and vars.SHARED_CACHE_PATH and os.path.isdir( vars.SHARED_CACHE_PATH ):
+                entry = copy_from_shared( key, cache_path, url )
+                source = 'shared'
+            if not entry:
+                telemetry.note( hit=False )
+                return False
+            link_or_copy( get_object_path( cache_path, entry['sha256'] ), dest )
+            with lock_index( cache_path ):
+                entries = load_index( cache_path )
+                if entries.get( key, {} ).get( 'sha256' ) == entry['sha256']:
+                    entries[key] = dict( entry, last_used=time.time() )
+                evict( cache_path, entries, vars.ARTIFACT_CACHE_SIZE )
+                save_index( cache_path, entries )
+            telemetry.count( files=1, bytes=entry['size'] )
+            telemetry.note( hit=True, source=source )
+            print( f'Using the cached {name} ({entry["size"] / 1e6:.1f} MB).' )
+            return True
+        except Exception:
+            message.print_exception_error_dbg()
+            phase.ok = False
+            return False
+
+def store( name: str, version: str, path: str, url: str = None, move: bool = False ) -> bool:
+    '''
+    Keep a downloaded file as name at version. The file at path is moved into the cache with move,
+    otherwise it stays (hardlinked to the cached copy when it can be).
+    With url, the server's ETag is kept to tell if the file changes on the server later.
+    Never fails, the cache isn't worth failing a download over. True if it was stored.
+    '''
+    import manifest
+    if not vars.ARTIFACT_CACHE or not version or not os.path.exists( path ):
+        return False
+    size = os.path.getsize( path )
+    if size > vars.ARTIFACT_CACHE_SIZE:
+        return False
+    cache_path = vars.ARTIFACT_CACHE_PATH
+    part_path = None
+    try:
+        sha256 = manifest.hash_file( path )
+        etag = get_remote_info( url )[1] if url else ''
+        object_path = get_object_path( cache_path, sha256 )
+        os.makedirs( os.path.dirname( object_path ), exist_ok=True )
+        # Get it next to where it goes first, it's only put there holding the lock
+        part_path = get_part_path( object_path )
+        if move:
+            try:
+                os.replace( path, part_path )
+            except OSError:
+                link_or_copy( path, part_path )
+        else:
+            link_or_copy( path, part_path )
+        with lock_index( cache_path ):
+            if os.path.exists( object_path ):
+                os.remove( part_path )
+            else:
+                os.replace( part_path, object_path )
+            entries = load_index( cache_path )
+            entries[get_key( name, version )] = { 'name': name,
+                                                  'version': version,
+                                                  'sha256': sha256,
+                                                  'size': size,
+                                                  'etag': etag,
+                                                  'last_used': time.time(),
+                                                  'checked': get_stat_key( object_path ) }
+            evict( cache_path, entries, vars.ARTIFACT_CACHE_SIZE )
+            save_index( cache_path, entries )
+        if move and os.path.exists( path ):
+            os.remove( path )
+        return True
+    except Exception:
+        message.print_exception_error_dbg()
+        if part_path and os.path.exists( part_path ):
+            os.remove( part_path )
+        return False
+
+def remove_unused( cache_path: str, entries: dict, sha256: str ) -> None:
+    '''
+    Delete the file with this hash, unless another entry still uses it.
+    '''
+    if any( entry['sha256'] == sha256 for entry in entries.values() ):
+        return
+    object_path = get_object_path( cache_path, sha256 )
+    if os.path.exists( object_path ):
+        os.remove( object_path )
+
+def evict( cache_path: str, entries: dict, budget: int ) -> None:
+    '''
+    Forget the least recently used entries until the files left fit in budget bytes, and delete
+    the files no entry uses anymore (like ones left by an interrupted store, once they're PART_MAX_AGE old).
+    entries has to be what index.json has, read holding index.lock.
+    '''
+    sizes = {}
+    for entry in entries.values():
+        sizes[entry['sha256']] = entry['size']
+    for key in sorted( entries, key=lambda key: entries[key]['last_used'] ):
+        if sum( sizes.values() ) <= budget:
+            break
+        sha256 = entries.pop( key )['sha256']
+        if not any( entry['sha256'] == sha256 for entry in entries.values() ):
+            sizes.pop( sha256 )
+
+    objects_path = os.path.join( cache_path, 'objects' )
+    if not os.path.isdir( objects_path ):
+        return
+    for folder in os.scandir( objects_path ):
+        if not folder.is_dir():
+            continue
+        for file in os.scandir( folder.path ):
+            if file.name in sizes:
+                continue
+            try:
+                if file.name.endswith( '.part' ) and time.time() - file.stat().st_mtime < PART_MAX_AGE:
+                    continue
+                os.remove( file.path )
+            except FileNotFoundError:
+                # Another updater got to it first
+                pass
@@ -0,0 +1,98 @@
+'''
+Finding and deleting the temp files (.cache and .tmp) of an installed game.
+The game folder is walked with os.scandir on a pool of threads. Every job lists a batch of folders and
+hands the ones it didn't get to back to the pool, so big installs with lots of custom folders are walked
+several parts at a time.
+Folders that never hold temp files (vars.CLEANUP_SKIP_FOLDERS, like materials and models) are skipped
+wherever they are, they're most of the files of an install.
+Found files are deleted in batches on the same pool.
+'''
+import os
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import vars
+import message as message
+
+# Extensions of the temp files.
+TEMP_EXTENSIONS = ( '.cache', '.tmp' )
+
+@dataclass
+class CleanupResult:
+    files: int = 0 # Number of temp files found, or deleted
+    size: int = 0 # Their size in bytes
+
+def scan_folders( path: str, skip_folders: set ) -> tuple:
+    '''
+    Walk path and the folders under it until vars.CLEANUP_FOLDERS_PER_JOB folders are listed.
+    Returns the folders left to walk, and the temp files found as ( path, size ).
+    '''
+    to_scan = [ path ]
+    files = []
+    scanned = 0
+    while to_scan and scanned < vars.CLEANUP_FOLDERS_PER_JOB:
+        folder = to_scan.pop()
+        scanned += 1
+        try:
+            with os.scandir( folder ) as entries:
+                for entry in entries:
+                    if entry.is_dir( follow_symlinks=False ):
+                        if entry.name.lower() not in skip_folders:
+                            to_scan.append( entry.path )
+                    elif entry.name.endswith( TEMP_EXTENSIONS ):
+                        files.append( ( entry.path, entry.stat( follow_symlinks=False ).st_size ) )
+        except OSError:
+            # Can't list it (no permission, or it's gone), leave it be
+            message.print_exception_error_dbg()
+    return to_scan, files
+
+def find_temp_files( game_path: str, workers: int = None ) -> list:
+    '''
+    Every temp file under game_path as ( path, size ), walking workers parts of it at once (vars.CLEANUP_WORKERS by default).
+    '''
+    skip_folders = { folder.lower() for folder in vars.CLEANUP_SKIP_FOLDERS }
+    found = []
+    with ThreadPoolExecutor( max_workers=workers or vars.CLEANUP_WORKERS ) as pool:
+        pending = { pool.submit( scan_folders, game_path, skip_folders ) }
+        while pending:
+            done, pending = wait( pending, return_when=FIRST_COMPLETED )
+            for future in done:
+                folders, files = future.result()
+                found.extend( files )
+                # Whatever a job didn't get to is split between new ones
+                pending.update( pool.submit( scan_folders, folder, skip_folders ) for folder in folders )
+    return found
+
+def remove_batch( files: list ) -> CleanupResult:
+    '''
+    Delete a batch of ( path, size ) files. Files that are already gone or can't be deleted don't count.
+    '''
+    result = CleanupResult()
+    for path, size in files:
+        try:
+            os.remove( path )
+        except FileNotFoundError:
+            continue
+        except OSError:
+            # In use or read only, the rest can still go
+            message.print_exception_error_dbg()
+            continue
+        result.files += 1
+        result.size += size
+    return result
+
+def delete_temp_files( game_path: str, dry_run: bool = False, workers: int = None ) -> CleanupResult:
+    '''
+    Delete every temp file under game_path. With dry_run, nothing is deleted, only counted.
+    Returns how many files were (or would be) deleted and their size.
+    '''
+    files = find_temp_files( game_path, workers )
+    if dry_run:
+        return CleanupResult( len( files ), sum( size for _, size in files ) )
+
+    result = CleanupResult()
+    batches = [ files[start:start + vars.CLEANUP_BATCH_SIZE] for start in range( 0, len( files ), vars.CLEANUP_BATCH_SIZE ) ]
+    with ThreadPoolExecutor( max_workers=workers or vars.CLEANUP_WORKERS ) as pool:
+        for batch_result in pool.map( remove_batch, batches ):
+            result.files += batch_result.files
+            result.size += batch_result.size
+    return result
@@ -0,0 +1,187 @@
+'''
+Binary delta format for rebuilding a changed file (.vpk, .bsp, .so...) from the installed old version,
+so an update downloads only the bytes that actually changed.
+
+A delta file is a header followed by a zlib stream of operations:
+    header:  b'PF2DELTA', format version (1 byte), old size, new size (8 bytes each),
+             SHA-256 of the old file, SHA-256 of the new file (32 bytes each)
+    'C' + offset + length (8 bytes each):  copy length bytes of the old file starting at offset
+    'L' + length (8 bytes) + data:          write the data as-is
+All numbers are little endian.
+'''
+import os
+import mmap
+import zlib
+import struct
+import hashlib
+
+# Identifies a delta file.
+MAGIC = b'PF2DELTA'
+# Format version. Bump it when the format changes.
+FORMAT_VERSION = 1
+HEADER = struct.Struct( '<8sBQQ32s32s' )
+COPY = struct.Struct( '<cQQ' )
+LITERAL = struct.Struct( '<cQ' )
+# Modulus of the adler32 checksum.
+ADLER_MOD = 65521
+
+def roll_adler32( checksum: int, block_size: int, old_byte: int, new_byte: int ) -> int:
+    '''
+    Move an adler32 checksum of a block_size window one byte forward,
+    dropping old_byte from the start and adding new_byte to the end.
+    '''
+    a = checksum & 0xffff
+    b = checksum >> 16
+    a = ( a - old_byte + new_byte ) % ADLER_MOD
+    b = ( b - block_size * old_byte + a - 1 ) % ADLER_MOD
+    return ( b << 16 ) | a
+
+def make_delta( old_path: str, new_path: str, delta_path: str, block_size: int = 4096, max_ratio: float = 0.5 ) -> bool:
+    '''
+    Publishing side. Write the delta that turns old_path into new_path.
+    Works like rsync: the old file's blocks are indexed by a rolling checksum, and the new file is scanned for them.
+    Returns False (and writes nothing) if the delta would be bigger than max_ratio of the new file,
+    downloading the whole file is better then.
+    '''
+    new_size = os.path.getsize( new_path )
+    old_size = os.path.getsize( old_path )
+    if new_size == 0 or old_size < block_size:
+        return False
+
+    with open( old_path, 'rb' ) as old_file, open( new_path, 'rb' ) as new_file, \
+         mmap.mmap( old_file.fileno(), 0, access=mmap.ACCESS_READ ) as old, \
+         mmap.mmap( new_file.fileno(), 0, access=mmap.ACCESS_READ ) as new:
+        # Where each block of the old file is, by its checksum
+        blocks = {}
+        for offset in range( 0, old_size - block_size + 1, block_size ):
+            blocks.setdefault( zlib.adler32( old[offset:offset + block_size] ), offset )
+
+        operations = []
+        literal_size = 0
+        literal_start = 0
+        position = 0
+        checksum = None
+        while position + block_size <= new_size:
+            if checksum is None:
+                checksum = zlib.adler32( new[position:position + block_size] )
+            offset = blocks.get( checksum )
+            # Checksums can collide, compare the actual bytes
+            if offset is not None and old[offset:offset + block_size] == new[position:position + block_size]:
+                # Grow the match as far as it goes
+                length = block_size
+                while position + length < new_size and offset + length < old_size and \
+                      old[offset + length:offset + length + block_size] == new[position + length:position + length + block_size]:
+                    length += block_size
+                length = min( length, new_size - position, old_size - offset )
+                while position + length < new_size and offset + length < old_size and old[offset + length] == new[position + length]:
+                    length += 1
+                # Write whatever was before the match as-is
+                if literal_start < position:
+                    operations.append( ( b'L', literal_start, position ) )
+                    literal_size += position - literal_start
+                operations.append( ( b'C', offset, length ) )
+                position += length
+                literal_start = position
+                checksum = None
+            else:
+                # No match here, move one byte forward
+                if position + block_size < new_size:
+                    checksum = roll_adler32( checksum, block_size, new[position], new[position + block_size] )
+                position += 1
+                # Not worth it, stop early.
+                if position - literal_start + literal_size > new_size * max_ratio:
+                    return False
+        # Whatever is left at the end
+        if literal_start < new_size:
+            operations.append( ( b'L', literal_start, new_size ) )
+            literal_size += new_size - literal_start
+        if literal_size > new_size * max_ratio:
+            return False
+
+        # Write the delta file.
+        with open( delta_path, 'wb' ) as delta:
+            delta.write( HEADER.pack( MAGIC, FORMAT_VERSION, old_size, new_size,
+                                      hashlib.sha256( old ).digest(), hashlib.sha256( new ).digest() ) )
+            compressor = zlib.compressobj( 9 )
+            for kind, first, second in operations:
+                if kind == b'C':
+                    delta.write( compressor.compress( COPY.pack( kind, first, second ) ) )
+                else:
+                    delta.write( compressor.compress( LITERAL.pack( kind, second - first ) ) )
+                    delta.write( compressor.compress( new[first:second] ) )
+            delta.write( compressor.flush() )
+    return True
+
+class DeltaReader:
+    '''
+    Reads the decompressed operation stream of a delta file a bit at a time.
+    '''
+    def __init__( self, file ):
+        self.file = file
+        self.decompressor = zlib.decompressobj()
+        self.buffer = b''
+        self.position = 0
+
+    def read( self, size: int ) -> bytes:
+        '''
+        Read up to size bytes. Less only at the end of the stream.
+        '''
+        while len( self.buffer ) - self.position < size and not self.decompressor.eof:
+            data = self.decompressor.unconsumed_tail or self.file.read( 1024 * 1024 )
+            if not data:
+                break
+            # Keep what we haven't read yet and add the next piece
+            self.buffer = self.buffer[self.position:] + self.decompressor.decompress( data, 1024 * 1024 )
+            self.position = 0
+        result = self.buffer[self.position:self.position + size]
+        self.position += len( result )
+        return result
+
+def read_header( delta_path: str ) -> tuple:
+    '''
+    Read the header of a delta file: ( old size, new size, old SHA-256, new SHA-256 ) as hex strings for the hashes.
+    '''
+    with open( delta_path, 'rb' ) as delta:
+        magic, version, old_size, new_size, old_sha256, new_sha256 = HEADER.unpack( delta.read( HEADER.size ) )
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError( f'{delta_path} is not a delta file we understand' )
+    return old_size, new_size, old_sha256.hex(), new_sha256.hex()
+
+def apply_delta( old_path: str, delta_path: str, new_path: str ) -> str:
+    '''
+    Rebuild the new file at new_path from old_path and the delta.
+    Returns the SHA-256 of what was written, so the caller can check it against the file it expected.
+    '''
+    old_size, new_size, _, _ = read_header( delta_path )
+    if os.path.getsize( old_path ) != old_size:
+        raise ValueError( f'{old_path} is not the file this delta was made for' )
+
+    sha256 = hashlib.sha256()
+    with open( old_path, 'rb' ) as old, open( delta_path, 'rb' ) as delta_file, open( new_path, 'wb' ) as new:
+        delta_file.seek( HEADER.size )
+        reader = DeltaReader( delta_file )
+        while kind := reader.read( 1 ):
+            if kind == b'C':
+                offset, length = struct.unpack( '<QQ', reader.read( 16 ) )
+                old.seek( offset )
+                while length > 0:
+                    data = old.read( min( length, 1024 * 1024 ) )
+                    if not data:
+                        raise ValueError( 'Delta copies past the end of the old file' )
+                    sha256.update( data )
+                    new.write( data )
+                    length -= len( data )
+            elif kind == b'L':
+                length, = struct.unpack( '<Q', reader.read( 8 ) )
+                while length > 0:
+                    data = reader.read( min( length, 1024 * 1024 ) )
+                    if not data:
+                        raise ValueError( 'Delta ended early' )
+                    sha256.update( data )
+                    new.write( data )
+                    length -= len( data )
+            else:
+                raise ValueError( 'Corrupted delta file' )
+        if new.tell() != new_size:
+            raise ValueError( 'Delta made a file of the wrong size' )
+    return sha256.hexdigest()
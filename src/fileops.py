@@ -0,0 +1,146 @@
+'''
+Putting files from the staging folder into the game folder without copying their bytes when we can.
+The staging folder sits next to the game folder, so a file is usually put in place with a rename.
+When the staged file has to stay, it's reflinked (a copy-on-write clone), hardlinked if
+vars.APPLY_HARDLINKS is on, or copied inside the kernel with copy_file_range.
+The bytes only go through us when nothing else works, like across filesystems.
+Every file is swapped in with os.replace, so the game never has a half-written file.
+'''
+import os
+import errno
+from shutil import copyfileobj, copystat
+from platform import system
+from concurrent.futures import ThreadPoolExecutor
+if system() == 'Linux':
+    import fcntl
+import vars
+
+# ioctl that clones a file on copy-on-write filesystems (btrfs, XFS...) on Linux.
+FICLONE = 0x40049409
+
+# How a file was put in place.
+METHOD_RENAME = 'rename'
+METHOD_HARDLINK = 'hardlink'
+METHOD_REFLINK = 'reflink'
+METHOD_COPY_FILE_RANGE = 'copy_file_range'
+METHOD_COPY = 'copy'
+
+def reflink( source: str, dest: str ) -> bool:
+    '''
+    Clone source to dest sharing the same blocks on disk. False if the filesystem can't.
+    '''
+    if system() != 'Linux':
+        return False
+    try:
+        with open( source, 'rb' ) as source_file, open( dest, 'wb' ) as dest_file:
+            fcntl.ioctl( dest_file.fileno(), FICLONE, source_file.fileno() )
+        return True
+    except OSError:
+        return False
+
+def kernel_copy( source: str, dest: str ) -> bool:
+    '''
+    Copy source to dest with copy_file_range, so the data never comes up to us. False if it isn't supported here.
+    '''
+    if not hasattr( os, 'copy_file_range' ):
+        return False
+    try:
+        with open( source, 'rb' ) as source_file, open( dest, 'wb' ) as dest_file:
+            while os.copy_file_range( source_file.fileno(), dest_file.fileno(), 1 << 30 ):
+                pass
+        return True
+    except OSError:
+        return False
+
+def copy_file( source: str, dest: str ) -> str:
+    '''
+    Copy source to dest (and its timestamps and permissions) the cheapest way we can. Returns how it was done.
+    '''
+    if reflink( source, dest ):
+        method = METHOD_REFLINK
+    elif kernel_copy( source, dest ):
+        method = METHOD_COPY_FILE_RANGE
+    else:
+        with open( source, 'rb' ) as source_file, open( dest, 'wb' ) as dest_file:
+            copyfileobj( source_file, dest_file, 1024 * 1024 )
+        method = METHOD_COPY
+    copystat( source, dest )
+    return method
+
+def place_file( source: str, dest: str, keep_source: bool = False ) -> str:
+    '''
+    Put source at dest, replacing whatever is there in one step. The source is moved unless keep_source is set.
+    Returns how it was done.
+    '''
+    if not keep_source:
+        try:
+            os.replace( source, dest )
+            return METHOD_RENAME
+        except OSError as error:
+            # Different filesystems, copy it instead
+            if error.errno != errno.EXDEV:
+                raise
+
+    part_path = dest + '.part'
+    if os.path.exists( part_path ):
+        os.remove( part_path )
+    method = None
+    if keep_source and vars.APPLY_HARDLINKS:
+        try:
+            os.link( source, part_path )
+            method = METHOD_HARDLINK
+        except OSError:
+            pass
+    if not method:
+        method = copy_file( source, part_path )
+    os.replace( part_path, dest )
+
+    if not keep_source:
+        os.remove( source )
+    return method
+
+def place_tree( source: str, dest: str, keep_source: bool = False ) -> None:
+    '''
+    Put every file under source at the same place under dest. A whole folder is moved
+    with one rename when dest doesn't exist yet and the source doesn't have to stay.
+    '''
+    if not keep_source and not os.path.exists( dest ):
+        try:
+            os.replace( source, dest )
+            return
+        except OSError as error:
+            if error.errno != errno.EXDEV:
+                raise
+    for root, _, files in os.walk( source ):
+        target = os.path.join( dest, os.path.relpath( root, source ) )
+        os.makedirs( target, exist_ok=True )
+        for name in files:
+            place_file( os.path.join( root, name ), os.path.join( target, name ), keep_source )
+
+def fsync_file( path: str ) -> None:
+    '''
+    Flush a file (or on anything but Windows, a folder) to disk.
+    '''
+    if system() == 'Windows':
+        if os.path.isdir( path ):
+            return
+        # Windows only flushes files opened for writing
+        descriptor = os.open( path, os.O_RDWR | os.O_BINARY )
+    else:
+        descriptor = os.open( path, os.O_RDONLY )
+    try:
+        os.fsync( descriptor )
+    finally:
+        os.close( descriptor )
+
+def fsync_tree( path: str ) -> None:
+    '''
+    Flush every file and folder under path to disk, several at a time.
+    '''
+    paths = []
+    for root, _, files in os.walk( path ):
+        paths.extend( os.path.join( root, name ) for name in files )
+        paths.append( root )
+    with ThreadPoolExecutor( max_workers=vars.APPLY_WORKERS ) as pool:
+        for _ in pool.map( fsync_file, paths ):
+            pass
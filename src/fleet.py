@@ -0,0 +1,366 @@
+'''
+Headless mode for hosts with many installs of the game (dedicated servers, several clients...).
+python main.py <check|update|install|verify> <game folder> [<game folder>...]
+Whatever an update or an install needs is downloaded and extracted once into a shared staging folder,
+then applied to every target at once on vars.FLEET_WORKERS processes. Installs at the same version
+share every patch of their chain. Each target gets its own process because the updater keeps the game
+it works on in vars. Its output goes to a log in the work folder, and one line per target is printed at the end.
+Exit codes: 0 everything went fine (for check, every target is up to date), 1 a target failed,
+2 bad arguments, 3 (check only) a target needs an update or an install.
+'''
+import os
+import json
+import time
+import shutil
+import argparse
+import contextlib
+from dataclasses import dataclass, asdict
+from concurrent.futures import ProcessPoolExecutor
+import vars
+import util
+import planner
+import telemetry
+import message as message
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_OUTDATED = 3
+
+# Status of a target.
+STATUS_UP_TO_DATE = 'up to date'
+STATUS_OUTDATED = 'out of date'
+STATUS_INTERRUPTED = 'update interrupted'
+STATUS_NOT_INSTALLED = 'not installed'
+STATUS_UPDATED = 'updated'
+STATUS_INSTALLED = 'installed'
+STATUS_VERIFIED = 'verified'
+STATUS_DAMAGED = 'damaged'
+STATUS_FAILED = 'failed'
+
+@dataclass
+class TargetResult:
+    path: str # Game folder
+    status: str = STATUS_FAILED
+    ok: bool = False
+    old_version: str = '' # Version before we started
+    new_version: str = '' # Version after we were done
+    seconds: float = 0.0
+    detail: str = '' # Why it failed, or what's wrong with it
+
+def get_settings() -> dict:
+    '''
+    Every setting in vars, to send to the worker processes (they don't get changes made at runtime otherwise).
+    '''
+    return { name: value for name, value in vars.__dict__.items() if name.isupper() and isinstance( value, ( str, int, float, bool, tuple ) ) }
+
+def get_work_path( work_path: str, game_path: str ) -> str:
+    '''
+    Folder of a target under the work folder, where its downloads go and its log is written.
+    '''
+    name = os.path.abspath( game_path ).strip( os.sep ).replace( os.sep, '_' ).replace( ':', '' )
+    return os.path.join( work_path, 'targets', name )
+
+def apply_target( command: str, game_path: str, work_path: str, settings: dict ) -> TargetResult:
+    '''
+    Worker process: run command ('update' to apply the staged update, 'full' to update from the staged full build,
+    'install' to install the staged build, 'continue' to continue an interrupted update) on one target, with its output in work_path/fleet.log
+    '''
+    for name, value in settings.items():
+        setattr( vars, name, value )
+    vars.GAME_PATH = game_path
+    os.makedirs( work_path, exist_ok=True )
+    os.chdir( work_path )
+
+    result = TargetResult( game_path, old_version=vars.LOCAL_VERSION_STRING )
+    start = time.perf_counter()
+    with open( 'fleet.log', 'a' ) as log, contextlib.redirect_stdout( log ), contextlib.redirect_stderr( log ):
+        try:
+            with telemetry.phase( 'fleet_' + command, target=game_path ) as phase:
+                if command == 'update':
+                    result.ok = util.update()
+                elif command == 'full':
+                    result.ok = util.update_from_build()
+                elif command == 'install':
+                    result.ok = util.install_build()
+                else:
+                    result.ok = util.continue_update()
+                phase.ok = result.ok
+        except Exception:
+            message.print_exception_error_dbg()
+    result.seconds = time.perf_counter() - start
+    if result.ok:
+        result.status = STATUS_UPDATED if command != 'install' else STATUS_INSTALLED
+        result.new_version = check_target( game_path ).old_version
+    else:
+        result.detail = f'see {os.path.join( work_path, "fleet.log" )}'
+    return result
+
+def check_target( game_path: str ) -> TargetResult:
+    '''
+    Installed version of a target, and whether it needs an update. vars.SERVER_VERSION_STRING has to be set.
+    '''
+    vars.GAME_PATH = game_path
+    result = TargetResult( game_path, STATUS_NOT_INSTALLED )
+    if not util.check_game_installation():
+        return result
+    result.old_version = result.new_version = util.check_game_version()
+    if util.recover_update():
+        result.status = STATUS_INTERRUPTED
+    elif util.get_local_version_num() < util.get_server_version_num():
+        result.status = STATUS_OUTDATED
+    else:
+        result.status = STATUS_UP_TO_DATE
+        result.ok = True
+    return result
+
+def run_on_targets( command: str, targets: list, work_path: str, workers: int ) -> list:
+    '''
+    Run apply_target on every target, at most workers at once. targets are ( game path, installed version ).
+    '''
+    if not targets:
+        return []
+    settings = get_settings()
+    jobs = []
+    with ProcessPoolExecutor( max_workers=min( workers, len( targets ) ) ) as pool:
+        for game_path, version in targets:
+            target_settings = dict( settings, LOCAL_VERSION_STRING=version )
+            jobs.append( pool.submit( apply_target, command, game_path, get_work_path( work_path, game_path ), target_settings ) )
+    return [ job.result() for job in jobs ]
+
+def stage_hop( hop: planner.Hop, game_path: str, latest_version: str, hop_path: str ) -> bool:
+    '''
+    Download what one patch needs into hop_path/staging, and its list of changed files into hop_path.
+    game_path is one of the targets at hop.old_version, the binary deltas are applied to its files.
+    '''
+    vars.GAME_PATH = game_path
+    vars.LOCAL_VERSION_STRING = hop.old_version
+    vars.SERVER_VERSION_STRING = hop.new_version
+    vars.STAGING_PATH = os.path.join( hop_path, 'staging' )
+    os.makedirs( hop_path, exist_ok=True )
+    os.chdir( hop_path )
+    print( f'Downloading the update from {hop.old_version} to {hop.new_version}...' )
+    return util.download_update( hop.index or None, hop.new_version == latest_version ) and util.download_changes() is not None
+
+def update_group( version: str, paths: list, latest_version: str, patch_index: planner.PatchIndex, work_path: str, workers: int ) -> list:
+    '''
+    Update every target at the same version, downloading each patch once for all of them.
+    If the full build is cheaper, it's downloaded once and each of them is updated from it file by file.
+    '''
+    results = { path: TargetResult( path, old_version=version ) for path in paths }
+    hops = planner.plan( patch_index, version, latest_version ) if patch_index else [ planner.Hop( version, latest_version, 0 ) ]
+    group_path = os.path.join( work_path, version )
+
+    if hops is None:
+        print( f'Downloading the full build for {len( paths )} installs at {version}...' )
+        vars.GAME_PATH = paths[0]
+        vars.STAGING_PATH = os.path.join( group_path, 'staging' )
+        os.makedirs( group_path, exist_ok=True )
+        os.chdir( group_path )
+        if util.download_build():
+            for result in run_on_targets( 'full', [ ( path, version ) for path in paths ], work_path, workers ):
+                results[result.path] = result
+            util.delete_folder_if_exists( vars.STAGING_PATH )
+        else:
+            for result in results.values():
+                result.detail = 'couldn\'t download the full build'
+        return list( results.values() )
+
+    pending = list( paths )
+    for hop in hops:
+        hop_path = os.path.join( group_path, f'{hop.old_version}-{hop.new_version}' )
+        if not stage_hop( hop, pending[0], latest_version, hop_path ):
+            for path in pending:
+                results[path].status = STATUS_FAILED
+                results[path].ok = False
+                results[path].detail = f'couldn\'t download the update from {hop.old_version} to {hop.new_version}'
+            break
+        # Every target starts from its own copy of the list of changed files, update() deletes it when done
+        changes_files = [ name for name in ( util.get_patch_name().replace( '.patch', '.manifest.json' ), util.get_patch_name() ) if os.path.exists( name ) ]
+        for path in pending:
+            target_path = get_work_path( work_path, path )
+            os.makedirs( target_path, exist_ok=True )
+            for name in changes_files:
+                shutil.copyfile( name, os.path.join( target_path, name ) )
+        vars.SERVER_VERSION_STRING = hop.new_version
+        hop_results = run_on_targets( 'update', [ ( path, hop.old_version ) for path in pending ], work_path, workers )
+        util.delete_folder_if_exists( vars.STAGING_PATH )
+        for result in hop_results:
+            result.old_version = version
+            result.seconds += results[result.path].seconds
+            results[result.path] = result
+        # Targets that failed stop here, the rest go on with the next patch
+        pending = [ result.path for result in hop_results if result.ok ]
+        if not pending:
+            break
+    return list( results.values() )
+
+def check_all( paths: list, work_path: str, workers: int ) -> list:
+    '''
+    Installed version of every target, and whether it needs an update.
+    '''
+    return [ check_target( path ) for path in paths ]
+
+def update_all( paths: list, work_path: str, workers: int ) -> list:
+    '''
+    Update every target to the server's version. Interrupted updates are continued on their own.
+    '''
+    latest_version = vars.SERVER_VERSION_STRING
+    results = [ check_target( path ) for path in paths ]
+    for result in results:
+        if result.status == STATUS_UP_TO_DATE:
+            result.new_version = result.old_version
+        elif result.status == STATUS_NOT_INSTALLED:
+            result.detail = 'install it first'
+
+    interrupted = [ ( result.path, result.old_version ) for result in results if result.status == STATUS_INTERRUPTED ]
+    finished = { result.path: result for result in run_on_targets( 'continue', interrupted, work_path, workers ) }
+
+    # Targets at the same version share their downloads
+    groups = {}
+    for result in results:
+        if result.status == STATUS_OUTDATED:
+            groups.setdefault( result.old_version, [] ).append( result.path )
+    patch_index = util.fetch_patch_index() if groups else None
+    for version, group_paths in groups.items():
+        for result in update_group( version, group_paths, latest_version, patch_index, work_path, workers ):
+            finished[result.path] = result
+        vars.SERVER_VERSION_STRING = latest_version
+    return [ finished.get( result.path, result ) for result in results ]
+
+def install_all( paths: list, work_path: str, workers: int, force: bool = False ) -> list:
+    '''
+    Install the latest build in every target that doesn't have the game, or in all of them with force.
+    The build is downloaded and extracted once.
+    '''
+    results = [ check_target( path ) for path in paths ]
+    to_install = [ result.path for result in results if force or result.status == STATUS_NOT_INSTALLED ]
+    for result in results:
+        if result.path not in to_install:
+            result.ok = True
+            result.detail = 'already installed'
+    if not to_install:
+        return results
+
+    print( f'Downloading the full build for {len( to_install )} installs...' )
+    vars.GAME_PATH = to_install[0]
+    vars.STAGING_PATH = os.path.join( work_path, 'staging' )
+    os.chdir( work_path )
+    if not util.download_build():
+        for result in results:
+            if result.path in to_install:
+                result.detail = 'couldn\'t download the full build'
+        return results
+    vars.LOCAL_VERSION_STRING = ''
+    finished = { result.path: result for result in run_on_targets( 'install', [ ( path, '' ) for path in to_install ], work_path, workers ) }
+    util.delete_folder_if_exists( vars.STAGING_PATH )
+    return [ finished.get( result.path, result ) for result in results ]
+
+def verify_all( paths: list, work_path: str, workers: int ) -> list:
+    '''
+    Check every file of every target against the latest build. The targets are checked one after another,
+    each one already hashes its files on every core.
+    '''
+    import verify
+    os.chdir( work_path )
+    build = util.fetch_build_manifest()
+    results = [ check_target( path ) for path in paths ]
+    for result in results:
+        if result.status != STATUS_UP_TO_DATE:
+            result.ok = False
+            result.detail = 'update it first'
+            continue
+        if not build:
+            result.ok = False
+            result.status = STATUS_FAILED
+            result.detail = 'couldn\'t download the list of files of the latest build'
+            continue
+        start = time.perf_counter()
+        checked = verify.verify( build, result.path )
+        result.seconds = time.perf_counter() - start
+        result.ok = checked.ok
+        result.status = STATUS_VERIFIED if checked.ok else STATUS_DAMAGED
+        if not checked.ok:
+            result.detail = f'{len( checked.missing )} missing, {len( checked.damaged )} damaged files'
+    return results
+
+def get_exit_code( command: str, results: list ) -> int:
+    '''
+    Exit code for the results of a command.
+    '''
+    if command == 'check':
+        if any( result.status == STATUS_INTERRUPTED or result.status == STATUS_OUTDATED or result.status == STATUS_NOT_INSTALLED for result in results ):
+            return EXIT_OUTDATED
+    return EXIT_OK if all( result.ok for result in results ) else EXIT_FAILED
+
+# Commands that take ( paths, work folder, workers ). install has its own arguments.
+COMMANDS = { 'check': check_all, 'update': update_all, 'verify': verify_all }
+
+def main( argv: list ) -> int:
+    '''
+    Run a command on the targets given on the command line. Returns the exit code.
+    '''
+    parser = argparse.ArgumentParser( prog='main.py', description='Check, update, install or verify many installs of Pre-Fortress 2 at once.' )
+    parser.add_argument( 'command', choices=( 'check', 'update', 'install', 'verify' ) )
+    parser.add_argument( 'targets', nargs='*', help='Game folders (like .../sourcemods/pf2)' )
+    parser.add_argument( '--targets-file', help='File with one game folder per line' )
+    parser.add_argument( '--workers', type=int, default=vars.FLEET_WORKERS, help='Targets updated or installed at once' )
+    parser.add_argument( '--work', default=vars.FLEET_WORK_PATH, help='Folder for the shared downloads and the logs of each target' )
+    parser.add_argument( '--force', action='store_true', help='install: reinstall targets that already have the game' )
+    parser.add_argument( '--json', action='store_true', help='Print the results as JSON' )
+    try:
+        args = parser.parse_args( argv )
+    except SystemExit as error:
+        return EXIT_USAGE if error.code else EXIT_OK
+
+    paths = list( args.targets )
+    if args.targets_file:
+        with open( args.targets_file, 'r' ) as file:
+            paths += [ line.strip() for line in file if line.strip() and not line.startswith( '#' ) ]
+    paths = list( dict.fromkeys( os.path.abspath( path ) for path in paths ) )
+    if not paths or args.workers < 1:
+        parser.print_usage()
+        return EXIT_USAGE
+
+    work_path = os.path.abspath( args.work )
+    # Only a work folder we made is deleted afterwards
+    made_work_path = not os.path.exists( work_path )
+    os.makedirs( work_path, exist_ok=True )
+    old_path = os.getcwd()
+    # Put back afterwards, for whatever else runs in this process
+    keep_old_build, keep_staging, staging_path, game_path = vars.KEEP_OLD_BUILD, vars.KEEP_STAGING, vars.STAGING_PATH, vars.GAME_PATH
+    # The staging folder is shared, nothing may be moved out of it
+    vars.KEEP_STAGING = True
+    # The worker processes don't delete pf2.old in the background, it's deleted below
+    vars.KEEP_OLD_BUILD = True
+    try:
+        vars.SERVER_VERSION_STRING = util.check_server_version()
+        if not vars.SERVER_VERSION_STRING:
+            print( 'Couldn\'t get the latest version from the server.' )
+            results = [ TargetResult( path, detail='couldn\'t reach the server' ) for path in paths ]
+        elif args.command == 'install':
+            results = install_all( paths, work_path, args.workers, args.force )
+        else:
+            results = COMMANDS[args.command]( paths, work_path, args.workers )
+
+        if not keep_old_build:
+            for result in results:
+                if result.ok and result.status in ( STATUS_UPDATED, STATUS_INSTALLED ):
+                    vars.GAME_PATH = result.path
+                    util.delete_folder_if_exists( util.get_sibling_path( '.old' ) )
+    finally:
+        os.chdir( old_path )
+        vars.KEEP_OLD_BUILD, vars.KEEP_STAGING, vars.STAGING_PATH, vars.GAME_PATH = keep_old_build, keep_staging, staging_path, game_path
+    # Keep the logs of the targets that failed
+    if made_work_path and not any( not result.ok and os.path.exists( os.path.join( get_work_path( work_path, result.path ), 'fleet.log' ) ) for result in results ):
+        util.delete_folder_if_exists( work_path )
+
+    if args.json:
+        print( json.dumps( { 'command': args.command, 'server_version': vars.SERVER_VERSION_STRING,
+                             'targets': [ asdict( result ) for result in results ] }, indent=1 ) )
+    else:
+        for result in results:
+            versions = f'{result.old_version} -> {result.new_version}' if result.old_version and result.new_version != result.old_version else result.new_version or result.old_version
+            print( f'{result.path}: {result.status}{" (" + versions + ")" if versions else ""}'
+                   f'{f" in {result.seconds:.1f}s" if result.seconds else ""}{": " + result.detail if result.detail else ""}' )
+    return get_exit_code( args.command, results )
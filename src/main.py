@@ -2,6 +2,7 @@
 Updater for Pre-Fortress 2. Windows and Linux compatible.
 '''
 import os
+import sys
 import message as message
 import vars
 from vars import UpdateCode
@@ -11,8 +12,7 @@ def download_game():
     '''
     Download and extract the game.
     '''
-    util.download()
-    util.extract()
+    util.download_build()
 
 def install_game():
     '''
@@ -21,30 +21,34 @@ def install_game():
     download_game()
     util.install()
 
-def update_game( continue_update : bool = False ) -> None:
+def update_game( continue_update : bool = False, chosen: 'planner.Estimate' = None ) -> None:
     '''
-    Download and update the game.
+    Download and update the game, the way util.preflight_update() chose if it was already asked.
     '''
-    download_game()
-
-    # If we were interrupted, pass the update file to the continue_update function
+    # If we were interrupted, pass the update file to the continue_update function.
+    # It downloads whatever is missing.
     if continue_update:
         util.continue_update()
     else:
-    # Else update normally.
-        util.update()
+    # Else update normally, through as many patches as it takes.
+        util.update_to_latest( chosen=chosen )
 
 def cleanup() -> None:
     '''
     Function to clean up some files after we're done with them
     '''
     if not vars.DEBUG:
-        util.delete_folder_if_exists( os.path.join( vars.TEMP_PATH, 'pf2_new' ) ) 
+        util.delete_folder_if_exists( util.get_staging_path() )
         util.delete_file_if_exists( os.path.join( vars.TEMP_PATH, vars.FILE_NAME ) )
     
     util.delete_all_temp_files()
 
 def main() -> None:
+    # Headless mode, for hosts with many installs: main.py <check|update|install|verify> <game folders...>
+    if len( sys.argv ) > 1:
+        import fleet
+        sys.exit( fleet.main( sys.argv[1:] ) )
+
     # set up the sourcemod path global var
     util.setup_game_path()
 
@@ -53,6 +57,9 @@ def main() -> None:
                                         'Check for updates',
                                         'Install the game',
                                         'Clear cache files',
+                                        'Restore the previous build',
+                                        'Verify the game files',
+                                        'Repair the game files',
                                         'Exit' )
         match result:
             case 1: # Check for updates.
@@ -67,9 +74,13 @@ def main() -> None:
                         # Game is out of date. Ask if the user wants to update.
                         print( f'Current version: {vars.LOCAL_VERSION_STRING}' )
                         print( f'Latest version: {vars.SERVER_VERSION_STRING}' )
-                        if message.message_yes_no( 'Your game is out of date! Do you wish to update?' ):
+                        # Say what the update costs first, and don't offer it if there's no room for it
+                        chosen = util.preflight_update( util.fetch_patch_index() )
+                        if not chosen:
+                            print( 'Going back to the main menu.' )
+                        elif message.message_yes_no( 'Your game is out of date! Do you wish to update?' ):
                             # Update the game!
-                            update_game()
+                            update_game( chosen=chosen )
                         else:
                             # Go back to the main menu if the user says no
                             print( 'Okay. Going back to the main menu.' )
@@ -79,14 +90,34 @@ def main() -> None:
             case 2: # Install the game
                 install_game()
             case 3:
-                # Delete all temp files in the installed game.
-                util.delete_all_temp_files()
+                # Show what there is to delete, then delete all temp files in the installed game.
+                result = util.delete_all_temp_files( dry_run=True )
+                if result and result.files and message.message_yes_no( 'Delete them?' ):
+                    util.delete_all_temp_files()
             case 4:
+                # Go back to the build from before the last install
+                if util.rollback_install():
+                    print( 'The previous build was restored.' )
+            case 5:
+                # Hash every file against the latest build
+                result = util.verify_game()
+                if result and result.ok:
+                    print( 'Every file is okay.' )
+            case 6:
+                # Download and replace only the files that are missing or damaged
+                if util.repair_game():
+                    print( 'Your game is repaired.' )
+            case 7:
                 break
             case default:
                 print( 'Invalid option! Try again.' )
                 
 
 if __name__ == "__main__":
+    # Needed for the verify processes in a PyInstaller build.
+    # multiprocessing is only loaded then, it slows down starting otherwise.
+    if getattr( sys, 'frozen', False ):
+        from multiprocessing import freeze_support
+        freeze_support()
     main()
    
\ No newline at end of file
@@ -0,0 +1,112 @@
+'''
+Update manifests: the list of files an update touches, with what happens to each of them,
+its size and its SHA-256. Replaces reading the same information out of the unified diff patches.
+
+A manifest is JSON:
+    { "format": 1, "from": "0.7.2", "to": "0.7.3",
+      "files": [ [ "bin/client.so", "M", 1234, "<sha256>" ], [ "cfg/old.cfg", "D", 0, "" ], ... ] }
+Paths are relative to the game folder with / separators. The operation is M (modified), A (added) or D (removed).
+A manifest of a full build has no "from" and lists every file as added.
+'''
+import os
+import json
+import hashlib
+import filecmp
+from dataclasses import dataclass, field
+
+# Format version of the manifest. Bump it when the format changes.
+FORMAT_VERSION = 1
+
+# Operations, numbered like in the update file.
+OP_MODIFIED = 0
+OP_REMOVED = 1
+OP_ADDED = 2
+# How each operation is written in a manifest.
+OPERATION_CODES = { 'M': OP_MODIFIED, 'D': OP_REMOVED, 'A': OP_ADDED }
+OPERATION_LETTERS = { number: letter for letter, number in OPERATION_CODES.items() }
+
+@dataclass
+class FileChange:
+    path: str # Path relative to the game folder, with / separators
+    operation: int # OP_MODIFIED, OP_REMOVED or OP_ADDED
+    size: int = 0 # Size in the new build, 0 if removed or unknown
+    sha256: str = '' # SHA-256 in the new build, empty if removed or unknown
+
+@dataclass
+class Manifest:
+    old_version: str # Version we're updating from, empty for a full build
+    new_version: str # Version we're updating to
+    files: list = field( default_factory=list ) # FileChange of every file
+
+    def get( self, operation: int ) -> list:
+        '''
+        Every file with this operation, in manifest order.
+        '''
+        return [ change for change in self.files if change.operation == operation ]
+
+def hash_file( path: str ) -> str:
+    '''
+    SHA-256 of a file as a hex string.
+    '''
+    sha256 = hashlib.sha256()
+    with open( path, 'rb' ) as file:
+        while chunk := file.read( 1024 * 1024 ):
+            sha256.update( chunk )
+    return sha256.hexdigest()
+
+def list_files( build_path: str ) -> list:
+    '''
+    Every file in a build as a path relative to it with / separators, sorted.
+    '''
+    result = []
+    for root, _, files in os.walk( build_path ):
+        for name in files:
+            result.append( os.path.relpath( os.path.join( root, name ), build_path ).replace( os.sep, '/' ) )
+    return sorted( result )
+
+def make_manifest( old_build: str, new_build: str, old_version: str, new_version: str ) -> Manifest:
+    '''
+    Publishing side. Compare two game folders (the pf2 folders of two builds) and list what changed.
+    Without an old build, make the manifest of the full new build.
+    '''
+    result = Manifest( old_version if old_build else '', new_version )
+    new_files = list_files( new_build )
+    old_files = set( list_files( old_build ) ) if old_build else set()
+
+    for path in new_files:
+        new_path = os.path.join( new_build, *path.split( '/' ) )
+        if path in old_files:
+            # Unchanged files aren't in the manifest
+            if filecmp.cmp( os.path.join( old_build, *path.split( '/' ) ), new_path, shallow=False ):
+                continue
+            operation = OP_MODIFIED
+        else:
+            operation = OP_ADDED
+        result.files.append( FileChange( path, operation, os.path.getsize( new_path ), hash_file( new_path ) ) )
+
+    for path in sorted( old_files.difference( new_files ) ):
+        result.files.append( FileChange( path, OP_REMOVED ) )
+    return result
+
+def save_manifest( manifest: Manifest, path: str ) -> None:
+    '''
+    Write a manifest to disk.
+    '''
+    data = { 'format': FORMAT_VERSION,
+             'to': manifest.new_version,
+             'files': [ [ change.path, OPERATION_LETTERS[change.operation], change.size, change.sha256 ] for change in manifest.files ] }
+    if manifest.old_version:
+        data['from'] = manifest.old_version
+    with open( path, 'w' ) as file:
+        json.dump( data, file, separators=( ',', ':' ) )
+
+def load_manifest( path: str ) -> Manifest:
+    '''
+    Read a manifest from disk.
+    '''
+    with open( path, 'r' ) as file:
+        data = json.load( file )
+    if data.get( 'format' ) != FORMAT_VERSION:
+        raise ValueError( f'{path} is not a manifest we understand' )
+    return Manifest( data.get( 'from', '' ), data['to'],
+                     [ FileChange( path, OPERATION_CODES[operation], size, sha256 ) for path, operation, size, sha256 in data['files'] ] )
@@ -0,0 +1,408 @@
+'''
+Shared HTTP client used for every network call in the updater.
+One session keeps connections alive per host, with timeouts and retries configured in vars.py
+Also has the resumable (and multi-connection) download used for the game tarball and patches.
+'''
+import os
+import json
+import time
+import queue
+import random
+import threading
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tqdm import tqdm
+import vars
+import telemetry
+import message as message
+
+# The session every request goes through. Created on first use by get_session()
+_session = None
+
+class JitterRetry( Retry ):
+    '''
+    Retry policy that adds a random jitter on top of the exponential backoff,
+    so a bunch of clients failing at the same time don't all hammer the server again at once.
+    '''
+    def get_backoff_time( self ) -> float:
+        backoff = super().get_backoff_time()
+        # No backoff yet (first retry), don't sleep
+        if backoff <= 0:
+            return 0
+        return backoff + random.uniform( 0, vars.HTTP_BACKOFF_JITTER )
+
+    def increment( self, *args, **kwargs ) -> Retry:
+        # Every request that's tried again counts as a retry of the phase we're in
+        telemetry.count( retries=1 )
+        return super().increment( *args, **kwargs )
+
+def make_retry() -> Retry:
+    '''
+    Build the retry policy from the settings in vars.py.
+    '''
+    return JitterRetry( total=vars.HTTP_RETRIES,
+                        connect=vars.HTTP_RETRIES,
+                        read=vars.HTTP_RETRIES,
+                        status=vars.HTTP_RETRIES,
+                        backoff_factor=vars.HTTP_BACKOFF_FACTOR,
+                        status_forcelist=( 429, 500, 502, 503, 504 ),
+                        allowed_methods=frozenset( [ 'GET', 'HEAD' ] ),
+                        respect_retry_after_header=True,
+                        raise_on_status=False )
+
+def get_session() -> requests.Session:
+    '''
+    Get the shared session, creating it the first time.
+    Every host we talk to gets its own connection pool that is kept alive between requests.
+    '''
+    global _session
+    if _session is None:
+        session = requests.Session()
+        session.headers.update( { 'User-Agent': vars.HTTP_USER_AGENT } )
+        # One adapter (and so one pool) per host we download from
+        for host_url in vars.HTTP_HOSTS:
+            session.mount( host_url, HTTPAdapter( pool_connections=1,
+                                                  pool_maxsize=vars.HTTP_POOL_SIZE,
+                                                  max_retries=make_retry() ) )
+        # Anything else still gets the retry policy
+        for scheme in ( 'https://', 'http://' ):
+            session.mount( scheme, HTTPAdapter( pool_connections=len( vars.HTTP_HOSTS ),
+                                                pool_maxsize=vars.HTTP_POOL_SIZE,
+                                                max_retries=make_retry() ) )
+        _session = session
+    return _session
+
+def close_session() -> None:
+    '''
+    Close every pooled connection. The next request opens a new session.
+    '''
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+
+def get( url: str, stream: bool = False, headers: dict = None ) -> requests.Response:
+    '''
+    GET a URL through the shared session with the configured timeouts.
+    '''
+    return get_session().get( url, stream=stream, headers=headers,
+                              timeout=( vars.HTTP_CONNECT_TIMEOUT, vars.HTTP_READ_TIMEOUT ) )
+
+def head( url: str, headers: dict = None ) -> requests.Response:
+    '''
+    HEAD a URL through the shared session with the configured timeouts.
+    '''
+    return get_session().head( url, headers=headers, allow_redirects=True,
+                               timeout=( vars.HTTP_CONNECT_TIMEOUT, vars.HTTP_READ_TIMEOUT ) )
+
+def read_sidecar( sidecar_path: str ) -> dict:
+    '''
+    Read the sidecar of a partial download. Returns None if there's no usable sidecar.
+    '''
+    try:
+        with open( sidecar_path, 'r' ) as file:
+            return json.load( file )
+    except Exception:
+        return None
+
+def write_sidecar( sidecar_path: str, url: str, response: requests.Response, total_size: int ) -> None:
+    '''
+    Write the sidecar of a partial download, holding the validators we need to resume it safely.
+    '''
+    # Weak ETags can't be used in If-Range, only strong ones.
+    etag = response.headers.get( 'ETag', '' )
+    if etag.startswith( 'W/' ):
+        etag = ''
+    with open( sidecar_path, 'w' ) as file:
+        json.dump( { 'url': url,
+                     'etag': etag,
+                     'last_modified': response.headers.get( 'Last-Modified', '' ),
+                     'total_size': total_size }, file )
+
+def delete_partial( part_path: str ) -> None:
+    '''
+    Throw away a partial download and its sidecar.
+    '''
+    for path in ( part_path, part_path + '.json' ):
+        if os.path.exists( path ):
+            os.remove( path )
+
+def get_total_size( response: requests.Response ) -> int:
+    '''
+    Get the full size of a file from a response, whether it's a full (200) or partial (206) one.
+    -1 if the server didn't tell us.
+    '''
+    # Partial responses look like "Content-Range: bytes 100-999/1000"
+    content_range = response.headers.get( 'Content-Range', '' )
+    if '/' in content_range and not content_range.endswith( '*' ):
+        return int( content_range.rpartition( '/' )[2] )
+    if response.status_code == 200 and 'Content-Length' in response.headers:
+        return int( response.headers['Content-Length'] )
+    return -1
+
+def download_file( url: str, path: str ) -> bool:
+    '''
+    Download a file to path, resuming a previous partial download if there is one.
+    The data goes to path.part with a path.part.json sidecar holding the server's validator (ETag/Last-Modified),
+    so an interrupted download continues with a Range request from the last byte we got instead of starting over.
+    True only once the whole file has been downloaded and its length matches what the server said.
+    '''
+    part_path = path + '.part'
+    sidecar_path = part_path + '.json'
+
+    for attempt in range( vars.HTTP_RETRIES + 1 ):
+        # Figure out where we're continuing from.
+        sidecar = read_sidecar( sidecar_path )
+        offset = 0
+        # Ranges and lengths count the file's bytes as they are on the server, don't let it compress them on the way
+        headers = { 'Accept-Encoding': 'identity' }
+        # (a sidecar with segments belongs to download_segmented, it can't be continued here)
+        if sidecar and sidecar['url'] == url and 'segments' not in sidecar and os.path.exists( part_path ):
+            offset = os.path.getsize( part_path )
+            validator = sidecar['etag'] or sidecar['last_modified']
+            # Without a validator we can't know if the file changed on the server, start over.
+            if offset > 0 and validator:
+                # If-Range makes the server send the whole file (200) if it changed since
+                headers['Range'] = f'bytes={offset}-'
+                headers['If-Range'] = validator
+            else:
+                offset = 0
+
+        try:
+            with get( url, stream=True, headers=headers ) as response:
+                if response.status_code == 416:
+                    # We already have the whole thing.
+                    if offset == sidecar['total_size']:
+                        break
+                    # Our partial file is bigger than the file on the server, throw it away.
+                    delete_partial( part_path )
+                    continue
+                response.raise_for_status()
+
+                if response.status_code == 206:
+                    # Make sure the server is continuing from where we asked it to, otherwise start over.
+                    if not response.headers.get( 'Content-Range', '' ).startswith( f'bytes {offset}-' ):
+                        delete_partial( part_path )
+                        continue
+                    total_size = sidecar['total_size']
+                    mode = 'ab'
+                else:
+                    # Full response, the file changed or the server doesn't do ranges. Start from zero.
+                    offset = 0
+                    total_size = get_total_size( response )
+                    write_sidecar( sidecar_path, url, response, total_size )
+                    mode = 'wb'
+
+                # show a progress bar to the console using tqdm.
+                with open( part_path, mode ) as handle, tqdm( desc=f'Downloading {os.path.basename( path )}',
+                                                              total=total_size if total_size >= 0 else None,
+                                                              initial=offset,
+                                                              unit='iB',
+                                                              unit_scale=True ) as bar:
+                    # Write to the disk.
+                    for chunk in response.iter_content( chunk_size=vars.DOWNLOAD_CHUNK_SIZE ):
+                        size = handle.write( chunk )
+                        bar.update( size )
+                        telemetry.count( downloaded=size )
+            # Did we get everything?
+            if total_size < 0 or os.path.getsize( part_path ) == total_size:
+                break
+        # The connection dropped, timed out, etc... Try again from where we stopped.
+        except ( requests.exceptions.ConnectionError,
+                 requests.exceptions.ChunkedEncodingError,
+                 requests.exceptions.ContentDecodingError,
+                 requests.exceptions.Timeout ):
+            message.print_exception_error_dbg()
+        if attempt < vars.HTTP_RETRIES:
+            print( f'Download interrupted, resuming... ({attempt + 1}/{vars.HTTP_RETRIES})' )
+            telemetry.count( retries=1 )
+    else:
+        # Ran out of attempts.
+        return False
+
+    # Check the final length against what the server told us before calling this a success.
+    sidecar = read_sidecar( sidecar_path )
+    if sidecar and sidecar['total_size'] >= 0 and os.path.getsize( part_path ) != sidecar['total_size']:
+        return False
+
+    # Done, move the finished file into place.
+    os.replace( part_path, path )
+    os.remove( sidecar_path )
+    return True
+
+def download_segmented( url: str, path: str ) -> bool:
+    '''
+    Download a file over several connections at once, each fetching its own byte ranges.
+    The file is preallocated as path.part and every range is written at its offset, reading into
+    reused buffers (readinto) instead of making a new bytes object per chunk.
+    Progress on every range is kept in the path.part.json sidecar so an interrupted download resumes.
+    Falls back to download_file if the server can't do ranges or the file is small.
+    '''
+    part_path = path + '.part'
+    sidecar_path = part_path + '.json'
+
+    # Ask the server about the file first.
+    with head( url, headers={ 'Accept-Encoding': 'identity' } ) as response:
+        # Some servers don't like HEAD, just download it normally then.
+        if not response.ok:
+            return download_file( url, path )
+        total_size = int( response.headers.get( 'Content-Length', -1 ) )
+        etag = response.headers.get( 'ETag', '' )
+        last_modified = response.headers.get( 'Last-Modified', '' )
+        accepts_ranges = response.headers.get( 'Accept-Ranges', '' ) == 'bytes'
+    # We need a strong validator so all of the connections are sure to get the same file.
+    validator = etag if not etag.startswith( 'W/' ) else last_modified
+    if not accepts_ranges or not validator or total_size < vars.DOWNLOAD_SEGMENTED_MIN_SIZE or vars.DOWNLOAD_CONNECTIONS <= 1:
+        return download_file( url, path )
+
+    # Continue from the sidecar if it's for this exact file, otherwise start over.
+    sidecar = read_sidecar( sidecar_path )
+    if not sidecar or sidecar['url'] != url or sidecar.get( 'validator' ) != validator or \
+       sidecar['total_size'] != total_size or not os.path.exists( part_path ):
+        # Split the file into more segments than connections so a slow connection doesn't hold everything up.
+        segment_size = max( total_size // ( vars.DOWNLOAD_CONNECTIONS * 4 ) + 1, vars.DOWNLOAD_SEGMENT_MIN_SIZE )
+        # Each segment is [ next byte to download, last byte of the segment ]
+        segments = [ [ start, min( start + segment_size, total_size ) - 1 ] for start in range( 0, total_size, segment_size ) ]
+        sidecar = { 'url': url, 'validator': validator, 'total_size': total_size, 'segments': segments }
+        # Preallocate the file.
+        with open( part_path, 'wb' ) as file:
+            file.truncate( total_size )
+    segments = sidecar['segments']
+
+    def save_progress() -> None:
+        with open( sidecar_path, 'w' ) as file:
+            json.dump( sidecar, file )
+    save_progress()
+
+    # Hand out the segments that are not done yet.
+    pending = queue.SimpleQueue()
+    for segment in segments:
+        if segment[0] <= segment[1]:
+            pending.put( segment )
+    # Set if the file changed on the server while downloading, or a segment ran out of retries.
+    failed = threading.Event()
+
+    def fetch_segments() -> None:
+        # Each connection reuses one buffer for all of its reads.
+        buffer = bytearray( vars.DOWNLOAD_BUFFER_MAX )
+        view = memoryview( buffer )
+        chunk_size = vars.DOWNLOAD_CHUNK_SIZE
+        with open( part_path, 'r+b', buffering=0 ) as handle:
+            while not failed.is_set():
+                try:
+                    segment = pending.get_nowait()
+                except queue.Empty:
+                    return
+                for attempt in range( vars.HTTP_RETRIES + 1 ):
+                    try:
+                        headers = { 'Range': f'bytes={segment[0]}-{segment[1]}', 'If-Range': validator,
+                                    'Accept-Encoding': 'identity' }
+                        with get( url, stream=True, headers=headers ) as response:
+                            # A full response means the file changed on the server.
+                            if response.status_code != 206:
+                                failed.set()
+                                return
+                            handle.seek( segment[0] )
+                            while segment[0] <= segment[1] and not failed.is_set():
+                                started = time.perf_counter()
+                                size = response.raw.readinto( view[:min( chunk_size, segment[1] - segment[0] + 1 )] )
+                                if not size:
+                                    raise requests.exceptions.ChunkedEncodingError( 'Connection closed early' )
+                                handle.write( view[:size] )
+                                segment[0] += size
+                                telemetry.count( downloaded=size )
+                                # Grow the reads while the data arrives quickly, shrink them if it gets slow
+                                # so progress stays smooth.
+                                elapsed = time.perf_counter() - started
+                                if size == chunk_size and elapsed < 0.05:
+                                    chunk_size = min( chunk_size * 2, vars.DOWNLOAD_BUFFER_MAX )
+                                elif elapsed > 0.5:
+                                    chunk_size = max( chunk_size // 2, vars.DOWNLOAD_CHUNK_SIZE )
+                        break
+                    except ( requests.exceptions.ConnectionError,
+                             requests.exceptions.ChunkedEncodingError,
+                             requests.exceptions.Timeout,
+                             urllib3.exceptions.HTTPError ):
+                        message.print_exception_error_dbg()
+                        telemetry.count( retries=1 )
+                else:
+                    # Ran out of attempts for this segment.
+                    failed.set()
+
+    workers = [ threading.Thread( target=fetch_segments, daemon=True ) for _ in range( vars.DOWNLOAD_CONNECTIONS ) ]
+    for worker in workers:
+        worker.start()
+
+    # Redraw the progress bar on a timer instead of on every chunk, and save our progress while we're at it.
+    def downloaded() -> int:
+        return total_size - sum( segment[1] - segment[0] + 1 for segment in segments )
+    with tqdm( desc=f'Downloading {os.path.basename( path )}', total=total_size, initial=downloaded(),
+               unit='iB', unit_scale=True ) as bar:
+        while any( worker.is_alive() for worker in workers ):
+            time.sleep( vars.PROGRESS_INTERVAL )
+            bar.update( downloaded() - bar.n )
+            save_progress()
+        bar.update( downloaded() - bar.n )
+    save_progress()
+
+    # Did every segment finish?
+    if failed.is_set() or downloaded() != total_size:
+        return False
+
+    # Done, move the finished file into place.
+    os.replace( part_path, path )
+    os.remove( sidecar_path )
+    return True
+
+def download( url: str, path: str ) -> bool:
+    '''
+    Download a file with the best method available, resuming if a previous download was interrupted.
+    '''
+    return download_segmented( url, path )
+
+def iter_download( url: str ):
+    '''
+    Generator that yields the body of a file in chunks as it downloads, for consumers that don't need it on disk.
+    If the connection drops, it reconnects and continues from the last byte with a Range request,
+    so the consumer sees one uninterrupted stream.
+    '''
+    offset = 0
+    validator = ''
+    total_size = -1
+    for attempt in range( vars.HTTP_RETRIES + 1 ):
+        # Ranges count the file's bytes as they are on the server, don't let it compress them on the way
+        headers = { 'Accept-Encoding': 'identity' }
+        if offset > 0:
+            # We need a validator to be sure we're continuing the same file.
+            if not validator:
+                break
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = validator
+        try:
+            with get( url, stream=True, headers=headers ) as response:
+                response.raise_for_status()
+                if offset > 0:
+                    # The file changed on the server (or it can't do ranges), we can't continue it.
+                    if response.status_code != 206 or not response.headers.get( 'Content-Range', '' ).startswith( f'bytes {offset}-' ):
+                        break
+                else:
+                    total_size = get_total_size( response )
+                    etag = response.headers.get( 'ETag', '' )
+                    validator = etag if not etag.startswith( 'W/' ) else response.headers.get( 'Last-Modified', '' )
+                for chunk in response.iter_content( chunk_size=vars.DOWNLOAD_CHUNK_SIZE ):
+                    offset += len( chunk )
+                    telemetry.count( downloaded=len( chunk ) )
+                    yield chunk
+            # Did we get everything?
+            if total_size < 0 or offset == total_size:
+                return
+        # The connection dropped, timed out, etc... Try again from where we stopped.
+        except ( requests.exceptions.ConnectionError,
+                 requests.exceptions.ChunkedEncodingError,
+                 requests.exceptions.Timeout ):
+            message.print_exception_error_dbg()
+            if attempt < vars.HTTP_RETRIES:
+                telemetry.count( retries=1 )
+    raise requests.exceptions.ConnectionError( f'Couldn\'t finish downloading {url}' )
@@ -0,0 +1,265 @@
+'''
+Member index of the latest build, so an update can download only the files it needs.
+The server publishes latest.pack, every file of the build stored one after another (each one either
+as-is or as its own zlib stream), and latest.index.json listing each file's path, offset, size and hash.
+The updater then fetches just the changed files with HTTP Range requests.
+An uncompressed latest.tar can be indexed too, since its files are also stored as-is at known offsets.
+'''
+import os
+import zlib
+import hashlib
+import tarfile
+from shutil import copyfileobj
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import vars
+import net
+import telemetry
+import message as message
+
+# Compression types a member can be stored with.
+COMPRESSION_NONE = 'none'
+COMPRESSION_ZLIB = 'zlib'
+
+# Format version of the index. Bump it when the format changes.
+INDEX_VERSION = 1
+
+def make_pack( build_path: str, pack_path: str, version: str ) -> dict:
+    '''
+    Publishing side. Pack every file under build_path (the folder holding pf2/) into pack_path
+    and return its index. Files are zlib compressed on their own if that makes them smaller.
+    '''
+    members = []
+    with open( pack_path, 'wb' ) as pack:
+        for root, dirs, files in os.walk( build_path ):
+            # Keep the order stable between runs
+            dirs.sort()
+            for name in sorted( files ):
+                full_path = os.path.join( root, name )
+                offset = pack.tell()
+                sha256 = hashlib.sha256()
+                # Try compressing it first.
+                compressor = zlib.compressobj( 9 )
+                with open( full_path, 'rb' ) as file:
+                    while chunk := file.read( 1024 * 1024 ):
+                        sha256.update( chunk )
+                        pack.write( compressor.compress( chunk ) )
+                pack.write( compressor.flush() )
+                length = os.path.getsize( full_path )
+                compression = COMPRESSION_ZLIB
+                # It didn't get smaller, store it as-is instead.
+                if pack.tell() - offset >= length:
+                    pack.seek( offset )
+                    pack.truncate()
+                    with open( full_path, 'rb' ) as file:
+                        copyfileobj( file, pack )
+                    compression = COMPRESSION_NONE
+                members.append( { 'path': os.path.relpath( full_path, build_path ).replace( os.sep, '/' ),
+                                  'offset': offset,
+                                  'size': pack.tell() - offset,
+                                  'length': length,
+                                  'sha256': sha256.hexdigest(),
+                                  'compression': compression } )
+    return { 'format': INDEX_VERSION,
+             'version': version,
+             'pack': os.path.basename( pack_path ),
+             'pack_size': os.path.getsize( pack_path ),
+             'members': members }
+
+def make_tar_index( tar_path: str, version: str ) -> dict:
+    '''
+    Publishing side. Index an uncompressed tar file, whose files are stored as-is.
+    '''
+    members = []
+    with tarfile.open( tar_path, 'r:' ) as file:
+        for member in file:
+            if not member.isfile():
+                continue
+            sha256 = hashlib.sha256()
+            with file.extractfile( member ) as data:
+                while chunk := data.read( 1024 * 1024 ):
+                    sha256.update( chunk )
+            members.append( { 'path': member.name,
+                              'offset': member.offset_data,
+                              'size': member.size,
+                              'length': member.size,
+                              'sha256': sha256.hexdigest(),
+                              'compression': COMPRESSION_NONE } )
+    return { 'format': INDEX_VERSION,
+             'version': version,
+             'pack': os.path.basename( tar_path ),
+             'pack_size': os.path.getsize( tar_path ),
+             'members': members }
+
+def fetch_index( url: str = None ) -> dict:
+    '''
+    Download the index of the latest build. None if the server doesn't have one we understand.
+    '''
+    try:
+        with net.get( url or vars.WEBSITE_URL + vars.INDEX_FILE_NAME ) as response:
+            response.raise_for_status()
+            index = response.json()
+        if index.get( 'format' ) != INDEX_VERSION:
+            return None
+        return index
+    except Exception:
+        message.print_exception_error_dbg()
+        return None
+
+def group_members( members: list ) -> list:
+    '''
+    Group members that are close together in the pack, so they can be fetched with one Range request.
+    '''
+    groups = []
+    for member in sorted( members, key=lambda member: member['offset'] ):
+        if groups:
+            last_group = groups[-1]
+            last = last_group[-1]
+            group_size = last['offset'] + last['size'] - last_group[0]['offset']
+            # Close enough to the previous member, and the group isn't too big yet
+            if member['offset'] - ( last['offset'] + last['size'] ) <= vars.RANGE_MERGE_GAP and \
+               group_size < vars.RANGE_GROUP_MAX_SIZE:
+                last_group.append( member )
+                continue
+        groups.append( [ member ] )
+    return groups
+
+def read_exactly( response: requests.Response, size: int, buffer: memoryview ):
+    '''
+    Yield exactly size bytes of a response body, in pieces of the buffer.
+    '''
+    while size > 0:
+        read = response.raw.readinto( buffer[:min( size, len( buffer ) )] )
+        if not read:
+            raise requests.exceptions.ChunkedEncodingError( 'Connection closed early' )
+        size -= read
+        telemetry.count( downloaded=read )
+        yield buffer[:read]
+
+def fetch_group( pack_url: str, group: list, dest_path: str ) -> int:
+    '''
+    Fetch a group of members with a single Range request, writing each one to dest_path/<member path>.
+    Every file is checked against its hash before it's moved into place.
+    Returns the number of bytes downloaded.
+    '''
+    start = group[0]['offset']
+    end = group[-1]['offset'] + group[-1]['size'] - 1
+    buffer = memoryview( bytearray( vars.DOWNLOAD_CHUNK_SIZE ) )
+
+    for attempt in range( vars.HTTP_RETRIES + 1 ):
+        try:
+            with net.get( pack_url, stream=True, headers={ 'Range': f'bytes={start}-{end}', 'Accept-Encoding': 'identity' } ) as response:
+                response.raise_for_status()
+                # The server must send exactly what we asked for.
+                if response.status_code != 206 or not response.headers.get( 'Content-Range', '' ).startswith( f'bytes {start}-{end}/' ):
+                    raise requests.exceptions.ContentDecodingError( 'Server ignored the Range request' )
+                position = start
+                for member in group:
+                    # Skip whatever is between this member and the last one
+                    for _ in read_exactly( response, member['offset'] - position, buffer ):
+                        pass
+                    install_path = os.path.join( dest_path, *member['path'].split( '/' ) )
+                    os.makedirs( os.path.dirname( install_path ), exist_ok=True )
+                    part_path = install_path + '.part'
+                    sha256 = hashlib.sha256()
+                    decompressor = zlib.decompressobj() if member['compression'] == COMPRESSION_ZLIB else None
+                    with open( part_path, 'wb' ) as file:
+                        for piece in read_exactly( response, member['size'], buffer ):
+                            if decompressor:
+                                piece = decompressor.decompress( piece )
+                            sha256.update( piece )
+                            file.write( piece )
+                        if decompressor:
+                            piece = decompressor.flush()
+                            sha256.update( piece )
+                            file.write( piece )
+                        written = file.tell()
+                    # Make sure we got the right file before putting it in place
+                    if sha256.hexdigest() != member['sha256']:
+                        os.remove( part_path )
+                        raise ValueError( f'Hash mismatch for {member["path"]}' )
+                    os.replace( part_path, install_path )
+                    telemetry.count( files=1, bytes=written )
+                    position = member['offset'] + member['size']
+            return end - start + 1
+        except ( requests.exceptions.ConnectionError,
+                 requests.exceptions.ChunkedEncodingError,
+                 requests.exceptions.Timeout ):
+            # Try the group again
+            message.print_exception_error_dbg()
+            telemetry.count( retries=1 )
+    raise requests.exceptions.ConnectionError( f'Ran out of retries fetching {pack_url}' )
+
+def is_wanted( path: str, wanted: set ) -> bool:
+    '''
+    True if path or one of the folders it's in is in wanted.
+    '''
+    while path:
+        if path in wanted:
+            return True
+        path = path.rpartition( '/' )[0]
+    return False
+
+def is_fetched( member: dict, path: str ) -> bool:
+    '''
+    True if the file at path is already this member, left by an interrupted fetch.
+    Its size and hash are checked, the folder can hold files of another version (from a repair, or another patch).
+    '''
+    try:
+        if os.path.getsize( path ) != member['length']:
+            return False
+        sha256 = hashlib.sha256()
+        with open( path, 'rb' ) as file:
+            while chunk := file.read( 1024 * 1024 ):
+                sha256.update( chunk )
+        return sha256.hexdigest() == member['sha256']
+    except FileNotFoundError:
+        return False
+
+def get_missing( index: dict, paths: list ) -> list:
+    '''
+    The paths that are neither a file of the index nor a folder with files in it.
+    '''
+    found = set()
+    for member in index['members']:
+        path = member['path']
+        while path and path not in found:
+            found.add( path )
+            path = path.rpartition( '/' )[0]
+    return [ path for path in paths if path not in found ]
+
+def fetch_members( index: dict, paths: list, dest_path: str ) -> bool:
+    '''
+    Download only the files in paths (as they're named in the index, like pf2/bin/client.so)
+    into dest_path, with Range requests on the pack.
+    A path can be a folder, then every file under it is fetched.
+    False if a path isn't in the index, or something went wrong. True if every file was fetched.
+    '''
+    missing = get_missing( index, paths )
+    if missing:
+        print( f'{len( missing )} changed files aren\'t on the server, like {missing[0]}.' )
+        return False
+    wanted = set( paths )
+    # Skip the files an interrupted fetch already got, the others are fetched again over them.
+    members = [ member for member in index['members'] if is_wanted( member['path'], wanted ) and
+                not is_fetched( member, os.path.join( dest_path, *member['path'].split( '/' ) ) ) ]
+    pack_url = vars.WEBSITE_URL + index['pack']
+    # Empty files have nothing to download.
+    for member in [ member for member in members if member['size'] == 0 ]:
+        install_path = os.path.join( dest_path, *member['path'].split( '/' ) )
+        os.makedirs( os.path.dirname( install_path ), exist_ok=True )
+        open( install_path, 'wb' ).close()
+    members = [ member for member in members if member['size'] > 0 ]
+    total_size = sum( member['size'] for member in members )
+    print( f'Fetching {len( members )} changed files ({total_size / 1e6:.1f} MB of {index["pack_size"] / 1e6:.1f} MB)...' )
+
+    success = False
+    try:
+        # Fetch groups on several connections at once.
+        with ThreadPoolExecutor( max_workers=vars.DOWNLOAD_CONNECTIONS ) as pool:
+            downloaded = sum( pool.map( lambda group: fetch_group( pack_url, group, dest_path ), group_members( members ) ) )
+        print( f'Downloaded {downloaded / 1e6:.1f} MB.' )
+        success = True
+    except Exception:
+        message.print_exception_error_dbg()
+    return success
@@ -0,0 +1,137 @@
+'''
+Header-only scanner for the unified diff patches (diff -ruN between two game folders).
+Instead of reading the patch line by line, one regex runs over its bytes and only stops at
+file headers: "diff ..." followed by the ---, +++ and first @@ lines, "Binary files ... differ"
+and "Only in ...". Hunk bodies are never looked at, their lines start with ' ', '+', '-' or '\\'
+so they can't be mistaken for a header.
+Files are classified like unidiff does: added if the old side is /dev/null or the only hunk starts at
+line 0 with 0 lines, removed the same way for the new side, and modified otherwise.
+The result can be cached as a small index keyed by the patch's hash.
+'''
+import os
+import re
+import json
+import mmap
+import manifest
+import message as message
+
+# Format version of the cached index. Bump it when the format changes.
+INDEX_VERSION = 1
+
+DEV_NULL = b'/dev/null'
+
+# A file's header: "diff" followed by the ---, +++ and first @@ lines, "Binary files ... differ" or "Only in".
+HEADER_PATTERN = ( rb'(?:diff [^\n]*\n'
+                   rb'--- (?P<source>[^\t\n]+)[^\n]*\n'
+                   rb'\+\+\+ (?P<target>[^\t\n]+)[^\n]*\n'
+                   rb'@@ -(?P<source_start>\d+)(?:,(?P<source_length>\d+))? \+(?P<target_start>\d+)(?:,(?P<target_length>\d+))? @@'
+                   rb'|Binary files (?P<binary_source>[^\t\n]+?)(?:\t[^\n]*?)? and (?P<binary_target>[^\t\n]+?)(?:\t[^\n]*?)? differ\r?$'
+                   rb'|Only in (?P<only_folder>[^\n]+?): (?P<only_name>[^\r\n]+))' )
+# Headers after a newline. Starting with a plain character lets the regex engine skip ahead quickly,
+# unlike ^ which it would try at every byte.
+HEADER = re.compile( rb'\n' + HEADER_PATTERN, re.MULTILINE )
+# A header on the very first line.
+FIRST_HEADER = re.compile( HEADER_PATTERN, re.MULTILINE )
+
+def decode_path( path: bytes ) -> str:
+    '''
+    A path from the patch as a string.
+    '''
+    return path.rstrip( b'\r' ).decode( 'utf-8', 'surrogateescape' )
+
+def get_root( path: bytes ) -> bytes:
+    '''
+    First folder of a path in the patch (pf2_0.7.2/pf2/bin/client.so -> pf2_0.7.2)
+    '''
+    return path.partition( b'/' )[0]
+
+def scan_patch( patch_path: str ) -> list:
+    '''
+    Every file a patch touches as ( path, operation ), in the order they're in the patch.
+    Paths are as written in the patch, like pf2_0.7.3/pf2/bin/client.so.
+    "Only in" lines are removed files if they're in the old folder and added files if they're in the new one.
+    They can name a whole folder.
+    '''
+    if os.path.getsize( patch_path ) == 0:
+        return []
+
+    result = []
+    # "Only in" lines, sorted out once we know which folder is the old one: ( result index, folder, path )
+    only_in = []
+    old_root = None
+    new_root = None
+    with open( patch_path, 'rb' ) as file, mmap.mmap( file.fileno(), 0, access=mmap.ACCESS_READ ) as data:
+        first = FIRST_HEADER.match( data )
+        for match in ( [ first ] if first else [] ) + list( HEADER.finditer( data ) ):
+            if match['source']:
+                source = match['source'].rstrip( b'\r' )
+                target = match['target'].rstrip( b'\r' )
+                if source == DEV_NULL or ( match['source_start'] == b'0' and match['source_length'] == b'0' ):
+                    operation = manifest.OP_ADDED
+                elif target == DEV_NULL or ( match['target_start'] == b'0' and match['target_length'] == b'0' ):
+                    operation = manifest.OP_REMOVED
+                else:
+                    operation = manifest.OP_MODIFIED
+                # The new side's path unless it's gone, like unidiff
+                path = source if target == DEV_NULL else target
+                if source != DEV_NULL and target != DEV_NULL:
+                    old_root, new_root = get_root( source ), get_root( target )
+                result.append( ( decode_path( path ), operation ) )
+            elif match['binary_source']:
+                target = match['binary_target']
+                old_root, new_root = get_root( match['binary_source'] ), get_root( target )
+                result.append( ( decode_path( target ), manifest.OP_MODIFIED ) )
+            else:
+                only_in.append( ( len( result ), match['only_folder'], match['only_name'] ) )
+                result.append( None )
+
+    for position, folder, name in only_in:
+        root = get_root( folder )
+        if root == new_root:
+            result[position] = ( decode_path( folder + b'/' + name ), manifest.OP_ADDED )
+        elif root == old_root:
+            result[position] = ( decode_path( folder + b'/' + name ), manifest.OP_REMOVED )
+    # Without any other header we can't tell which folder is which, leave those out.
+    return [ entry for entry in result if entry ]
+
+def load_index( index_path: str, sha256: str ) -> list:
+    '''
+    Read a cached scan. None if there's none for a patch with this hash.
+    '''
+    try:
+        with open( index_path, 'r' ) as file:
+            data = json.load( file )
+        if data.get( 'format' ) != INDEX_VERSION or data.get( 'sha256' ) != sha256:
+            return None
+        return [ ( path, manifest.OPERATION_CODES[operation] ) for path, operation in data['files'] ]
+    except FileNotFoundError:
+        return None
+    except Exception:
+        message.print_exception_error_dbg()
+        return None
+
+def save_index( index_path: str, sha256: str, files: list ) -> None:
+    '''
+    Cache a scan of the patch with this hash.
+    '''
+    with open( index_path + '.part', 'w' ) as file:
+        json.dump( { 'format': INDEX_VERSION,
+                     'sha256': sha256,
+                     'files': [ [ path, manifest.OPERATION_LETTERS[operation] ] for path, operation in files ] },
+                   file, separators=( ',', ':' ) )
+    os.replace( index_path + '.part', index_path )
+
+def scan_patch_cached( patch_path: str, index_path: str ) -> list:
+    '''
+    scan_patch, but read from the index at index_path if it was made from the same patch.
+    '''
+    sha256 = manifest.hash_file( patch_path )
+    files = load_index( index_path, sha256 )
+    if files is None:
+        files = scan_patch( patch_path )
+        try:
+            save_index( index_path, sha256, files )
+        except Exception:
+            # We just scan it again next time
+            message.print_exception_error_dbg()
+    return files
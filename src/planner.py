@@ -0,0 +1,115 @@
+'''
+Picking the cheapest way to update from one version to another.
+The server lists the patches it has, and what each one costs to download, in patches.json:
+    { "format": 1, "full_size": 4000000000,
+      "patches": [ { "from": "0.7.1", "to": "0.7.2", "size": 300000000, "index": "hops/0.7.1-0.7.2.index.json" }, ... ] }
+"size" is the bytes a patch downloads, "index" the member index (see pack.py) of the pack holding the files
+it changes, relative to the download server. "full_size" is what downloading the full build costs.
+Versions are the nodes of a graph (0.7-HOTFIX is a node of its own) and patches are its edges, so the
+cheapest chain of patches is a shortest path, found with Dijkstra's algorithm.
+Before updating, each way of doing it (a strategy) gets an Estimate of what it downloads, puts on disk and writes,
+and the one that should finish first is picked with choose().
+'''
+import heapq
+from dataclasses import dataclass, field
+
+# Format version of patches.json. Bump it when the format changes.
+FORMAT_VERSION = 1
+
+# Ways to update.
+STRATEGY_PATCHES = 'patches' # Through the chain of patches in patches.json
+STRATEGY_PARTIAL = 'partial' # Only the changed files, with Range requests on the latest build's pack
+STRATEGY_ARCHIVE = 'archive' # Only the changed files, taken out of the latest build's tar file
+STRATEGY_FULL = 'full' # The whole latest build, compared with the game and applied file by file
+
+@dataclass
+class Hop:
+    old_version: str # Version this patch updates from
+    new_version: str # Version this patch updates to
+    size: int # Bytes it downloads
+    index: str = '' # Member index of its pack on the download server, empty to use the latest build's
+
+@dataclass
+class PatchIndex:
+    full_size: int # Bytes the full build downloads
+    hops: list = field( default_factory=list ) # Hop of every patch
+
+@dataclass
+class Throughput:
+    download: float # Bytes downloaded per second
+    extract: float # Bytes decompressed out of a tar file per second
+    write: float # Bytes written into the game per second
+
+@dataclass
+class Estimate:
+    strategy: str # One of the STRATEGY_* above
+    download: int = 0 # Bytes downloaded
+    staging: int = 0 # Bytes in the staging folder at most
+    saved: int = 0 # Bytes of downloads kept on disk in the working folder (the tar file)
+    cached: int = 0 # Bytes of downloads stored in the artifact cache
+    write: int = 0 # Bytes written into the game
+    extract: int = 0 # Bytes decompressed out of the tar file, written or not
+    hops: list = None # Hops of STRATEGY_PATCHES
+    seconds: float = 0.0 # How long it should take, set by choose()
+
+def parse_patch_index( data: dict ) -> PatchIndex:
+    '''
+    Read the contents of patches.json.
+    '''
+    if data.get( 'format' ) != FORMAT_VERSION:
+        raise ValueError( 'Not a list of patches we understand' )
+    return PatchIndex( data['full_size'],
+                       [ Hop( patch['from'], patch['to'], patch['size'], patch.get( 'index', '' ) ) for patch in data['patches'] ] )
+
+def plan( patch_index: PatchIndex, old_version: str, new_version: str ) -> list:
+    '''
+    The cheapest chain of Hops from old_version to new_version.
+    None if downloading the full build is cheaper, or no chain of patches gets there.
+    '''
+    if old_version == new_version:
+        return []
+
+    edges = {}
+    for hop in patch_index.hops:
+        edges.setdefault( hop.old_version, [] ).append( hop )
+
+    # Cheapest known cost to each version, and the hop that got there
+    costs = { old_version: 0 }
+    came_from = {}
+    queue = [ ( 0, old_version ) ]
+    while queue:
+        cost, version = heapq.heappop( queue )
+        if version == new_version:
+            break
+        # Already reached this version for less
+        if cost > costs[version]:
+            continue
+        for hop in edges.get( version, [] ):
+            new_cost = cost + hop.size
+            if new_cost < costs.get( hop.new_version, new_cost + 1 ):
+                costs[hop.new_version] = new_cost
+                came_from[hop.new_version] = hop
+                heapq.heappush( queue, ( new_cost, hop.new_version ) )
+
+    if new_version not in costs or costs[new_version] >= patch_index.full_size:
+        return None
+
+    # Walk back from the new version
+    hops = []
+    version = new_version
+    while version != old_version:
+        hop = came_from[version]
+        hops.append( hop )
+        version = hop.old_version
+    hops.reverse()
+    return hops
+
+def choose( estimates: list, throughput: Throughput ) -> Estimate:
+    '''
+    The estimate that should finish first, the one downloading less (then the first one) on a tie. None if there are none.
+    Sets the seconds of every estimate.
+    '''
+    for estimate in estimates:
+        estimate.seconds = estimate.download / throughput.download + estimate.extract / throughput.extract + \
+                           estimate.write / throughput.write
+    return min( estimates, key=lambda estimate: ( estimate.seconds, estimate.download ), default=None )
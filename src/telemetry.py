@@ -0,0 +1,221 @@
+'''
+Timing of the updater's phases (version check, download, extract, patch parse, apply, install, cleanup...).
+Every phase writes one line of JSON to vars.TELEMETRY_PATH when it ends, with its wall and CPU time,
+the files and bytes it wrote, the bytes it downloaded, the retries it needed and the throughput of each.
+Phases can be nested (an update holds its download and apply phases). Counts go to every phase running,
+so the outer phase has the totals of its inner ones. A phase counts what any thread does while it runs.
+With vars.PROFILE_PHASES, the outermost phase running is profiled with cProfile, and its stats are written
+to vars.PROFILE_PATH (open them with python -m pstats). add_hook() puts any other tracer around every phase.
+'''
+import os
+import json
+import time
+import functools
+import threading
+import contextlib
+from platform import system
+import vars
+import message as message
+
+# Tells the phases of one run of the updater apart from the others in the file.
+SESSION = os.urandom( 6 ).hex()
+
+# Phases running right now, outermost first.
+_active = []
+_lock = threading.Lock()
+# Context managers entered around every phase, each is called with the Phase.
+_hooks = []
+# Set while cProfile is running, it can't profile two phases at once.
+_profiling = False
+
+class Phase:
+    '''
+    One phase being timed. Use it as a context manager, or through timed().
+    '''
+    def __init__( self, name: str, **fields ):
+        self.name = name
+        self.fields = fields # Extra things to write with the record
+        self.parent = None
+        self.files = 0 # Files written (or checked, deleted...)
+        self.bytes = 0 # Bytes written
+        self.downloaded = 0 # Bytes downloaded
+        self.retries = 0 # Requests or downloads that had to be tried again
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.ok = True
+        self.record = None # What was written, once the phase is over
+        self._stack = None
+
+    def __enter__( self ):
+        with _lock:
+            self.parent = _active[-1].name if _active else None
+            _active.append( self )
+        self._stack = contextlib.ExitStack()
+        if vars.PROFILE_PHASES:
+            self._stack.enter_context( profile( self ) )
+        for hook in _hooks:
+            self._stack.enter_context( hook( self ) )
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        return self
+
+    def __exit__( self, error_type, error, traceback ) -> None:
+        self.seconds = time.perf_counter() - self._start
+        self.cpu_seconds = time.process_time() - self._cpu_start
+        with _lock:
+            _active.remove( self )
+        if error_type is not None:
+            self.ok = False
+            self.fields['error'] = error_type.__name__
+        self.record = make_record( self )
+        self._stack.close()
+        write_record( self.record )
+
+def make_record( phase: Phase ) -> dict:
+    '''
+    The line of JSON written for a phase.
+    '''
+    seconds = max( phase.seconds, 1e-6 )
+    record = { 'time': time.strftime( '%Y-%m-%dT%H:%M:%SZ', time.gmtime() ),
+               'session': SESSION,
+               'phase': phase.name,
+               'parent': phase.parent,
+               'ok': phase.ok,
+               'seconds': round( phase.seconds, 4 ),
+               'cpu_seconds': round( phase.cpu_seconds, 4 ),
+               'files': phase.files,
+               'bytes': phase.bytes,
+               'downloaded': phase.downloaded,
+               'retries': phase.retries,
+               'files_per_s': round( phase.files / seconds, 1 ),
+               'mb_per_s': round( phase.bytes / seconds / 1e6, 2 ),
+               'download_mb_per_s': round( phase.downloaded / seconds / 1e6, 2 ),
+               'local_version': vars.LOCAL_VERSION_STRING,
+               'server_version': vars.SERVER_VERSION_STRING,
+               'platform': system() }
+    record.update( phase.fields )
+    return record
+
+def write_record( record: dict ) -> None:
+    '''
+    Append a record to vars.TELEMETRY_PATH. The file is moved to .1 once it's over vars.TELEMETRY_MAX_SIZE.
+    Never fails, telemetry isn't worth stopping an update for.
+    '''
+    if not vars.TELEMETRY or not vars.TELEMETRY_PATH:
+        return
+    try:
+        with _lock:
+            folder = os.path.dirname( vars.TELEMETRY_PATH )
+            if folder:
+                os.makedirs( folder, exist_ok=True )
+            if os.path.exists( vars.TELEMETRY_PATH ) and os.path.getsize( vars.TELEMETRY_PATH ) > vars.TELEMETRY_MAX_SIZE:
+                os.replace( vars.TELEMETRY_PATH, vars.TELEMETRY_PATH + '.1' )
+            with open( vars.TELEMETRY_PATH, 'a' ) as file:
+                file.write( json.dumps( record, separators=( ',', ':' ) ) + '\n' )
+    except Exception:
+        message.print_exception_error_dbg()
+
+def phase( name: str, **fields ) -> Phase:
+    '''
+    Time a phase: with telemetry.phase( 'extract' ) as phase: ...
+    fields are written with its record.
+    '''
+    return Phase( name, **fields )
+
+def timed( name: str ):
+    '''
+    Decorator that times every call of a function as a phase.
+    A call that returns False or None, or raises, is written as not ok.
+    '''
+    def decorator( function ):
+        @functools.wraps( function )
+        def wrapper( *args, **kwargs ):
+            with Phase( name ) as current:
+                result = function( *args, **kwargs )
+                current.ok = result is not None and result is not False
+                return result
+        return wrapper
+    return decorator
+
+def count( files: int = 0, bytes: int = 0, downloaded: int = 0, retries: int = 0 ) -> None:
+    '''
+    Add to the counts of every phase running. Does nothing outside of a phase.
+    '''
+    if not _active:
+        return
+    with _lock:
+        for current in _active:
+            current.files += files
+            current.bytes += bytes
+            current.downloaded += downloaded
+            current.retries += retries
+
+def note( **fields ) -> None:
+    '''
+    Write fields with the record of the innermost phase running. Does nothing outside of a phase.
+    '''
+    with _lock:
+        if _active:
+            _active[-1].fields.update( fields )
+
+def add_hook( hook ) -> None:
+    '''
+    Enter hook( phase ), a context manager, around every phase from now on. For tracers other than cProfile.
+    '''
+    _hooks.append( hook )
+
+def remove_hook( hook ) -> None:
+    '''
+    Stop entering a hook added with add_hook().
+    '''
+    _hooks.remove( hook )
+
+@contextlib.contextmanager
+def profile( current: Phase ):
+    '''
+    Profile a phase with cProfile, into vars.PROFILE_PATH/<time>-<session>-<phase>.prof
+    Phases inside a profiled one are part of its profile. Only the thread that started the phase is profiled.
+    '''
+    global _profiling
+    with _lock:
+        nested = _profiling
+        _profiling = True
+    if nested:
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        yield
+    finally:
+        profiler.disable()
+        _profiling = False
+        try:
+            os.makedirs( vars.PROFILE_PATH, exist_ok=True )
+            profiler.dump_stats( os.path.join( vars.PROFILE_PATH, f'{time.strftime( "%Y%m%d-%H%M%S" )}-{SESSION}-{current.name}.prof' ) )
+        except Exception:
+            message.print_exception_error_dbg()
+
+def get_throughput( phases: tuple, key: str, accept=None, limit: int = 20 ) -> float:
+    '''
+    Median of a record's key (like mb_per_s) over the last limit successful records of these phases, in bytes per second.
+    accept( record ) can leave records out. None if no record is left.
+    '''
+    if not vars.TELEMETRY_PATH or not os.path.exists( vars.TELEMETRY_PATH ):
+        return None
+    names = [ f'"phase":"{name}"' for name in phases ]
+    values = []
+    try:
+        with open( vars.TELEMETRY_PATH, 'r' ) as file:
+            for line in file:
+                # Don't parse the lines of other phases
+                if not any( name in line for name in names ):
+                    continue
+                record = json.loads( line )
+                if record['phase'] in phases and record['ok'] and record.get( key ) and ( not accept or accept( record ) ):
+                    values.append( record[key] )
+    except Exception:
+        message.print_exception_error_dbg()
+    values = sorted( values[-limit:] )
+    return values[len( values ) // 2] * 1e6 if values else None
@@ -2,24 +2,49 @@
 Helpful functions used for the updater
 '''
 import os
-from shutil import rmtree
+import io
+import json
+import queue
+import threading
+import time
+import zlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from shutil import rmtree, disk_usage
 from platform import system
-import requests
-import tarfile
-from tqdm import tqdm
-import unidiff
 if system() == 'Windows':
     import winreg
     import userpaths # Get the downloads folder on Windows 
-from shutil import rmtree, copy2, copytree
 from dataclasses import dataclass
 import vars
 from vars import UpdateCode # Not writing vars.UpdateCode.UPDATE_YES screw that
-import vpk
-import requests
+import manifest
+import fileops
+import planner
+import vpkdir
+import cleanup
+import telemetry
+import artifacts
 import message as message
+# requests (through net and pack), tarfile, tqdm and vpk (through vpkpatch) take a while to load,
+# so the modules that use them are imported in the functions that need them. The menu shows up without waiting for them.
 
-# structure of an update file.
+# Format version of the cached Steam path. Bump it when the format changes.
+STEAM_PATH_CACHE_VERSION = 1
+
+# Update journal, so an interrupted update continues where it stopped.
+# It starts with JOURNAL_MAGIC and the format version (1 byte), then records follow one after another:
+#     hotfix flag, operation (1 byte each), old version, new version (4 bytes each),
+#     index of the first file of the operation that isn't done yet (8 bytes), CRC32 of the record so far (4 bytes)
+# All numbers are little endian. The last intact record is where the update stopped.
+JOURNAL_MAGIC = b'PF2JRNL'
+# Format version of the journal. Bump it when the format changes.
+JOURNAL_VERSION = 1
+JOURNAL_HEADER = struct.Struct( '<7sB' )
+JOURNAL_RECORD = struct.Struct( '<BBIIQ' )
+JOURNAL_CHECKSUM = struct.Struct( '<I' )
+
+# structure of an update journal record.
 @dataclass
 class UpdateInfo:
     hotfix_flag: bool # number to indicate the hotfix version (currently only used by 0.7-HOTFIX)
@@ -51,44 +76,86 @@ def setup_game_path() -> None:
             message.print_exception_error_dbg()
     else: # Linux. We don't have a registry, so Steam has a fake one via registry.vdf
         try:
-            sourcepath = None
-            # Open the registry.vdf file, which holds the fake registry 
-            with open( os.path.expanduser( r'~/.steam/registry.vdf' ), encoding="utf-8" ) as file:
-                # Look for SourceModInstallPath.
-                for _, line in enumerate( file ):
-                    if 'SourceModInstallPath' in line:
-                        # If we find it, replace the paths with proper slashes for UNIX systems
-                        sourcepath = line[line.index('/home'):-1].replace(r'\\', '/').replace('\"', '')
-                        break
+            registry_path = os.path.expanduser( r'~/.steam/registry.vdf' )
+            registry_stat = os.stat( registry_path )
+            # Steam rarely rewrites it, so use the path we found last time unless it did.
+            sourcepath = load_steam_path( registry_path, registry_stat )
+            if not sourcepath:
+                # Open the registry.vdf file, which holds the fake registry 
+                with open( registry_path, encoding="utf-8" ) as file:
+                    # Look for SourceModInstallPath.
+                    for _, line in enumerate( file ):
+                        if 'SourceModInstallPath' in line:
+                            # If we find it, replace the paths with proper slashes for UNIX systems
+                            sourcepath = line[line.index('/home'):-1].replace(r'\\', '/').replace('\"', '')
+                            break
+                save_steam_path( registry_path, registry_stat, sourcepath )
             # Set the global variable.
             vars.SOURCEMOD_PATH = sourcepath
             vars.GAME_PATH = os.path.join( sourcepath, 'pf2' )
         except Exception:
             message.print_exception_error_dbg()
 
-def get_local_version_num() -> int:
+def load_steam_path( registry_path: str, registry_stat: os.stat_result ) -> str:
     '''
-    Get the server's version in a number. Useful for patch identification and comparisons. 
+    SourceMod path cached from registry.vdf. None if the file changed since it was cached, or there's no cache.
+    '''
+    try:
+        with open( vars.STEAM_PATH_CACHE, 'r' ) as file:
+            data = json.load( file )
+        if data.get( 'format' ) != STEAM_PATH_CACHE_VERSION:
+            return None
+        if ( data['registry'], data['size'], data['mtime_ns'] ) != ( registry_path, registry_stat.st_size, registry_stat.st_mtime_ns ):
+            return None
+        return data['sourcemod_path']
+    except FileNotFoundError:
+        return None
+    except Exception:
+        message.print_exception_error_dbg()
+        return None
+
+def save_steam_path( registry_path: str, registry_stat: os.stat_result, sourcepath: str ) -> None:
+    '''
+    Cache the SourceMod path found in registry.vdf, along with the size and mtime the file had.
+    '''
+    if not sourcepath:
+        return
+    try:
+        os.makedirs( os.path.dirname( vars.STEAM_PATH_CACHE ), exist_ok=True )
+        with open( vars.STEAM_PATH_CACHE + '.part', 'w' ) as file:
+            json.dump( { 'format': STEAM_PATH_CACHE_VERSION,
+                         'registry': registry_path,
+                         'size': registry_stat.st_size,
+                         'mtime_ns': registry_stat.st_mtime_ns,
+                         'sourcemod_path': sourcepath }, file )
+        os.replace( vars.STEAM_PATH_CACHE + '.part', vars.STEAM_PATH_CACHE )
+    except Exception:
+        # We just read registry.vdf again next time
+        message.print_exception_error_dbg()
+
+def get_version_num( version: str ) -> int:
+    '''
+    Get a version string in a number (0.7.1 -> 71, 0.7 -> 70).
     '''
     # Remove the periods from the string, and convert it to a number
-    result = int( vars.LOCAL_VERSION_STRING.replace( '.', '' ).replace( '-HOTFIX', '' ) )
+    result = int( version.replace( '.', '' ).replace( '-HOTFIX', '' ) )
     # If this is a number divisible by 10, add a 0 at the end
     if len( str( result ) ) < 2:
         result *= 10
 
     return result
 
-def get_server_version_num() -> int:
+def get_local_version_num() -> int:
     '''
     Get the server's version in a number. Useful for patch identification and comparisons. 
     '''
-    # Remove the periods from the string, and convert it to a number
-    result = int( vars.SERVER_VERSION_STRING.replace( '.', '' ) )
-    # If this is a number divisible by 10, add a 0 at the end
-    if len( str( result ) ) < 2:
-        result *= 10 
+    return get_version_num( vars.LOCAL_VERSION_STRING )
 
-    return result
+def get_server_version_num() -> int:
+    '''
+    Get the server's version in a number. Useful for patch identification and comparisons. 
+    '''
+    return get_version_num( vars.SERVER_VERSION_STRING )
 
 def delete_file_if_exists( file_path: str ) -> None:
     '''
@@ -104,6 +171,19 @@ def delete_folder_if_exists( folder_path: str ) -> None:
     if os.path.exists( folder_path ):
         rmtree( folder_path )
 
+def get_staging_path() -> str:
+    '''
+    Folder the new build is downloaded into before it's applied (pf2_new).
+    It goes next to the game folder when it can, so it's on the same filesystem
+    and files can be moved into the game instead of copied. vars.STAGING_PATH puts it somewhere else.
+    '''
+    if vars.STAGING_PATH:
+        return vars.STAGING_PATH
+    parent = os.path.dirname( os.path.abspath( vars.GAME_PATH ) ) if vars.GAME_PATH else ''
+    if vars.STAGE_NEXT_TO_GAME and parent and os.path.isdir( parent ):
+        return os.path.join( parent, 'pf2_new' )
+    return 'pf2_new'
+
 def check_game_installation() -> bool:
     '''
     Checks if the game is installed. 
@@ -143,23 +223,26 @@ def check_game_version() -> str:
     #if not check_game_installation():
     #    return ''
 
-    # Open the vpk file to get the version.txt file.
+    # Read the version.txt file out of the vpk.
     # Note: pre-0.7.4 builds store it in the vpks
     # VPK path for the version.
     vpkpath = os.path.join( vars.GAME_PATH, "pf2_misc_dir.vpk" )
     version = ''
-    # Open the vpk file containing the version.txt
+    version_file = None
     try:
-        with vpk.open( vpkpath ) as vpkfile:
-            # Get the file.
-            version_file = vpkfile.get_file( 'version.txt' )
-            # Get the version string from the file and convert it into an integer
-            # Read the file, decode the file, format it as unicode, partition the important number part
-            # and remove the periods from the version so that we can store the number
-            version = vars.LOCAL_VERSION_STRING = version_file.read().decode().format('utf-8').partition('=')[2]
+        # Only reads the vpk's directory up to version.txt, and only once as long as the vpk doesn't change.
+        version_file = vpkdir.read_file_cached( vpkpath, 'version.txt' )
     except FileNotFoundError:
-        # If this exception was raised, that means that we didn't find the file in the VPK.
-        # try again in the root directory
+        pass
+    except Exception:
+        message.print_exception_error_dbg()
+
+    if version_file is not None:
+        # Get the version string from the file
+        # Decode the file and partition the important number part
+        version = vars.LOCAL_VERSION_STRING = version_file.decode( 'utf-8' ).partition('=')[2]
+    else:
+        # If we didn't find the file in the VPK, try again in the root directory
         # Get the version.txt file
         normpath = os.path.join( vars.GAME_PATH, 'version.txt' )
         try:
@@ -182,11 +265,13 @@ def check_server_version() -> str:
     '''
     Function to ask the server for the latest version via a text file
     '''
+    import net
     server_version = ''
     # try to match that version.txt file from the server
     try:
         # Request version.txt from the website
-        with requests.get( vars.WEBSITE_URL + 'version.txt' ) as response:
+        with net.get( vars.WEBSITE_URL + 'version.txt' ) as response:
+            response.raise_for_status()
             # Strip new lines so we only get the server version.
             server_version = response.text.strip( '\n' )    
     except Exception as error:
@@ -194,6 +279,7 @@ def check_server_version() -> str:
 
     return server_version
 
+@telemetry.timed( 'version_check' )
 def check_for_update() -> int:
     '''
     Check if we need an update.
@@ -215,7 +301,7 @@ def check_for_update() -> int:
     vars.SERVER_VERSION_STRING = check_server_version()
 
     # Check for an update file. If we have one, continue updating the game
-    if parse_update_file():
+    if recover_update():
         print( 'Continuing your update...\n' )
         return UpdateCode.UPDATE_INTERRUPTED
 
@@ -226,31 +312,22 @@ def check_for_update() -> int:
 def download_file( url: str ) -> bool:
     '''
     Function to download a file off the internet and write it to disk. 
-    True if we were able to fully download the file (HTTP 200 success code), False if we didn't 
+    An interrupted download is resumed from where it stopped the next time this is called.
+    True if we were able to fully download the file (length matches what the server said), False if we didn't 
     '''
-    try:
-        # Try requesting the server to get a file.
-        response = requests.get( url, stream=True, timeout=10 )
-
-        # how big is this file?
-        total_size = int( response.headers.get( 'content-length', 0 ) )
-        # show a progress bar to the console using tqdm.
-        with open( os.path.basename( url ), "wb" ) as handle,    tqdm( 
-                                                                            desc=f'Downloading {os.path.basename( url )}', 
-                                                                            total=total_size,
-                                                                            unit='iB',
-                                                                            unit_scale=True ) as bar:
-            # Write to the disk.
-            for chunk in response.iter_content( chunk_size=1*1024 ):
-                size = handle.write( chunk )
-                bar.update( size )
-                
-    # did we time out? Did the server just not have it? etc...
-    except Exception as error:
-        message.print_exception_error_dbg()
+    import net
+    success = False
+    with telemetry.phase( 'download', file=os.path.basename( url ) ) as phase:
+        try:
+            # Download it next to us with the same name it has on the server.
+            success = net.download( url, os.path.basename( url ) )
+        # did we time out? Did the server just not have it? etc...
+        except Exception as error:
+            message.print_exception_error_dbg()
+        phase.ok = success
 
     # Did we succeed?
-    return response.status_code == 200
+    return success
 
 
 def download() -> bool: 
@@ -262,56 +339,663 @@ def download() -> bool:
     if vars.DEBUG and os.path.exists( vars.FILE_NAME ):
         return True
 
-    return download_file( vars.FILE_URL )
+    # Reuse the tar file of this version if it's in the cache
+    version = get_build_version()
+    if artifacts.fetch( vars.FILE_NAME, version, vars.FILE_NAME, vars.FILE_URL ):
+        return True
+    if not download_file( vars.FILE_URL ):
+        return False
+    artifacts.store( vars.FILE_NAME, version, vars.FILE_NAME, vars.FILE_URL )
+    return True
+
+def get_build_version() -> str:
+    '''
+    Version of the server's latest build, to tell its tar files apart in the cache.
+    '''
+    return vars.SERVER_VERSION_STRING or check_server_version()
 
-def extract() -> bool:
+def extract_members( file, dest_path: str, paths: list = None ) -> None:
     '''
-    Extracts the tar file into a new folder.
+    Extract an open tar file (a stream or not) into dest_path, in one pass over it.
+    With paths (as they're named in the tar file, like pf2/bin/client.so), only those files and what's in those folders are written,
+    the other members are decompressed and skipped.
     '''
+    import pack
+    wanted = set( paths ) if paths is not None else None
+    skipped = 0
+
+    def members():
+        nonlocal skipped
+        for member in file:
+            if wanted is not None and not pack.is_wanted( member.name, wanted ):
+                skipped += 1
+                continue
+            if member.isfile():
+                telemetry.count( files=1, bytes=member.size )
+            yield member
+
+    file.extractall( dest_path, members=members() )
+    if wanted is not None:
+        telemetry.note( skipped_members=skipped )
+
+@telemetry.timed( 'extract' )
+def extract( paths: list = None ) -> bool:
+    '''
+    Extracts the tar file into a new folder. Only the files in paths if it's set (see extract_members).
+    '''
+    import tarfile
     print('Extracting the game...')
 
-    if vars.DEBUG and os.path.exists( 'pf2_new' ):
+    staging_path = get_staging_path()
+    if vars.DEBUG and os.path.exists( staging_path ):
         return True
     
+    # Extract to a temporary folder first, so a half extracted game never looks like a finished one
+    partial_path = staging_path + '.partial'
+    delete_folder_if_exists( partial_path )
+
     # Flag to indicate success.
     success = False
     try:
         # Open the tar file that we just downloaded.
         with tarfile.open( vars.FILE_NAME ) as file:
             # Try extracting it
-            file.extractall( 'pf2_new' )
-            os.chmod( 'pf2_new', 0o755 )
-            # If we extracted it, set the flag for success.
-            success = True
+            extract_members( file, partial_path, paths )
+        os.makedirs( partial_path, exist_ok=True )
+        delete_folder_if_exists( staging_path )
+        os.replace( partial_path, staging_path )
+        os.chmod( staging_path, 0o755 )
+        # If we extracted it, set the flag for success.
+        success = True
     except Exception:
         message.print_exception_error_dbg()
+        delete_folder_if_exists( partial_path )
 
     return success
 
-def update( update_info : UpdateInfo = None ) -> bool:
+class QueueReader( io.RawIOBase ):
     '''
-    Try to update the game with the downloaded build 
-    via a diff file downloaded from the server.
-    This assumes the downloaded game was already extracted and updates files from it.
+    Read-only file object over chunks of bytes put in a queue by another thread.
+    None marks the end of the data, and an exception is raised in the reading thread.
     '''
-    print( 'Applying the update...' )
+    def __init__( self, chunks: queue.Queue ):
+        self.chunks = chunks
+        self.chunk = memoryview( b'' )
+        self.done = False
 
-    # Is this the hotfix version?
-    old_version_hotfix_flag = vars.LOCAL_VERSION_STRING.endswith( '-HOTFIX' )
+    def readable( self ) -> bool:
+        return True
+
+    def readinto( self, buffer ) -> int:
+        # Wait for the next chunk if we used up the last one
+        while not self.chunk and not self.done:
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.done = True
+            elif isinstance( chunk, Exception ):
+                raise chunk
+            else:
+                self.chunk = memoryview( chunk )
+        # Copy as much as we can
+        size = min( len( buffer ), len( self.chunk ) )
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+@telemetry.timed( 'download_extract' )
+def download_and_extract( tee: bool = None, paths: list = None ) -> bool:
+    '''
+    Downloads the game's tar file and extracts it into the staging folder at the same time, without writing latest.tar.gz first.
+    Only the files in paths are written if it's set (see extract_members).
+    The download runs on this thread and feeds a worker thread that decompresses the stream and writes the files,
+    so the network never waits on the disk.
+    If tee is set (vars.STREAM_TEE by default), the tar file is also saved to disk to be reused later,
+    and into the cache with vars.ARTIFACT_CACHE on. vars.CACHE_STREAMED_BUILDS saves it only for the cache.
+    It's only stored once everything was extracted.
+    True if the whole game was downloaded and extracted.
+    '''
+    import tarfile
+    from tqdm import tqdm
+    import net
+    print( 'Downloading and extracting the game...' )
+
+    staging_path = get_staging_path()
+    if vars.DEBUG and os.path.exists( staging_path ):
+        return True
+
+    if tee is None:
+        tee = vars.STREAM_TEE
+    # The tar file is saved for the cache too, if we're asked to
+    cache_version = get_build_version() if vars.ARTIFACT_CACHE and ( tee or vars.CACHE_STREAMED_BUILDS ) else ''
+
+    # Extract to a temporary folder first, so a half extracted game never looks like a finished one
+    partial_path = staging_path + '.partial'
+    delete_folder_if_exists( partial_path )
+
+    # Downloaded chunks waiting to be extracted. Bounded so we don't buffer the entire game in memory.
+    chunks = queue.Queue( maxsize=vars.STREAM_QUEUE_SIZE )
+    # Set when the extract thread stops, whether it finished or failed.
+    extract_done = threading.Event()
+    # Holds the exception that stopped the extract thread, if any.
+    extract_error = []
+
+    def extract_stream() -> None:
+        try:
+            # Read the tar file as a stream, extracting every member as soon as it arrives
+            with tarfile.open( fileobj=QueueReader( chunks ), mode='r|gz' ) as file:
+                extract_members( file, partial_path, paths )
+            # Nothing to write still makes a staging folder
+            os.makedirs( partial_path, exist_ok=True )
+        except Exception as error:
+            message.print_exception_error_dbg()
+            extract_error.append( error )
+        finally:
+            extract_done.set()
+
+    def hand_over( item ) -> None:
+        # Give the extract thread something, unless it already stopped
+        while not extract_done.is_set():
+            try:
+                chunks.put( item, timeout=0.1 )
+                return
+            except queue.Full:
+                pass
+
+    extract_thread = threading.Thread( target=extract_stream, daemon=True )
+    extract_thread.start()
+
+    tee_file = None
+    try:
+        if tee or cache_version:
+            tee_file = open( vars.FILE_NAME + '.part', 'wb' )
+        with tqdm( desc=f'Downloading {vars.FILE_NAME}', unit='iB', unit_scale=True ) as bar:
+            for chunk in net.iter_download( vars.FILE_URL ):
+                if tee_file:
+                    tee_file.write( chunk )
+                hand_over( chunk )
+                # Stop if extracting failed, or it finished and we don't need the rest of the file for the tee.
+                if extract_done.is_set() and ( extract_error or not tee_file ):
+                    break
+                bar.update( len( chunk ) )
+        # Mark the end of the data.
+        hand_over( None )
+    except Exception as error:
+        message.print_exception_error_dbg()
+        # Stop the extract thread.
+        hand_over( error )
+    finally:
+        if tee_file:
+            tee_file.close()
+
+    # Wait for the last files to be written
+    extract_thread.join()
+    if extract_error or not os.path.exists( partial_path ):
+        delete_folder_if_exists( partial_path )
+        delete_file_if_exists( vars.FILE_NAME + '.part' )
+        return False
+
+    # Everything's here, move it into place.
+    delete_folder_if_exists( staging_path )
+    os.replace( partial_path, staging_path )
+    os.chmod( staging_path, 0o755 )
+    if tee:
+        os.replace( vars.FILE_NAME + '.part', vars.FILE_NAME )
+        artifacts.store( vars.FILE_NAME, cache_version, vars.FILE_NAME, vars.FILE_URL )
+    elif cache_version:
+        artifacts.store( vars.FILE_NAME, cache_version, vars.FILE_NAME + '.part', vars.FILE_URL, move=True )
+        delete_file_if_exists( vars.FILE_NAME + '.part' )
+    return True
+
+def download_build( paths: list = None ) -> bool:
+    '''
+    Download and extract the whole latest build into the staging folder,
+    or only the files in paths out of it (see extract_members).
+    '''
+    # Extract the cached tar file if we have it, it's only a link to the cached one.
+    if not os.path.exists( vars.FILE_NAME ) and artifacts.fetch( vars.FILE_NAME, get_build_version(), vars.FILE_NAME, vars.FILE_URL ):
+        success = extract( paths )
+        delete_file_if_exists( vars.FILE_NAME )
+        return success
+    # Extract while downloading, unless we already have the tar file.
+    if vars.STREAM_EXTRACT and not os.path.exists( vars.FILE_NAME ):
+        return download_and_extract( paths=paths )
+    return download() and extract( paths )
 
-    # append 1 to the local version num if we're updating from the 0.7 hotfix from an interrupted update
+def get_patch_name() -> str:
+    '''
+    Name of the patch file that updates the installed version to the server's version.
+    '''
+    # append 1 to the local version num if we're updating from the 0.7 hotfix
     hotfix_add = ''
-    if old_version_hotfix_flag:
+    if vars.LOCAL_VERSION_STRING.endswith( '-HOTFIX' ):
         hotfix_add = '1'
 
-    # Download a temp patch file.
-    diff_path = 'pf2_0' + str( get_local_version_num() ).replace( '.', '' ) + hotfix_add + '-0' + str( get_server_version_num() ) + '.patch'
+    return 'pf2_0' + str( get_local_version_num() ).replace( '.', '' ) + hotfix_add + '-0' + str( get_server_version_num() ) + '.patch'
+
+def download_patch() -> str:
+    '''
+    Download the patch file for this update, unless we already have it.
+    Returns the patch file's name, or an empty string if we couldn't get it.
+    '''
+    diff_path = get_patch_name()
+    # Patches never change once they're published, a cached one is always good
+    if os.path.exists( diff_path ) or artifacts.fetch( diff_path, vars.SERVER_VERSION_STRING, diff_path ):
+        return diff_path
 
     print( 'Downloading the patch file for temporary usage...' )
     # Download a patch file, we're gonna use this to patch the game.
-    download_file( f'https://raw.githubusercontent.com/Pre-Fortress-2/Updater/main/{diff_path}' )
-    # Build we just downloaded in the temp path
-    replacement_path = os.path.join( 'pf2_new', 'pf2' ) 
+    if not download_file( vars.PATCH_URL + diff_path ):
+        return ''
+    artifacts.store( diff_path, vars.SERVER_VERSION_STRING, diff_path )
+    return diff_path
+
+def get_patch_relative_path( patch_path: str ) -> str:
+    '''
+    Get the path relative to the game folder of a file in a patch (pf2_0.7.3/pf2/bin/client.so -> bin/client.so)
+    '''
+    return patch_path.partition( '/' )[2].partition('/')[2]
+
+def get_patch_index_path() -> str:
+    '''
+    Path of the cached scan of the patch file.
+    '''
+    return os.path.join( vars.GAME_PATH, 'patch_index.cache' )
+
+@telemetry.timed( 'patch_parse' )
+def manifest_from_patch( diff_path: str ) -> manifest.Manifest:
+    '''
+    Build a manifest out of a unified diff patch, for updates that don't have a manifest on the server.
+    Patches don't have sizes or hashes, and can say a file was modified when it was removed.
+    The patch is scanned once, a resumed update reads the cached scan.
+    '''
+    import patchscan
+    result = manifest.Manifest( vars.LOCAL_VERSION_STRING, vars.SERVER_VERSION_STRING )
+    for path, operation in patchscan.scan_patch_cached( diff_path, get_patch_index_path() ):
+        result.files.append( manifest.FileChange( get_patch_relative_path( path ), operation ) )
+    return result
+
+@telemetry.timed( 'changes' )
+def download_changes() -> manifest.Manifest:
+    '''
+    Get the list of files this update changes.
+    Uses the update's manifest if the server has one, otherwise its patch file. None if we couldn't get either.
+    '''
+    manifest_path = get_patch_name().replace( '.patch', '.manifest.json' )
+    if not os.path.exists( manifest_path ) and not artifacts.fetch( manifest_path, vars.SERVER_VERSION_STRING, manifest_path ) and \
+       download_file( vars.PATCH_URL + manifest_path ):
+        artifacts.store( manifest_path, vars.SERVER_VERSION_STRING, manifest_path )
+    if os.path.exists( manifest_path ):
+        try:
+            changes = manifest.load_manifest( manifest_path )
+            telemetry.note( source='manifest', changed_files=len( changes.files ) )
+            return changes
+        except Exception:
+            message.print_exception_error_dbg()
+
+    diff_path = download_patch()
+    if diff_path:
+        changes = manifest_from_patch( diff_path )
+        telemetry.note( source='patch', changed_files=len( changes.files ) )
+        return changes
+    return None
+
+def delete_changes() -> None:
+    '''
+    Delete the manifest and patch files of this update, we're done with them.
+    '''
+    delete_file_if_exists( get_patch_name().replace( '.patch', '.manifest.json' ) )
+    delete_file_if_exists( get_patch_name() )
+
+@telemetry.timed( 'fetch_deltas' )
+def fetch_deltas( index: dict, paths: list, dest_path: str ) -> list:
+    '''
+    Rebuild the changed binary files we have deltas for from the installed files, writing them to dest_path.
+    Every rebuilt file is checked against the hash in the index, if it doesn't match it's downloaded whole instead.
+    Returns the paths that still have to be downloaded.
+    '''
+    import net
+    import pack
+    import delta
+    delta_url = vars.DELTA_URL.format( vars.LOCAL_VERSION_STRING, vars.SERVER_VERSION_STRING )
+    try:
+        # Which files have deltas for this update?
+        with net.get( delta_url + 'deltas.json' ) as response:
+            response.raise_for_status()
+            delta_list = response.json()
+        if delta_list.get( 'format' ) != delta.FORMAT_VERSION:
+            return paths
+    except Exception:
+        # No deltas for this update, that's fine.
+        message.print_exception_error_dbg()
+        return paths
+
+    members = { member['path']: member for member in index['members'] }
+    remaining = []
+    for path in paths:
+        delta_info = delta_list['files'].get( path )
+        # The installed file
+        old_path = os.path.join( vars.GAME_PATH, *path.split( '/' )[1:] )
+        # Where the rebuilt file goes
+        new_path = os.path.join( dest_path, *path.split( '/' ) )
+        # Already rebuilt before we were interrupted. Anything else there is rebuilt or downloaded again over it.
+        if path in members and pack.is_fetched( members[path], new_path ):
+            continue
+        if not delta_info or path not in members or not os.path.exists( old_path ):
+            remaining.append( path )
+            continue
+
+        delta_path = new_path + '.pf2delta'
+        try:
+            os.makedirs( os.path.dirname( new_path ), exist_ok=True )
+            print( f'Patching {path}...' )
+            if not net.download( delta_url + delta_info['delta'], delta_path ):
+                raise ValueError( f'Couldn\'t download the delta for {path}' )
+            # Rebuild it, and make sure it's the exact file we want before putting it in place
+            if delta.apply_delta( old_path, delta_path, new_path + '.part' ) != members[path]['sha256']:
+                raise ValueError( f'{path} doesn\'t match the new build after patching' )
+            os.replace( new_path + '.part', new_path )
+            telemetry.count( files=1, bytes=os.path.getsize( new_path ) )
+        except Exception:
+            # Didn't work, download the whole file.
+            message.print_exception_error_dbg()
+            delete_file_if_exists( new_path + '.part' )
+            remaining.append( path )
+        delete_file_if_exists( delta_path )
+
+    return remaining
+
+@telemetry.timed( 'fetch_changed_files' )
+def fetch_changed_files( index_name: str = None ) -> bool:
+    '''
+    Download only the files this update changes into the staging folder, with Range requests on the server's pack of the latest build,
+    or on the pack of index_name on the server.
+    False if the server has no index for the latest build, or something went wrong. Download the whole build then.
+    '''
+    import pack
+    print( 'Looking for the changed files on the server...' )
+
+    # The index has to be for the version we're updating to.
+    index = pack.fetch_index( vars.WEBSITE_URL + index_name if index_name else None )
+    if not index or index['version'] != vars.SERVER_VERSION_STRING:
+        return False
+
+    success = False
+    try:
+        # Files that have a new version in the latest build
+        changes = download_changes()
+        if not changes:
+            return False
+        paths = [ 'pf2/' + change.path for change in changes.get( manifest.OP_MODIFIED ) + changes.get( manifest.OP_ADDED ) ]
+        # Patches can say a file is modified when the new build doesn't have it (see update()), there's nothing to fetch then.
+        gone = set( pack.get_missing( index, [ 'pf2/' + change.path for change in changes.get( manifest.OP_MODIFIED ) if not change.sha256 ] ) )
+        paths = [ path for path in paths if path not in gone ]
+
+        # Fetch to a temporary folder so a half fetched update never looks like a finished one.
+        # The files already in it from an interrupted fetch are kept.
+        # Patch the binary files we have deltas for, and download the rest.
+        staging_path = get_staging_path()
+        paths = fetch_deltas( index, paths, staging_path + '.partial' )
+        if pack.fetch_members( index, paths, staging_path + '.partial' ):
+            delete_folder_if_exists( staging_path )
+            os.replace( staging_path + '.partial', staging_path )
+            success = True
+    except Exception:
+        message.print_exception_error_dbg()
+
+    return success
+
+def extract_changed_files() -> bool:
+    '''
+    Get only the files this update changes out of the latest build into the staging folder.
+    Its tar file is read once, and the files the update doesn't change are skipped without being written.
+    '''
+    changes = download_changes()
+    if not changes:
+        return False
+    paths = [ 'pf2/' + change.path for change in changes.get( manifest.OP_MODIFIED ) + changes.get( manifest.OP_ADDED ) ]
+    print( f'Taking {len( paths )} changed files out of the latest build...' )
+    return download_build( paths )
+
+def download_update( index_name: str = None, full_build: bool = True ) -> bool:
+    '''
+    Get what an update needs into the staging folder.
+    Only the changed files, with Range requests if the server lets us, otherwise out of the whole build's tar file.
+    An update to a version that isn't the latest has its own pack (index_name),
+    and can't fall back on the full build (full_build is False then).
+    '''
+    if ( vars.PARTIAL_FETCH or index_name ) and fetch_changed_files( index_name ):
+        return True
+    if not full_build:
+        return False
+    return extract_changed_files() if vars.EXTRACT_CHANGED_ONLY else download_build()
+
+@telemetry.timed( 'apply_vpk' )
+def update_vpks( changes: manifest.Manifest, replacement_path: str ) -> set:
+    '''
+    Update the modified VPK archives entry by entry, so only the parts of the chunks that changed get written.
+    Returns the paths of the files that were updated this way, the rest are copied whole as usual.
+    '''
+    import vpkpatch
+    handled = set()
+    modified = [ change.path for change in changes.get( manifest.OP_MODIFIED ) ]
+    for dir_path in modified:
+        # Only VPKs with chunks we have the old and new versions of
+        if not dir_path.endswith( '_dir.vpk' ) or not os.path.exists( os.path.join( replacement_path, dir_path ) ) or \
+           not os.path.exists( os.path.join( vars.GAME_PATH, dir_path ) ):
+            continue
+        chunks = { path: vpkpatch.get_archive_index( dir_path, path ) for path in modified }
+        chunks = { path: index for path, index in chunks.items() if index >= 0 and
+                   os.path.exists( os.path.join( replacement_path, path ) ) and os.path.exists( os.path.join( vars.GAME_PATH, path ) ) }
+        try:
+            written = vpkpatch.patch_vpk( dir_path, replacement_path, vars.GAME_PATH, list( chunks.values() ) )
+            telemetry.count( files=len( chunks ) + 1, bytes=written )
+            total_size = sum( os.path.getsize( os.path.join( replacement_path, path ) ) for path in chunks )
+            print( f'Updated {dir_path}: wrote {written / 1e6:.1f} MB of {total_size / 1e6:.1f} MB in {len( chunks )} changed chunks.' )
+            handled.add( dir_path )
+            handled.update( chunks )
+        except Exception:
+            # Copy the whole files instead.
+            message.print_exception_error_dbg()
+    return handled
+
+def get_journal_path() -> str:
+    '''
+    Path of the update journal.
+    '''
+    return os.path.join( vars.GAME_PATH, 'update_journal' )
+
+def read_journal( journal_path: str ) -> tuple:
+    '''
+    Read an update journal: ( its last intact record as an UpdateInfo, the offset where that record ends ).
+    ( None, 0 ) if it isn't a journal we understand. A torn or corrupted record
+    (from a crash in the middle of writing it) ends the journal.
+    '''
+    record_size = JOURNAL_RECORD.size + JOURNAL_CHECKSUM.size
+    with open( journal_path, 'rb' ) as file:
+        header = file.read( JOURNAL_HEADER.size )
+        if len( header ) < JOURNAL_HEADER.size or JOURNAL_HEADER.unpack( header ) != ( JOURNAL_MAGIC, JOURNAL_VERSION ):
+            return None, 0
+        info = None
+        end = file.tell()
+        while len( data := file.read( record_size ) ) == record_size:
+            record = data[:JOURNAL_RECORD.size]
+            checksum, = JOURNAL_CHECKSUM.unpack( data[JOURNAL_RECORD.size:] )
+            if zlib.crc32( record ) != checksum:
+                break
+            hotfix_flag, operation, old_version, new_version, last_file_num = JOURNAL_RECORD.unpack( record )
+            info = UpdateInfo( bool( hotfix_flag ), old_version, new_version, last_file_num, operation )
+            end = file.tell()
+    return info, end
+
+def recover_update() -> UpdateInfo:
+    '''
+    Where an interrupted update stopped, from the update journal. None if no update was interrupted.
+    A journal without an intact record was cut off before its first one was durable,
+    so the update stopped before it touched anything: it continues from the start.
+    '''
+    journal_path = get_journal_path()
+    if not os.path.exists( journal_path ):
+        return None
+    info, end = read_journal( journal_path )
+    if not info and end:
+        return UpdateInfo( vars.LOCAL_VERSION_STRING.endswith( '-HOTFIX' ), get_local_version_num(), get_server_version_num(), 0, manifest.OP_MODIFIED )
+    return info
+
+class UpdateJournal:
+    '''
+    Append-only journal an update writes its progress to, see JOURNAL_MAGIC for the format.
+    Every record says which operation we're on and the index below which all of its files are done.
+    Records are written together and fsynced every vars.JOURNAL_SYNC_OPS records or every
+    vars.JOURNAL_SYNC_INTERVAL seconds, whichever comes first, and when the journal is closed.
+    Losing the records since the last sync only means redoing those files, which is safe
+    since applying a file twice gives the same result.
+    A new journal gets a record for the start of the update right away, fsynced, so it's never
+    left without one. Opening an existing journal (when continuing an update) cuts off a torn record at its end and appends after it.
+    '''
+    def __init__( self, journal_path: str, hotfix_flag: bool, old_version: int, new_version: int ):
+        self.hotfix_flag = hotfix_flag
+        self.old_version = old_version
+        self.new_version = new_version
+        self.lock = threading.Lock()
+        end = read_journal( journal_path )[1] if os.path.exists( journal_path ) else 0
+        if end:
+            self.file = open( journal_path, 'r+b' )
+            self.file.truncate( end )
+            self.file.seek( end )
+        else:
+            self.file = open( journal_path, 'wb' )
+            self.file.write( JOURNAL_HEADER.pack( JOURNAL_MAGIC, JOURNAL_VERSION ) )
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        if not end:
+            self.record( manifest.OP_MODIFIED, 0 )
+            self.sync()
+
+    def record( self, operation: int, last_file_num: int ) -> None:
+        '''
+        Append a record: every file of operation before last_file_num is done.
+        '''
+        record = JOURNAL_RECORD.pack( self.hotfix_flag, operation, self.old_version, self.new_version, last_file_num )
+        with self.lock:
+            self.file.write( record + JOURNAL_CHECKSUM.pack( zlib.crc32( record ) ) )
+            self.pending += 1
+            if self.pending >= vars.JOURNAL_SYNC_OPS or time.monotonic() - self.last_sync >= vars.JOURNAL_SYNC_INTERVAL:
+                self.sync()
+
+    def sync( self ) -> None:
+        '''
+        Make every record so far durable.
+        '''
+        self.file.flush()
+        os.fsync( self.file.fileno() )
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def close( self ) -> None:
+        with self.lock:
+            self.sync()
+            self.file.close()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ) -> None:
+        self.close()
+
+def apply_phase( name: str, operation: int, files: list, apply_file, update_info: UpdateInfo, journal: UpdateJournal ) -> None:
+    '''
+    Apply one kind of change (modified, removed or added files) on vars.APPLY_WORKERS threads.
+    apply_file takes a FileChange and returns the number of bytes it wrote.
+    The journal always has the index below which every file is done, so continuing
+    an interrupted update starts there and only redoes the files that were in flight.
+    '''
+    start = 0
+    # If we're continuing from where we started, check the last thing we were on
+    if update_info:
+        # This phase was already done
+        if update_info.operation > operation:
+            return
+        if update_info.operation == operation:
+            start = update_info.last_file_num
+    journal.record( operation, start )
+
+    lock = threading.Lock()
+    finished = set()
+    next_idx = start
+    written = 0
+
+    def apply( idx: int ) -> None:
+        nonlocal next_idx, written
+        size = apply_file( files[idx] )
+        telemetry.count( files=1, bytes=size )
+        with lock:
+            written += size
+            finished.add( idx )
+            # Files finish out of order, only move the resume point past the ones that are all done
+            if idx == next_idx:
+                while next_idx in finished:
+                    finished.remove( next_idx )
+                    next_idx += 1
+                journal.record( operation, next_idx )
+
+    with telemetry.phase( 'apply_' + name.lower(), workers=vars.APPLY_WORKERS, resumed_at=start ) as phase:
+        pool = ThreadPoolExecutor( max_workers=vars.APPLY_WORKERS )
+        try:
+            # Raises the first error a file ran into
+            for _ in pool.map( apply, range( start, len( files ) ) ):
+                pass
+        finally:
+            # Don't start anything else if something failed
+            pool.shutdown( cancel_futures=True )
+    elapsed = max( phase.seconds, 1e-6 )
+    count = len( files ) - start
+    print( f'{name}: {count} files in {elapsed:.2f}s ({count / elapsed:.0f} files/s, {written / elapsed / 1e6:.1f} MB/s)' )
+
+def is_installed( change: manifest.FileChange ) -> bool:
+    '''
+    Whether the installed file is already the new build's, by its hash. False if we don't know the hash.
+    '''
+    install_path = os.path.join( vars.GAME_PATH, change.path )
+    return bool( change.sha256 ) and os.path.isfile( install_path ) and manifest.hash_file( install_path ) == change.sha256
+
+def get_missing_staged( changes: manifest.Manifest, update_info: UpdateInfo ) -> list:
+    '''
+    Paths of the files an interrupted update still has to put in place that aren't in the staging folder anymore.
+    The ones past the journal's resume point may have been moved in before the interruption,
+    they don't count if the installed file has the new hash. We can't tell for files without a hash.
+    '''
+    replacement_path = os.path.join( get_staging_path(), 'pf2' )
+    missing = []
+    for operation in ( manifest.OP_MODIFIED, manifest.OP_ADDED ):
+        # Phases that are done don't need anything anymore
+        if update_info.operation > operation:
+            continue
+        start = update_info.last_file_num if update_info.operation == operation else 0
+        for change in changes.get( operation )[start:]:
+            if not os.path.exists( os.path.join( replacement_path, change.path ) ) and not is_installed( change ):
+                missing.append( change.path )
+    return missing
+
+@telemetry.timed( 'apply' )
+def update( update_info : UpdateInfo = None, restaged: bool = False ) -> bool:
+    '''
+    Try to update the game with the downloaded build 
+    via a manifest (or diff file) downloaded from the server.
+    This assumes the downloaded game was already extracted and updates files from it.
+    When continuing an interrupted update, restaged says the staging folder was downloaded again
+    for it, so it has every file again.
+    '''
+    print( 'Applying the update...' )
+
+    # Is this the hotfix version?
+    old_version_hotfix_flag = vars.LOCAL_VERSION_STRING.endswith( '-HOTFIX' )
+
+    # Build we just downloaded in the staging folder
+    replacement_path = os.path.join( get_staging_path(), 'pf2' ) 
+    # Move the new files into the game, unless we're told to keep them
+    keep_staging = vars.KEEP_STAGING
+    # Files can only be missing from the staging folder because we moved them, if we're continuing with the same one
+    staging_complete = not update_info or restaged
 
     # Debug log file storage
     update_dbg_log = None
@@ -326,113 +1010,100 @@ def update( update_info : UpdateInfo = None ) -> bool:
 
     # Success flag
     success = False
+    journal = None
     try:
-        # Open the patch file.
-        with open( diff_path, 'r' ) as file:
-            diff_file = unidiff.PatchSet( file, metadata_only=True )
-            for idx, mod_file in enumerate( diff_file.modified_files ):
-                # Get the relative path so we can easily join the new folder with the old folder.
-                # If we're continuing from where we started, check the last thing we were on
-                if update_info:
-                    # If we're not modifying, go to the next one
-                    if update_info.operation != 0:
-                        break
-                    # Don't do anything if we're not where we continued from
-                    if idx < update_info.last_file_num:
-                        continue
-
-                # Get the relative path
-                relative_path = mod_file.path.partition( '/' )[2].partition('/')[2]
-
-                # write what we did to the update file
-                write_to_update_file( old_version_hotfix_flag, int( get_local_version_num() ), get_server_version_num(), idx, 0 )
-
-                # Get the currently installed game's path in TEMP
-                replace_path = os.path.join( replacement_path, relative_path )
-                # And the installed game we're trying to update.
-                install_path = os.path.join( vars.GAME_PATH, relative_path )
+        # Get the list of changed files.
+        changes = download_changes()
+        if not changes:
+            raise FileNotFoundError( 'Couldn\'t download the list of changed files' )
+        # Write down how far we get, so an interrupted update can continue.
+        journal = UpdateJournal( get_journal_path(), old_version_hotfix_flag, int( get_local_version_num() ), get_server_version_num() )
+        # Update the VPKs entry by entry first, and skip copying them below.
+        # The journal already has a durable record by now, so an interruption in there still continues the update.
+        vpk_files = set()
+        if vars.VPK_ENTRY_UPDATES and ( not update_info or update_info.operation == 0 ):
+            vpk_files = update_vpks( changes, replacement_path )
+
+        def log( text: str ) -> None:
+            # Write to our debug log to see what was touched
+            if vars.DEBUG:
+                with log_lock:
+                    update_dbg_log.write( text + '\n' )
 
+        def apply_modified( change: manifest.FileChange ) -> int:
+            # Already updated entry by entry
+            if change.path in vpk_files:
+                return 0
+            # Get the currently installed game's path in TEMP
+            replace_path = os.path.join( replacement_path, change.path )
+            # And the installed game we're trying to update.
+            install_path = os.path.join( vars.GAME_PATH, change.path )
+            if not os.path.exists( replace_path ):
+                # Moved into place before the update was interrupted
+                if is_installed( change ):
+                    return 0
                 # Sometimes, diff files say a file is modified when 
-                # in fact the file doesn't exist in the new one
-                # Delete it if this happens
-                if not os.path.exists( replace_path ):
-                    # Write to our debug log to see what was touched
-                    if vars.DEBUG:
-                        update_dbg_log.write( "Removed: " + relative_path + '\n' )
-                    # Delete it from our build as we no longer need it anymore
-                    os.remove( install_path )
-                    continue
-                # Write to our debug log to see what was touched
-                if vars.DEBUG:
-                    update_dbg_log.write( "Modified: " + relative_path + '\n' )
-                # Update this file with the replacement one
-                copy2( replace_path, install_path )
-            for idx, rem_file in enumerate( diff_file.removed_files ):
-                # Get the relative path so we can easily join the new folder with the old folder.
-                # If we're continuing from where we started, check the last thing we were on
-                if update_info:
-                    # If we're not modifying, go to the next one
-                    if update_info.operation != 1:
-                        break
-                    # Don't do anything if we're not where we continued from
-                    if idx < update_info.last_file_num:
-                        continue
-                # Get the relative path
-                relative_path = rem_file.path.partition( '/' )[2].partition('/')[2]
-                
-                # Get the currently installed game's path in TEMP
-                replace_path = os.path.join( replacement_path, relative_path )
-                # And the installed game we're trying to update
-                install_path = os.path.join( vars.GAME_PATH, relative_path )
-
-                # Remove this file.
-                if vars.DEBUG:
-                    update_dbg_log.write( "Removed: " + relative_path + '\n' ) 
-                # Write our progress in the update file
-                write_to_update_file( old_version_hotfix_flag, int( get_local_version_num() ), get_server_version_num(), idx, 1 )
-
-                # Remove the file.
-                os.remove( os.path.join( vars.GAME_PATH, relative_path ) )
-            for idx, added_file in enumerate( diff_file.added_files ):
-                # If we're continuing from where we started, check the last thing we were on
-                if update_info:
-                    # This shouldn't happen, but break if we're here and somehow operation isn't 2
-                    if update_info.operation != 2:
-                        break
-                    # Go to the file from the update info
-                    if idx < update_info.last_file_num:
-                        continue
-                # Get the relative path so we can easily join the new folder with the old folder.
-                relative_path = added_file.path.partition( '/' )[2].partition('/')[2]
-                
-                # Write to our debug log
-                if vars.DEBUG:
-                    update_dbg_log.write( "Added: " + relative_path + '\n' )
-                
-                # Write to the update file.
-                write_to_update_file( old_version_hotfix_flag, int( get_local_version_num() ), get_server_version_num(), idx, 2 )
-
-                # New downloaded game path
-                replace_path = os.path.join( replacement_path, relative_path )
-                # Install path
-                install_path = os.path.join( vars.GAME_PATH, relative_path )
-
-                # If we don't have a folder for this new file, make one
-                if not os.path.exists( os.path.join( install_path, '../' ) ):
-                    os.mkdir( os.path.join( install_path, '../' )  )
-
-                # Get the file
-                copy2( replace_path, install_path )
-            # Set the flag after we're done
-            success = True
+                # in fact the file doesn't exist in the new one (manifests don't do this)
+                # Delete it if this happens. We can only tell when the staging folder has everything.
+                if change.sha256 or not staging_complete:
+                    raise FileNotFoundError( f'{change.path} is missing from the staging folder' )
+                log( 'Removed: ' + change.path )
+                delete_file_if_exists( install_path )
+                return 0
+            log( 'Modified: ' + change.path )
+            # Swap in the replacement one
+            fileops.place_file( replace_path, install_path, keep_staging )
+            return os.path.getsize( install_path )
+
+        def apply_removed( change: manifest.FileChange ) -> int:
+            log( 'Removed: ' + change.path )
+            install_path = os.path.join( vars.GAME_PATH, change.path )
+            # Patches can remove a whole folder
+            if os.path.isdir( install_path ):
+                delete_folder_if_exists( install_path )
+            # It may already be gone if we're continuing an interrupted update
+            delete_file_if_exists( install_path )
+            return 0
+
+        def apply_added( change: manifest.FileChange ) -> int:
+            log( 'Added: ' + change.path )
+            replace_path = os.path.join( replacement_path, change.path )
+            install_path = os.path.join( vars.GAME_PATH, change.path )
+            # Moved into place before the update was interrupted
+            if not os.path.exists( replace_path ) and is_installed( change ):
+                return 0
+            # Patches can add a whole folder
+            if os.path.isdir( replace_path ):
+                fileops.place_tree( replace_path, install_path, keep_staging )
+                return 0
+            fileops.place_file( replace_path, install_path, keep_staging )
+            return os.path.getsize( install_path )
+
+        log_lock = threading.Lock()
+        apply_phase( 'Modified', manifest.OP_MODIFIED, changes.get( manifest.OP_MODIFIED ), apply_modified, update_info, journal )
+        apply_phase( 'Removed', manifest.OP_REMOVED, changes.get( manifest.OP_REMOVED ), apply_removed, update_info, journal )
+        # Make the folders of new files first, parents before children, so the copies don't race each other.
+        added_files = changes.get( manifest.OP_ADDED )
+        for folder in sorted( { os.path.dirname( os.path.join( vars.GAME_PATH, change.path ) ) for change in added_files } ):
+            os.makedirs( folder, exist_ok=True )
+        apply_phase( 'Added', manifest.OP_ADDED, added_files, apply_added, update_info, journal )
+        # Set the flag after we're done
+        success = True
     except Exception:
         # Something happened, error out
         message.print_exception_error_dbg()
 
-    # Delete the update file. We're done with it.
-    delete_file_if_exists( os.path.join( vars.GAME_PATH, 'update_file' ) )
-    # Delete that patch file too.
-    delete_file_if_exists( diff_path )
+    if journal:
+        journal.close()
+    # Delete the journal if we're done with it. Keep it if we failed, so the update continues next time.
+    if success:
+        delete_file_if_exists( get_journal_path() )
+        delete_file_if_exists( get_patch_index_path() )
+        # What's left in the staging folder is of no use anymore
+        if not keep_staging:
+            delete_folder_if_exists( get_staging_path() )
+    # Delete the manifest or patch file too.
+    delete_changes()
 
     # Close the update debug log
     if vars.DEBUG:
@@ -442,127 +1113,545 @@ def update( update_info : UpdateInfo = None ) -> bool:
     return success
 
 
+def fetch_patch_index() -> planner.PatchIndex:
+    '''
+    Download the list of patches on the server and what they cost. None if the server doesn't have one we understand.
+    '''
+    import net
+    try:
+        with net.get( vars.WEBSITE_URL + vars.PATCH_INDEX_NAME ) as response:
+            response.raise_for_status()
+            return planner.parse_patch_index( response.json() )
+    except Exception:
+        message.print_exception_error_dbg()
+        return None
+
+def get_throughput() -> planner.Throughput:
+    '''
+    How fast this machine downloads, decompresses and writes, as measured by earlier runs (see telemetry.py),
+    or the vars.PREFLIGHT_*_RATE defaults for what wasn't measured yet. Small files don't say much about it, so they're left out.
+    '''
+    return planner.Throughput( telemetry.get_throughput( ( 'download', 'download_extract', 'fetch_changed_files' ), 'download_mb_per_s',
+                                                         lambda record: record['downloaded'] >= 1e6 ) or vars.PREFLIGHT_DOWNLOAD_RATE,
+                               # Extracting only the changed files decompresses more than it writes
+                               telemetry.get_throughput( ( 'extract', 'download_extract' ), 'mb_per_s',
+                                                         lambda record: record['bytes'] >= 1e6 and 'skipped_members' not in record ) or vars.PREFLIGHT_EXTRACT_RATE,
+                               telemetry.get_throughput( ( 'apply', ), 'mb_per_s',
+                                                         lambda record: record['bytes'] >= 1e6 ) or vars.PREFLIGHT_WRITE_RATE )
+
+def estimate_update( patch_index: planner.PatchIndex = None ) -> list:
+    '''
+    An Estimate of what each way of updating to the server's version downloads, puts on disk and writes into the game.
+    Sizes come from the server's member index of the latest build, or its build manifest, and from the update's manifest or patch.
+    '''
+    import pack
+    latest_version = vars.SERVER_VERSION_STRING
+    estimates = []
+
+    # Size of every file of the latest build, and what it costs to download from the pack
+    index = pack.fetch_index() if vars.PARTIAL_FETCH else None
+    if index and index['version'] != latest_version:
+        index = None
+    if index:
+        files = { member['path']: ( member['length'], member['size'] ) for member in index['members'] }
+    else:
+        build = fetch_build_manifest()
+        files = { 'pf2/' + change.path: ( change.size, change.size ) for change in build.files } if build else {}
+
+    # The tar file, unless the cache has this version of it. One left in the working folder is downloaded again.
+    have_tar = artifacts.is_cached( vars.FILE_NAME, latest_version )
+    tar_size = max( artifacts.get_remote_info( vars.FILE_URL )[0], 0 )
+    # Without a list of its files, the build is at least as big as its tar file
+    build_size = sum( length for length, _ in files.values() ) or tar_size
+    tar_download = 0 if have_tar else tar_size
+    # The tar file is written to the working folder too, unless it's only streamed
+    tar_written = not ( vars.STREAM_EXTRACT and not have_tar ) or vars.STREAM_TEE or ( vars.ARTIFACT_CACHE and vars.CACHE_STREAMED_BUILDS )
+    tar_saved = tar_size if tar_written else 0
+    # and kept in the cache
+    tar_cached = tar_download if vars.ARTIFACT_CACHE and tar_written else 0
+
+    changes = download_changes()
+    if changes:
+        changed = changes.get( manifest.OP_MODIFIED ) + changes.get( manifest.OP_ADDED )
+        wanted = set( 'pf2/' + change.path for change in changed )
+        changed_files = [ sizes for path, sizes in files.items() if pack.is_wanted( path, wanted ) ]
+        # Patches don't have the sizes of the files, manifests do. Without either, assume the worst.
+        changed_size = sum( length for length, _ in changed_files ) or sum( change.size for change in changed ) or \
+                       ( build_size if changed else 0 )
+        estimates.append( planner.Estimate( planner.STRATEGY_ARCHIVE, download=tar_download,
+                                            staging=changed_size if vars.EXTRACT_CHANGED_ONLY else build_size, saved=tar_saved,
+                                            cached=tar_cached, write=changed_size, extract=build_size ) )
+        if index:
+            estimates.append( planner.Estimate( planner.STRATEGY_PARTIAL, download=sum( size for _, size in changed_files ),
+                                                staging=changed_size, write=changed_size ) )
+
+    hops = planner.plan( patch_index, vars.LOCAL_VERSION_STRING, latest_version ) if patch_index else None
+    if hops:
+        # Every patch is staged and applied before the next one
+        hop_sizes = [ get_hop_size( hop ) for hop in hops ]
+        estimates.append( planner.Estimate( planner.STRATEGY_PATCHES, download=sum( hop.size for hop in hops ), staging=max( hop_sizes ),
+                                            write=sum( hop_sizes ), hops=hops ) )
+    # Last, so it's only picked on a tie if nothing else can be.
+    # Only when the server knows this update: failing to get the list of changed files isn't a reason to take the whole build.
+    if changes or hops is not None:
+        estimates.append( planner.Estimate( planner.STRATEGY_FULL, download=tar_download, staging=build_size, saved=tar_saved,
+                                            cached=tar_cached, write=build_size, extract=build_size ) )
+    return estimates
+
+def get_hop_size( hop: planner.Hop ) -> int:
+    '''
+    Bytes of the files one patch of a chain writes, from its manifest. What the patch downloads if it has no manifest to tell.
+    '''
+    local_version, server_version = vars.LOCAL_VERSION_STRING, vars.SERVER_VERSION_STRING
+    vars.LOCAL_VERSION_STRING, vars.SERVER_VERSION_STRING = hop.old_version, hop.new_version
+    try:
+        changes = download_changes()
+        # The changes of the whole update are still needed, the others are fetched again (from the cache) if this chain is picked
+        if ( hop.old_version, hop.new_version ) != ( local_version, server_version ):
+            delete_changes()
+        if not changes:
+            return hop.size
+        return sum( change.size for change in changes.get( manifest.OP_MODIFIED ) + changes.get( manifest.OP_ADDED ) ) or hop.size
+    finally:
+        vars.LOCAL_VERSION_STRING, vars.SERVER_VERSION_STRING = local_version, server_version
+
+def get_existing_folder( path: str ) -> str:
+    '''
+    path, or the closest folder above it that exists.
+    '''
+    path = os.path.abspath( path )
+    while not os.path.isdir( path ) and os.path.dirname( path ) != path:
+        path = os.path.dirname( path )
+    return path
+
+def check_disk_space( estimate: planner.Estimate ) -> list:
+    '''
+    The disks without room for an estimate, as ( folder, bytes needed, bytes free ). Empty if it fits.
+    vars.PREFLIGHT_DISK_MARGIN has to be left free on each of them.
+    '''
+    staging_path = get_existing_folder( get_staging_path() )
+    game_path = get_existing_folder( vars.GAME_PATH )
+    needs = [ ( staging_path, estimate.staging ), ( os.getcwd(), estimate.saved ) ]
+    # Staged files are moved into the game, unless they're kept or on another disk
+    if vars.KEEP_STAGING or os.stat( staging_path ).st_dev != os.stat( game_path ).st_dev:
+        needs.append( ( game_path, estimate.write ) )
+    if vars.ARTIFACT_CACHE and estimate.cached:
+        cache_path = get_existing_folder( vars.ARTIFACT_CACHE_PATH )
+        # Downloads are moved or hardlinked into a cache on the same disk, they only take room once there
+        if os.stat( cache_path ).st_dev != os.stat( os.getcwd() ).st_dev:
+            needs.append( ( cache_path, estimate.cached ) )
+
+    # Add up what goes on the same disk
+    disks = {}
+    for folder, size in needs:
+        device = os.stat( folder ).st_dev
+        disk_folder, total = disks.get( device, ( folder, 0 ) )
+        disks[device] = ( disk_folder, total + size )
+    short = []
+    for folder, needed in disks.values():
+        free = disk_usage( folder ).free
+        if needed and needed + vars.PREFLIGHT_DISK_MARGIN > free:
+            short.append( ( folder, needed, free ) )
+    return short
+
+@telemetry.timed( 'preflight' )
+def preflight_update( patch_index: planner.PatchIndex = None ) -> planner.Estimate:
+    '''
+    Plan the update to the server's version before downloading anything big: pick the way that should finish first
+    out of the ones there's disk space for, and say what it will cost.
+    None if no way fits on disk (or we couldn't tell), the update shouldn't be started then.
+    '''
+    print( 'Planning the update...' )
+    try:
+        estimates = estimate_update( patch_index )
+        throughput = get_throughput()
+        fitting = [ estimate for estimate in estimates if not check_disk_space( estimate ) ]
+        chosen = planner.choose( fitting, throughput )
+    except Exception:
+        message.print_exception_error_dbg()
+        return None
+    if not estimates:
+        print( 'Couldn\'t get the list of files this update changes from the server. Try again later.' )
+        telemetry.note( strategy=None, refused=True )
+        return None
+
+    if not chosen:
+        # Say what the quickest way would need
+        quickest = planner.choose( estimates, throughput )
+        for folder, needed, free in check_disk_space( quickest ):
+            print( f'Not enough disk space to update: {folder} needs {( needed + vars.PREFLIGHT_DISK_MARGIN ) / 1e6:.1f} MB free and has {free / 1e6:.1f} MB.' )
+        print( 'Free up some space and try again.' )
+        telemetry.note( strategy=None, refused=True )
+        return None
+
+    names = { planner.STRATEGY_PATCHES: f'through {len( chosen.hops or [] )} patches',
+              planner.STRATEGY_PARTIAL: 'fetching only the changed files',
+              planner.STRATEGY_ARCHIVE: 'taking the changed files out of the full build',
+              planner.STRATEGY_FULL: 'comparing the game with the full build' }
+    eta = f'{chosen.seconds / 60:.0f} minutes' if chosen.seconds >= 90 else f'{max( chosen.seconds, 1 ):.0f} seconds'
+    print( f'Updating {names[chosen.strategy]}: {chosen.download / 1e6:.1f} MB to download, {( chosen.staging + chosen.saved ) / 1e6:.1f} MB of disk, '
+           f'{chosen.write / 1e6:.1f} MB to write into the game, about {eta}.' )
+    telemetry.note( strategy=chosen.strategy, estimated_seconds=round( chosen.seconds, 2 ), estimated_download=chosen.download,
+                    estimated_staging=chosen.staging + chosen.saved, estimated_write=chosen.write )
+    return chosen
+
+def update_from_build() -> bool:
+    '''
+    Update the game to the full latest build in the staging folder file by file, with a manifest of what differs made here.
+    Files the build doesn't have (custom content, configs...) are left alone, nothing is removed.
+    The manifest is saved as the update's, so an interrupted update continues like any other.
+    '''
+    print( 'Comparing the game with the full build...' )
+    try:
+        changes = manifest.make_manifest( vars.GAME_PATH, os.path.join( get_staging_path(), 'pf2' ),
+                                          vars.LOCAL_VERSION_STRING, vars.SERVER_VERSION_STRING )
+        changes.files = [ change for change in changes.files if change.operation != manifest.OP_REMOVED ]
+        manifest.save_manifest( changes, get_patch_name().replace( '.patch', '.manifest.json' ) )
+    except Exception:
+        message.print_exception_error_dbg()
+        return False
+    return update()
+
+@telemetry.timed( 'update_to_latest' )
+def update_to_latest( patch_index: planner.PatchIndex = None, chosen: planner.Estimate = None ) -> bool:
+    '''
+    Update the installed version to the server's version the way preflight_update() picks (chosen, if it was already picked):
+    through the cheapest chain of patches, only the changed files, or the files that differ from the full build.
+    Every finished patch leaves the game at its version, so an interrupted chain picks up after the last finished one.
+    Nothing is done if there isn't enough disk space for any of them.
+    '''
+    latest_version = vars.SERVER_VERSION_STRING
+    if not chosen:
+        chosen = preflight_update( patch_index or fetch_patch_index() )
+        if not chosen:
+            return False
+    telemetry.note( strategy=chosen.strategy )
+
+    if chosen.strategy in ( planner.STRATEGY_FULL, planner.STRATEGY_PATCHES ):
+        # The changes straight to the server's version were only needed for the estimates
+        delete_changes()
+    if chosen.strategy == planner.STRATEGY_FULL:
+        print( 'Downloading the full build is the quickest, updating the game from it...' )
+        return download_build() and update_from_build()
+    if chosen.strategy == planner.STRATEGY_PARTIAL:
+        return download_update() and update()
+    if chosen.strategy == planner.STRATEGY_ARCHIVE:
+        return extract_changed_files() and update()
+
+    hops = chosen.hops
+    telemetry.note( hops=len( hops ) )
+    success = True
+    for hop in hops:
+        vars.LOCAL_VERSION_STRING = hop.old_version
+        vars.SERVER_VERSION_STRING = hop.new_version
+        print( f'Updating from {hop.old_version} to {hop.new_version}...' )
+        if not download_update( hop.index or None, hop.new_version == latest_version ) or not update():
+            success = False
+            break
+    vars.SERVER_VERSION_STRING = latest_version
+    return success
+
+def find_version( number: int, hotfix_flag: bool, versions: list ) -> str:
+    '''
+    The version string out of versions with this version number.
+    If none has it, the version string is made from the number (73 -> 0.7.3, 70 -> 0.7).
+    '''
+    for version in versions:
+        if version and version.endswith( '-HOTFIX' ) == hotfix_flag and get_version_num( version ) == number:
+            return version
+    # The inverse of get_version_num
+    version = f'0.{number // 10}' if number % 10 == 0 else f'0.{number // 10}.{number % 10}'
+    return version + '-HOTFIX' if hotfix_flag else version
+
+@telemetry.timed( 'continue_update' )
 def continue_update() -> bool:
     '''
     Function to set up variables so that the update can be continued. 
+    The interrupted update may be one patch of a chain, that patch is finished first and then the rest of the chain.
     '''
     print( 'It appears an update was interrupted. Continuing.' )
     # Get the update file so we can continue updating
-    update_info = parse_update_file()
+    update_info = recover_update()
+    latest_version = vars.SERVER_VERSION_STRING
 
-    # Check if some files are still there
-    # Redownload if this doesn't exist
-    if not os.path.exists( vars.FILE_NAME ):
-        download()
-    
-    # extract if this doesn't exist.
-    if not os.path.exists( 'pf2_new' ):
-        extract()
-    
-    # Add -HOTFIX to the local version we have.
-    if update_info.hotfix_flag:
-        vars.LOCAL_VERSION_STRING += '-HOTFIX' 
+    # Versions the update could have been between
+    patch_index = fetch_patch_index()
+    versions = [ vars.LOCAL_VERSION_STRING, vars.SERVER_VERSION_STRING ]
+    if patch_index:
+        versions += [ hop.old_version for hop in patch_index.hops ] + [ hop.new_version for hop in patch_index.hops ]
+    old_version = find_version( update_info.old_version, update_info.hotfix_flag, versions )
+    new_version = find_version( update_info.new_version, False, versions )
+    # The installed version may already be the new one, if version.txt was updated before we were interrupted.
+    vars.LOCAL_VERSION_STRING = old_version
+    vars.SERVER_VERSION_STRING = new_version
+
+    # The pack of this patch, if it's part of a chain
+    index_name = None
+    if patch_index:
+        index_name = next( ( hop.index for hop in patch_index.hops if hop.old_version == vars.LOCAL_VERSION_STRING and
+                             hop.new_version == vars.SERVER_VERSION_STRING ), None ) or None
+
+    # Check if the new files are still there, get them again if they aren't
+    changes = download_changes()
+    restaged = False
+    if not os.path.exists( get_staging_path() ) or not changes or get_missing_staged( changes, update_info ):
+        # Keep the journal, we can try again next time.
+        if not download_update( index_name, vars.SERVER_VERSION_STRING == latest_version ):
+            print( 'Couldn\'t download the update\'s files again. It\'ll continue next time.' )
+            vars.SERVER_VERSION_STRING = latest_version
+            return False
+        restaged = True
     
     # Continue updating.
-    return update( update_info=update_info ) 
+    success = update( update_info=update_info, restaged=restaged ) 
+    vars.SERVER_VERSION_STRING = latest_version
 
-def install() -> bool:
+    # Then the rest of the chain
+    if success and new_version != latest_version:
+        vars.LOCAL_VERSION_STRING = new_version
+        success = update_to_latest( patch_index )
+    return success
+
+def fetch_build_manifest() -> manifest.Manifest:
     '''
-    Function to install PF2 into the sourcemods folder. If there is already a build there, then
-    the user will be asked if they wish to delete it and install over it. Otherwise, nothing will happen.
-    True if it was done successfully, False if something went wrong
+    Download the manifest of the latest build. None if the server doesn't have one we understand.
     '''
-    print( 'Installing Pre-Fortress 2 to the sourcemods folder...' )
+    # Always get a fresh one, it changes with every release.
+    delete_file_if_exists( vars.BUILD_MANIFEST_NAME )
+    if not download_file( vars.WEBSITE_URL + vars.BUILD_MANIFEST_NAME ):
+        return None
+    try:
+        build = manifest.load_manifest( vars.BUILD_MANIFEST_NAME )
+        if build.new_version == vars.SERVER_VERSION_STRING:
+            return build
+    except Exception:
+        message.print_exception_error_dbg()
+    finally:
+        delete_file_if_exists( vars.BUILD_MANIFEST_NAME )
+    return None
 
-    # This is where the extracted contents are. 
-    temp_install = os.path.join( 'pf2_new', 'pf2' )
+@telemetry.timed( 'verify' )
+def verify_game() -> 'verify.VerifyResult':
+    '''
+    Check every installed file against the manifest of the latest build.
+    The game has to be up to date, the server only has the manifest of the latest build.
+    None if the game couldn't be verified.
+    '''
+    import verify
+    print( 'Verifying the game files...' )
+
+    if not check_game_installation():
+        print( 'Pre-Fortress 2 is not installed on this device.' )
+        return None
+    vars.LOCAL_VERSION_STRING = check_game_version()
+    vars.SERVER_VERSION_STRING = check_server_version()
+    if vars.LOCAL_VERSION_STRING != vars.SERVER_VERSION_STRING:
+        print( 'Your game is out of date. Update it before verifying it.' )
+        return None
+
+    build = fetch_build_manifest()
+    if not build:
+        print( 'Couldn\'t download the list of files of the latest build.' )
+        return None
+
+    result = None
+    try:
+        result = verify.verify( build, vars.GAME_PATH )
+        telemetry.count( files=result.checked )
+        telemetry.note( hashed=result.hashed, missing=len( result.missing ), damaged=len( result.damaged ) )
+        print( f'Checked {result.checked} files, hashed {result.hashed} of them.' )
+        for change in result.missing:
+            print( 'Missing: ' + change.path )
+        for change in result.damaged:
+            print( 'Damaged: ' + change.path )
+    except Exception:
+        message.print_exception_error_dbg()
+    return result
+
+@telemetry.timed( 'repair' )
+def repair_game() -> bool:
+    '''
+    Verify the game, then download only the files that are missing or damaged and put them in place.
+    They're fetched from the server's pack of the latest build with Range requests, so a broken file
+    costs only its own bytes. Without a pack, the whole build is downloaded, but still only those files are replaced.
+    True if everything is okay afterwards.
+    '''
+    import pack
+    result = verify_game()
+    if not result:
+        return False
+    if result.ok:
+        print( 'Every file is okay, nothing to repair.' )
+        return True
+
+    broken = result.missing + result.damaged
+    print( f'Repairing {len( broken )} files...' )
+    staging_path = get_staging_path()
+    # Build we get the good files from
+    replacement_path = os.path.join( staging_path, 'pf2' )
+
+    success = False
+    try:
+        index = pack.fetch_index() if vars.PARTIAL_FETCH else None
+        fetched = False
+        if index and index['version'] == vars.SERVER_VERSION_STRING:
+            # Fetch to a temporary folder so a half fetched repair never looks like a finished one.
+            if pack.fetch_members( index, [ 'pf2/' + change.path for change in broken ], staging_path + '.partial' ):
+                delete_folder_if_exists( staging_path )
+                os.replace( staging_path + '.partial', staging_path )
+                fetched = True
+        if not fetched and not download_build():
+            raise FileNotFoundError( 'Couldn\'t download the latest build' )
+
+        failed = []
+        for change in broken:
+            replace_path = os.path.join( replacement_path, *change.path.split( '/' ) )
+            install_path = os.path.join( vars.GAME_PATH, *change.path.split( '/' ) )
+            if not os.path.exists( replace_path ):
+                failed.append( change.path )
+                continue
+            os.makedirs( os.path.dirname( install_path ), exist_ok=True )
+            fileops.place_file( replace_path, install_path, vars.KEEP_STAGING )
+        for path in failed:
+            print( 'Couldn\'t repair: ' + path )
+        success = not failed
+    except Exception:
+        message.print_exception_error_dbg()
+
+    # What's left in the staging folder is of no use anymore
+    if success and not vars.KEEP_STAGING:
+        delete_folder_if_exists( staging_path )
+    return success
+
+def get_sibling_path( suffix: str ) -> str:
+    '''
+    Path of a folder next to the game folder, named after it (pf2.old, pf2.new...)
+    '''
+    return os.path.abspath( vars.GAME_PATH ) + suffix
+
+def swap_in_build( new_path: str ) -> None:
+    '''
+    Make the tree at new_path the game folder with two renames. The installed game is kept as pf2.old.
+    If the new tree can't be put in place, the old game is put back.
+    '''
+    old_path = get_sibling_path( '.old' )
+    delete_folder_if_exists( old_path )
+    had_game = os.path.exists( vars.GAME_PATH )
+    if had_game:
+        os.replace( vars.GAME_PATH, old_path )
+    try:
+        os.replace( new_path, vars.GAME_PATH )
+    except Exception:
+        if had_game:
+            os.replace( old_path, vars.GAME_PATH )
+        raise
+    # Make the renames themselves durable
+    fileops.fsync_file( os.path.dirname( os.path.abspath( vars.GAME_PATH ) ) )
+
+def delete_old_build() -> threading.Thread:
+    '''
+    Delete pf2.old on another thread, so we don't wait for it.
+    '''
+    thread = threading.Thread( target=rmtree, args=( get_sibling_path( '.old' ), ), kwargs={ 'ignore_errors': True } )
+    thread.start()
+    return thread
+
+def rollback_install() -> bool:
+    '''
+    Put the previous build (pf2.old) back in place of the installed one, which gets deleted.
+    True if it was done successfully, False if there's nothing to go back to or something went wrong
+    '''
+    old_path = get_sibling_path( '.old' )
+    if not os.path.exists( old_path ):
+        print( 'There is no previous build to go back to.' )
+        return False
 
-    # success flag to indicate that we did this completely.
     success = False
     try:
+        failed_path = get_sibling_path( '.failed' )
+        delete_folder_if_exists( failed_path )
         if os.path.exists( vars.GAME_PATH ):
-            if message.message_yes_no( 'WARNING: Pre-Fortess 2 will be removed. Do you wish to continue?' ):
-                # Delete everything in the folder after consent has been given
-                for file in os.listdir( vars.GAME_PATH ):
-                    # Relative path to the game directory
-                    rel_path = os.path.join( vars.GAME_PATH, file )
-                    # Call the proper removal function if it's a file or directory.
-                    if os.path.isfile( rel_path ):
-                        os.unlink( rel_path )
-                    if os.path.isdir( rel_path ):
-                        rmtree( rel_path )
-            else: # If no, return early, the user didn't want to remove the game.
-                return True
-            
-        else: # PF2 wasn't detected, make the pf2 folder
-            os.mkdir( vars.GAME_PATH )
-
-        # Copy the contents to the game directory.
-        for file in os.listdir( temp_install ):
-            # Relative path to the new downloaded version
-            rel_path = os.path.join( temp_install, file )
-            # Destination path to the game path
-            dest_path = os.path.join( vars.GAME_PATH, file )
-            # Do the appropriate copy function for a file or directory.
-            if os.path.isfile( rel_path ):
-                copy2( rel_path, dest_path )
-            if os.path.isdir( rel_path ):
-                copytree( rel_path, dest_path )
-        # Mark that we succeeded
+            os.replace( vars.GAME_PATH, failed_path )
+        os.replace( old_path, vars.GAME_PATH )
+        delete_folder_if_exists( failed_path )
         success = True
     except Exception:
         message.print_exception_error_dbg()
     return success
 
-def write_to_update_file( hotfix_flag: bool, old_version: int, new_version: int, idx: int, operation: int ) -> None:
+@telemetry.timed( 'install' )
+def install_build() -> bool:
     '''
-    Function to write to an update file while we're updating the game.
-    Overwrite every time we update anything to keep our space to continue
-    Arguments:
-    hotfix_flag indicates that this version is a hotfix.
-    old_version is the version we're updating from
-    new_version is the version we're updating to
-    idx is part of the index of files we left off from in updater.py's update function
-    operation is either 0, 1, or 2 which is modified, removed, added, respectively
+    Make the build in the staging folder the game folder.
+    It's put together next to the game folder (pf2.new) and swapped in with a rename,
+    so the game is never missing or half there. The old build is kept as pf2.old until it's deleted in the background,
+    or until the next install if vars.KEEP_OLD_BUILD is on, so rollback_install() can bring it back.
+    True if it was done successfully, False if something went wrong
     '''
-    # Go to the update file path
-    update_file_path = os.path.join( vars.GAME_PATH, 'update_file' )
-    # Write the format as binary to the file_path
-    with open( update_file_path, 'wb') as file:
-        file.write( hotfix_flag.to_bytes( 2 ) + old_version.to_bytes( 2 ) + new_version.to_bytes( 2 ) + idx.to_bytes( 2 ) + operation.to_bytes( 2 ) )
+    # This is where the extracted contents are. 
+    temp_install = os.path.join( get_staging_path(), 'pf2' )
+    # This is where the new game folder is put together.
+    new_path = get_sibling_path( '.new' )
+
+    # success flag to indicate that we did this completely.
+    success = False
+    try:
+        # Put the new tree together. It's one rename if the staging folder is next to the game,
+        # otherwise its files are cloned or copied.
+        delete_folder_if_exists( new_path )
+        fileops.place_tree( temp_install, new_path, vars.KEEP_STAGING )
+        # Everything has to be on disk before it becomes the game.
+        fileops.fsync_tree( new_path )
+        swap_in_build( new_path )
+
+        # What's left in the staging folder is of no use anymore
+        if not vars.KEEP_STAGING:
+            delete_folder_if_exists( get_staging_path() )
+        if not vars.KEEP_OLD_BUILD:
+            delete_old_build()
+        # Mark that we succeeded
+        success = True
+    except Exception:
+        message.print_exception_error_dbg()
+        try:
+            # Put the new build back in the staging folder, so it doesn't have to be downloaded again
+            if os.path.exists( new_path ) and not os.path.exists( temp_install ):
+                fileops.place_tree( new_path, temp_install )
+            delete_folder_if_exists( new_path )
+        except Exception:
+            message.print_exception_error_dbg()
+    return success
 
-def parse_update_file() -> UpdateInfo:
+def install() -> bool:
     '''
-    Function to parse the update file so that we can continue from where we stopped.
+    Function to install PF2 into the sourcemods folder. If there is already a build there, then
+    the user will be asked if they wish to delete it and install over it. Otherwise, nothing will happen.
+    True if it was done successfully, False if something went wrong
     '''
-    update_path = os.path.join( vars.GAME_PATH, 'update_file' )
-    # How?
-    if not os.path.exists( update_path ):
-        return None
-    # Append the bytes to a list
-    result = []
-    # Open the update file
-    with open( update_path, 'rb' ) as update_file:
-        # Loop through the file by two bytes
-        while byte := update_file.read( 2 ):
-            result.append( byte )
-            
-    # Return an UpdateInfo object based on the file we just read
-    return UpdateInfo( result[0], result[1], result[2], result[3], result[4] )
-        
-def delete_all_temp_files() -> None:
+    print( 'Installing Pre-Fortress 2 to the sourcemods folder...' )
+
+    if os.path.exists( vars.GAME_PATH ):
+        if not message.message_yes_no( 'WARNING: Pre-Fortess 2 will be removed. Do you wish to continue?' ):
+            # If no, return early, the user didn't want to remove the game.
+            return True
+
+    return install_build()
+
+@telemetry.timed( 'cleanup' )
+def delete_all_temp_files( dry_run: bool = False ) -> cleanup.CleanupResult:
     '''
     Function to delete all temp files (.cache and .tmp)
+    With dry_run, only count them and their size. None if the game isn't installed.
     '''
     if not check_game_installation():
-        return
-
-    # Look through all directories for any temp files
-    for root, __, files in os.walk( vars.GAME_PATH ):
-        for tmp_file in files:
-            # Is this file a temp file?
-            if tmp_file.endswith( '.cache' ) or tmp_file.endswith( '.tmp' ):
-                # If so, delete it
-                os.remove( os.path.join( root, tmp_file ) )
+        return None
 
-    print( 'Cleared all cache files.' )
\ No newline at end of file
+    # Look through the directories that can have temp files
+    result = cleanup.delete_temp_files( vars.GAME_PATH, dry_run )
+    telemetry.count( files=result.files, bytes=result.size )
+    telemetry.note( dry_run=dry_run )
+    if dry_run:
+        print( f'Found {result.files} cache files ({result.size / 1e6:.1f} MB).' )
+    else:
+        print( f'Cleared all cache files ({result.files} files, {result.size / 1e6:.1f} MB).' )
+    return result
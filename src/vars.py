@@ -11,6 +11,95 @@ WEBSITE_URL = 'https://dl.prefortress.com/latest/'
 FILE_NAME = 'latest.tar.gz'
 # latest file
 FILE_URL = WEBSITE_URL + FILE_NAME
+# Index of every file in the latest build, so updates can download only the files that changed.
+INDEX_FILE_NAME = 'latest.index.json'
+# Manifest of every file in the latest build with its size and hash, for verifying an install.
+BUILD_MANIFEST_NAME = 'latest.manifest.json'
+# List of the patches on the server and what they cost, to plan updates that skip versions.
+PATCH_INDEX_NAME = 'patches.json'
+# Folder on the server with the binary deltas between two versions, as DELTA_URL.format( old, new ).
+DELTA_URL = WEBSITE_URL + 'deltas/{}-{}/'
+# Files that get binary deltas.
+DELTA_EXTENSIONS = ( '.vpk', '.bsp', '.so', '.dll', '.dylib' )
+# Where the patch files are hosted.
+PATCH_URL = 'https://raw.githubusercontent.com/Pre-Fortress-2/Updater/main/'
+
+# HTTP client settings used by net.py
+# Hosts that get their own kept-alive connection pool.
+HTTP_HOSTS = ( 'https://dl.prefortress.com/', 'https://raw.githubusercontent.com/' )
+# Max connections kept open per host.
+HTTP_POOL_SIZE = 8
+# Seconds to wait for a connection, and for data once connected.
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 30
+# How many times to retry a failed request, the exponential backoff factor between retries,
+# and the max random seconds added on top of the backoff.
+HTTP_RETRIES = 5
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_BACKOFF_JITTER = 1.0
+# Bytes read from the network at a time when downloading. The segmented download grows its reads up to DOWNLOAD_BUFFER_MAX.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_BUFFER_MAX = 4 * 1024 * 1024
+# Connections used at once to download a big file, and the smallest piece each of them fetches.
+DOWNLOAD_CONNECTIONS = 4
+DOWNLOAD_SEGMENT_MIN_SIZE = 8 * 1024 * 1024
+# Files smaller than this are downloaded over a single connection.
+DOWNLOAD_SEGMENTED_MIN_SIZE = 32 * 1024 * 1024
+# Seconds between progress bar redraws.
+PROGRESS_INTERVAL = 0.25
+# Extract the game while it downloads instead of downloading latest.tar.gz first. The tar file is never written then,
+# unless STREAM_TEE or CACHE_STREAMED_BUILDS say otherwise.
+STREAM_EXTRACT = True
+# Also save latest.tar.gz to disk while stream extracting (it goes into the artifact cache too, if that's on).
+STREAM_TEE = False
+# Downloaded chunks that can wait to be extracted while stream extracting.
+STREAM_QUEUE_SIZE = 256
+# Download only the changed files of an update when the server has a member index.
+PARTIAL_FETCH = True
+# When an update has to fall back on the whole build, only write the files it changes out of the tar file.
+EXTRACT_CHANGED_ONLY = True
+# Changed files closer together than this in the server's pack are fetched with one Range request,
+# up to this many bytes per request.
+RANGE_MERGE_GAP = 256 * 1024
+RANGE_GROUP_MAX_SIZE = 64 * 1024 * 1024
+# Update modified VPK archives entry by entry instead of copying their whole chunks.
+VPK_ENTRY_UPDATES = True
+# Throughput the update estimates assume until telemetry has measured ours, in bytes per second:
+# downloading, decompressing the tar file and writing into the game.
+PREFLIGHT_DOWNLOAD_RATE = 10 * 1000 * 1000
+PREFLIGHT_EXTRACT_RATE = 100 * 1000 * 1000
+PREFLIGHT_WRITE_RATE = 200 * 1000 * 1000
+# Bytes every disk has to have free after an update, on top of what the update needs. An update that doesn't leave this much isn't started.
+PREFLIGHT_DISK_MARGIN = 256 * 1024 * 1024
+# Files copied or deleted at once while applying an update.
+APPLY_WORKERS = 8
+# The update journal is fsynced every this many records, or this many seconds.
+JOURNAL_SYNC_OPS = 64
+JOURNAL_SYNC_INTERVAL = 0.5
+# Download the new build next to the game folder, so its files can be moved into the game instead of copied.
+STAGE_NEXT_TO_GAME = True
+# Folder the new build is downloaded into. Empty to put it next to the game folder (see util.get_staging_path)
+STAGING_PATH = ''
+# Keep the downloaded build after applying it. Its files are cloned or copied into the game instead of moved then.
+KEEP_STAGING = False
+# Hardlink kept files into the game instead of copying them. The game and the staging folder share those files then.
+APPLY_HARDLINKS = False
+# Keep the previous build as pf2.old after installing, so it can be brought back. Deleted in the background otherwise.
+KEEP_OLD_BUILD = False
+# Processes hashing files while verifying the game, 0 for one per core.
+VERIFY_WORKERS = 0
+# Jobs walking the game at once while looking for temp files to clear, how many folders each job lists
+# before handing the rest back, and how many of the files found are deleted per job.
+CLEANUP_WORKERS = 8
+CLEANUP_FOLDERS_PER_JOB = 64
+CLEANUP_BATCH_SIZE = 256
+# Folders that never hold temp files, skipped wherever they are while clearing them.
+CLEANUP_SKIP_FOLDERS = ( 'materials', 'models', 'particles', 'resource', 'scripts', 'bin', 'media' )
+# Installs updated or installed at once by the headless mode (see fleet.py), and the folder for its shared downloads and logs.
+FLEET_WORKERS = 4
+FLEET_WORK_PATH = 'pf2_fleet'
+# User agent sent to the servers.
+HTTP_USER_AGENT = 'PF2-Updater'
 
 # Temp path.
 TEMP_PATH = ''
@@ -19,6 +108,34 @@ if system() == 'Windows':
 elif system() == 'Linux':
     TEMP_PATH = '/var/tmp' # Temp folder in Linux
 
+# Where the updater keeps its own small files between runs.
+CACHE_PATH = ''
+if system() == 'Windows':
+    CACHE_PATH = os.path.join( os.environ.get( 'LOCALAPPDATA', TEMP_PATH ), 'PF2-Updater' )
+else:
+    CACHE_PATH = os.path.join( os.environ.get( 'XDG_CACHE_HOME' ) or os.path.expanduser( '~/.cache' ), 'pf2-updater' )
+# SourceMod path found in Steam's registry.vdf, reused until that file changes.
+STEAM_PATH_CACHE = os.path.join( CACHE_PATH, 'steam_path.cache' )
+# Write the time, files, bytes and retries of every phase as a line of JSON to TELEMETRY_PATH (PF2_TELEMETRY_PATH overrides it).
+# The file is moved to TELEMETRY_PATH.1 once it's bigger than TELEMETRY_MAX_SIZE.
+TELEMETRY = True
+TELEMETRY_PATH = os.environ.get( 'PF2_TELEMETRY_PATH' ) or os.path.join( CACHE_PATH, 'telemetry.jsonl' )
+TELEMETRY_MAX_SIZE = 4 * 1024 * 1024
+# Profile every phase with cProfile into PROFILE_PATH. Off unless the PF2_PROFILE environment variable is set.
+PROFILE_PHASES = bool( os.environ.get( 'PF2_PROFILE' ) )
+PROFILE_PATH = os.path.join( CACHE_PATH, 'profiles' )
+# Keep downloaded builds and patches in ARTIFACT_CACHE_PATH to reuse them, up to ARTIFACT_CACHE_SIZE bytes
+# (the least recently used go first).
+ARTIFACT_CACHE = True
+# Write the tar file while stream extracting too, only to keep it in the artifact cache, so reinstalling and repairing
+# don't download it again. Off by default: it costs the tar file's size in disk writes and space, which streaming is there to save.
+CACHE_STREAMED_BUILDS = False
+ARTIFACT_CACHE_PATH = os.path.join( CACHE_PATH, 'artifacts' )
+ARTIFACT_CACHE_SIZE = 6 * 1024 * 1024 * 1024
+# Read-only cache shared between machines (another machine's ARTIFACT_CACHE_PATH, on NFS say), looked in before the server.
+# Set with the PF2_SHARED_CACHE environment variable.
+SHARED_CACHE_PATH = os.environ.get( 'PF2_SHARED_CACHE', '' )
+
 # Sourcemod path set by setup_game_path()
 SOURCEMOD_PATH = ''
 # Game path set by setup_game_path()
@@ -0,0 +1,120 @@
+'''
+Checking an installed game against the manifest of its build.
+Every file is hashed on a pool of processes, so a big install is limited by the disk instead of one core.
+The hashes are saved in a cache next to the files, keyed on each file's path, size, mtime and inode,
+so verifying again only hashes the files that changed since.
+'''
+import os
+import json
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+import vars
+import manifest
+import message as message
+
+# Format version of the hash cache. Bump it when the format changes.
+CACHE_VERSION = 1
+
+@dataclass
+class VerifyResult:
+    missing: list = field( default_factory=list ) # FileChange of every file that isn't installed
+    damaged: list = field( default_factory=list ) # FileChange of every file with the wrong size or hash
+    checked: int = 0 # Number of files checked
+    hashed: int = 0 # Number of files that had to be hashed, the rest came from the cache
+
+    @property
+    def ok( self ) -> bool:
+        return not self.missing and not self.damaged
+
+def get_cache_path( game_path: str ) -> str:
+    '''
+    Path of the hash cache of a game folder. "Clear cache files" deletes it like any other .cache file.
+    '''
+    return os.path.join( game_path, 'verify_hashes.cache' )
+
+def load_cache( cache_path: str ) -> dict:
+    '''
+    Read the hash cache: path: ( size, mtime_ns, inode, sha256 ). Empty if there's none we understand.
+    '''
+    try:
+        with open( cache_path, 'r' ) as file:
+            data = json.load( file )
+        if data.get( 'format' ) != CACHE_VERSION:
+            return {}
+        return { path: tuple( entry ) for path, entry in data['files'].items() }
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        message.print_exception_error_dbg()
+        return {}
+
+def save_cache( cache_path: str, cache: dict ) -> None:
+    '''
+    Write the hash cache, replacing the old one in one step.
+    '''
+    with open( cache_path + '.part', 'w' ) as file:
+        json.dump( { 'format': CACHE_VERSION, 'files': cache }, file, separators=( ',', ':' ) )
+    os.replace( cache_path + '.part', cache_path )
+
+def verify( build: manifest.Manifest, game_path: str, workers: int = None ) -> VerifyResult:
+    '''
+    Check every file of a build's manifest in game_path. Files that aren't in the manifest are ignored.
+    Files with the wrong size are damaged without hashing them. The rest are hashed on workers processes
+    (vars.VERIFY_WORKERS, or one per core), unless the cache has their hash for the same size, mtime and inode.
+    '''
+    cache_path = get_cache_path( game_path )
+    cache = load_cache( cache_path )
+    new_cache = {}
+    result = VerifyResult()
+    # Files we have to hash: ( FileChange, full path, cache key )
+    to_hash = []
+
+    for change in build.files:
+        if change.operation == manifest.OP_REMOVED:
+            continue
+        result.checked += 1
+        full_path = os.path.join( game_path, *change.path.split( '/' ) )
+        try:
+            stat = os.stat( full_path )
+        except FileNotFoundError:
+            result.missing.append( change )
+            continue
+        if stat.st_size != change.size:
+            result.damaged.append( change )
+            continue
+        key = ( stat.st_size, stat.st_mtime_ns, stat.st_ino )
+        cached = cache.get( change.path )
+        if cached and cached[:3] == key:
+            new_cache[change.path] = cached
+            if cached[3] != change.sha256:
+                result.damaged.append( change )
+            continue
+        to_hash.append( ( change, full_path, key ) )
+
+    if to_hash:
+        # Biggest files first, so one big file doesn't finish alone at the end
+        to_hash.sort( key=lambda item: item[0].size, reverse=True )
+        with ProcessPoolExecutor( max_workers=workers or vars.VERIFY_WORKERS or None ) as pool, \
+             tqdm( total=sum( item[0].size for item in to_hash ), desc='Verifying', unit='iB', unit_scale=True ) as bar:
+            futures = { pool.submit( manifest.hash_file, full_path ): ( change, key ) for change, full_path, key in to_hash }
+            for future in as_completed( futures ):
+                change, key = futures[future]
+                bar.update( change.size )
+                try:
+                    sha256 = future.result()
+                except FileNotFoundError:
+                    # Deleted since we looked at it
+                    result.missing.append( change )
+                    continue
+                new_cache[change.path] = key + ( sha256, )
+                if sha256 != change.sha256:
+                    result.damaged.append( change )
+        result.hashed = len( to_hash )
+
+    try:
+        save_cache( cache_path, new_cache )
+    except Exception:
+        # Not worth failing over, we just hash everything again next time
+        message.print_exception_error_dbg()
+    return result
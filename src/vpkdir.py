@@ -0,0 +1,144 @@
+'''
+Minimal reader of VPK directories (pf2_*_dir.vpk), for reading one small file like version.txt
+without parsing the whole directory the way the vpk module does.
+The directory is a tree of null terminated strings: extensions, then the folders holding files with
+that extension (' ' for the root), then the names of those files, each level ending with an empty string.
+Every file name is followed by its entry and its preloaded bytes.
+The tree is walked from the start only until the file is found, entries of other folders are
+skipped without comparing their names. Then the file is read with one seek.
+'''
+import os
+import zlib
+import mmap
+import struct
+from dataclasses import dataclass
+
+# Identifies a VPK directory.
+MAGIC = 0x55aa1234
+# magic, version, size of the tree
+HEADER = struct.Struct( '<III' )
+# Version 2 has 4 more sizes after the header: file data, archive hashes, other hashes and signature.
+HEADER_V2 = struct.Struct( '<IIIIIII' )
+# crc32, preloaded bytes, archive index, offset, length, terminator (0xffff)
+ENTRY = struct.Struct( '<IHHIIH' )
+ENTRY_TERMINATOR = 0xffff
+# Where the preloaded bytes count is in an entry.
+PRELOAD_OFFSET = 4
+PRELOAD_SIZE = struct.Struct( '<H' )
+# Archive index of entries stored in the _dir.vpk itself.
+EMBEDDED_ARCHIVE = 0x7fff
+
+# Files already read, by ( dir_path, path, size, mtime_ns ) of the _dir.vpk.
+_read_cache = {}
+
+@dataclass
+class Entry:
+    crc32: int # CRC32 of the whole file
+    preload: bytes # Bytes of the file stored in the directory itself, before the rest
+    archive_index: int # Chunk holding the rest of the file, EMBEDDED_ARCHIVE for the _dir.vpk
+    offset: int # Where the rest of the file starts in that chunk
+    length: int # Bytes of the file in that chunk
+
+def get_chunk_path( dir_path: str, archive_index: int ) -> str:
+    '''
+    Path of a chunk of a VPK (pf2_misc_dir.vpk, 3 -> pf2_misc_003.vpk)
+    '''
+    return dir_path[:-len( 'dir.vpk' )] + f'{archive_index:03d}.vpk'
+
+def read_string( data: mmap.mmap, position: int ) -> tuple:
+    '''
+    The null terminated string at position, and the position after it.
+    '''
+    end = data.find( b'\0', position )
+    if end < 0:
+        raise ValueError( 'Truncated VPK directory' )
+    return data[position:end], end + 1
+
+def find_entry( dir_path: str, path: str ) -> Entry:
+    '''
+    Entry of path (like "version.txt" or "scripts/items.txt") in a _dir.vpk. None if it isn't in there.
+    '''
+    folder, _, name = path.rpartition( '/' )
+    name, dot, extension = name.rpartition( '.' )
+    if not dot:
+        # No extension is stored as ' ' too
+        name, extension = extension, ' '
+    wanted_extension = extension.encode()
+    wanted_folder = ( folder or ' ' ).encode()
+    wanted_name = name.encode()
+
+    with open( dir_path, 'rb' ) as file, mmap.mmap( file.fileno(), 0, access=mmap.ACCESS_READ ) as data:
+        magic, version, tree_size = HEADER.unpack_from( data, 0 )
+        if magic != MAGIC:
+            raise ValueError( 'Not a VPK directory' )
+        header_size = HEADER_V2.size if version == 2 else HEADER.size
+        # Embedded files are stored right after the tree
+        data_start = header_size + tree_size
+
+        position = header_size
+        while True:
+            extension, position = read_string( data, position )
+            if not extension:
+                return None
+            while True:
+                folder, position = read_string( data, position )
+                if not folder:
+                    break
+                wanted = extension == wanted_extension and folder == wanted_folder
+                if not wanted:
+                    # Skip the folder's files, all we need of them is how many bytes they preload
+                    while True:
+                        end = data.find( b'\0', position )
+                        if end < 0:
+                            raise ValueError( 'Truncated VPK directory' )
+                        if end == position:
+                            position += 1
+                            break
+                        position = end + 1 + ENTRY.size + PRELOAD_SIZE.unpack_from( data, end + 1 + PRELOAD_OFFSET )[0]
+                    continue
+                while True:
+                    name, position = read_string( data, position )
+                    if not name:
+                        break
+                    crc32, preload_size, archive_index, offset, length, terminator = ENTRY.unpack_from( data, position )
+                    if terminator != ENTRY_TERMINATOR:
+                        raise ValueError( 'Broken VPK directory entry' )
+                    position += ENTRY.size
+                    if name == wanted_name:
+                        if archive_index == EMBEDDED_ARCHIVE:
+                            offset += data_start
+                        return Entry( crc32, data[position:position + preload_size], archive_index, offset, length )
+                    position += preload_size
+                # A folder is only listed once per extension, the file isn't in this VPK
+                return None
+            if extension == wanted_extension:
+                return None
+
+def read_file( dir_path: str, path: str ) -> bytes:
+    '''
+    Contents of path in the VPK of dir_path, None if it isn't in there.
+    Raises ValueError if they don't match the CRC32 of the entry.
+    '''
+    entry = find_entry( dir_path, path )
+    if not entry:
+        return None
+    contents = entry.preload
+    if entry.length:
+        chunk_path = dir_path if entry.archive_index == EMBEDDED_ARCHIVE else get_chunk_path( dir_path, entry.archive_index )
+        with open( chunk_path, 'rb' ) as file:
+            file.seek( entry.offset )
+            contents += file.read( entry.length )
+    if zlib.crc32( contents ) != entry.crc32:
+        raise ValueError( f'{path} in {os.path.basename( dir_path )} is damaged' )
+    return contents
+
+def read_file_cached( dir_path: str, path: str ) -> bytes:
+    '''
+    read_file, but only read once as long as the _dir.vpk keeps the same size and mtime.
+    Raises FileNotFoundError if there's no _dir.vpk.
+    '''
+    stat = os.stat( dir_path )
+    key = ( dir_path, path, stat.st_size, stat.st_mtime_ns )
+    if key not in _read_cache:
+        _read_cache[key] = read_file( dir_path, path )
+    return _read_cache[key]
@@ -0,0 +1,152 @@
+'''
+Entry level updates of multi-chunk VPK archives (a pf2_*_dir.vpk index and its pf2_*_NNN.vpk chunks).
+Instead of copying whole changed chunks, the entries of the old and new _dir.vpk are compared
+(path, CRC, archive index, offset, length) and only the bytes of the entries that changed are written
+into copies of the installed chunks (reflinked when the filesystem can). Then the copies and the new _dir.vpk replace the old ones.
+'''
+import os
+import zlib
+from shutil import copy2
+import vpk
+import fileops
+from vpkdir import get_chunk_path
+
+def read_entries( dir_path: str ) -> dict:
+    '''
+    Every entry of a _dir.vpk as path: ( crc32, archive index, offset, length, preload bytes ).
+    '''
+    entries = {}
+    for path, metadata in vpk.open( dir_path ).items():
+        preload, crc32, _, archive_index, offset, length = metadata
+        entries[path] = ( crc32, archive_index, offset, length, preload )
+    return entries
+
+def get_archive_index( dir_path: str, chunk_path: str ) -> int:
+    '''
+    Archive index of a chunk if it belongs to the VPK of dir_path, otherwise -1.
+    '''
+    prefix = dir_path[:-len( 'dir.vpk' )]
+    number = chunk_path[len( prefix ):-len( '.vpk' )]
+    if chunk_path.startswith( prefix ) and chunk_path.endswith( '.vpk' ) and len( number ) == 3 and number.isdigit():
+        return int( number )
+    return -1
+
+def merge_ranges( ranges: list ) -> list:
+    '''
+    Merge overlapping or touching ( offset, length ) ranges.
+    '''
+    merged = []
+    for offset, length in sorted( ranges ):
+        if merged and offset <= merged[-1][0] + merged[-1][1]:
+            last_offset, last_length = merged[-1]
+            merged[-1] = ( last_offset, max( last_length, offset + length - last_offset ) )
+        else:
+            merged.append( ( offset, length ) )
+    return merged
+
+def plan_chunk_writes( old_entries: dict, new_entries: dict, archive_index: int, chunk_size: int ) -> list:
+    '''
+    The ( offset, length ) ranges of a chunk that have to be written to turn the old chunk into the new one:
+    every new entry that isn't already at the same place with the same CRC, and anything between entries.
+    '''
+    # Entries of the old build, by where they are.
+    in_place = { ( old_index, offset, length, crc32 ) for crc32, old_index, offset, length, _ in old_entries.values() if old_index == archive_index }
+
+    ranges = []
+    covered = []
+    for crc32, index, offset, length, _ in new_entries.values():
+        if index != archive_index or length == 0:
+            continue
+        covered.append( ( offset, length ) )
+        if ( index, offset, length, crc32 ) not in in_place:
+            ranges.append( ( offset, length ) )
+
+    # Bytes that no entry covers (padding) are written too, we can't know if they match.
+    position = 0
+    for offset, length in merge_ranges( covered ):
+        if offset > position:
+            ranges.append( ( position, offset - position ) )
+        position = offset + length
+    if position < chunk_size:
+        ranges.append( ( position, chunk_size - position ) )
+    return merge_ranges( ranges )
+
+def copy_range( source, dest, offset: int, length: int ) -> None:
+    '''
+    Copy length bytes at offset from one open file to the same place in another.
+    '''
+    source.seek( offset )
+    dest.seek( offset )
+    while length > 0:
+        data = source.read( min( length, 1024 * 1024 ) )
+        if not data:
+            raise ValueError( 'New chunk is shorter than its entries say' )
+        dest.write( data )
+        length -= len( data )
+
+def check_entry( file, offset: int, length: int, crc32: int, preload: bytes = b'' ) -> bool:
+    '''
+    Check the CRC of an entry in a chunk. The CRC covers the entry's preload bytes (kept in the _dir.vpk) first.
+    '''
+    file.seek( offset )
+    checksum = zlib.crc32( preload )
+    while length > 0:
+        data = file.read( min( length, 1024 * 1024 ) )
+        if not data:
+            return False
+        checksum = zlib.crc32( data, checksum )
+        length -= len( data )
+    return checksum == crc32
+
+def patch_vpk( dir_path: str, new_root: str, game_root: str, archive_indexes: list ) -> int:
+    '''
+    Update the installed VPK at game_root/dir_path to the one at new_root/dir_path, entry by entry.
+    Only the chunks in archive_indexes are touched, and they must already be installed.
+    Each of them is copied next to itself, the changed entries are written into the copy and checked
+    against their CRCs. The installed files are never written to: once every copy is done they're
+    swapped in with os.replace, the _dir.vpk last. So the installed VPK stays the old version until then,
+    a hardlinked chunk keeps its other links untouched, and running this again after an interruption finishes the job.
+    Returns the number of bytes written into chunks.
+    '''
+    old_dir = os.path.join( game_root, dir_path )
+    new_dir = os.path.join( new_root, dir_path )
+    old_entries = read_entries( old_dir )
+    new_entries = read_entries( new_dir )
+
+    written = 0
+    parts = []
+    try:
+        for archive_index in archive_indexes:
+            new_chunk = os.path.join( new_root, get_chunk_path( dir_path, archive_index ) )
+            old_chunk = os.path.join( game_root, get_chunk_path( dir_path, archive_index ) )
+            chunk_size = os.path.getsize( new_chunk )
+            ranges = plan_chunk_writes( old_entries, new_entries, archive_index, chunk_size )
+
+            parts.append( ( old_chunk + '.part', old_chunk ) )
+            fileops.copy_file( old_chunk, old_chunk + '.part' )
+            with open( new_chunk, 'rb' ) as source, open( old_chunk + '.part', 'r+b' ) as dest:
+                for offset, length in ranges:
+                    copy_range( source, dest, offset, length )
+                    written += length
+                dest.truncate( chunk_size )
+                dest.flush()
+                os.fsync( dest.fileno() )
+
+                # Make sure the entries we wrote came out right
+                for path, ( crc32, index, offset, length, preload ) in new_entries.items():
+                    if index == archive_index and length and ( crc32, index, offset, length, preload ) != old_entries.get( path ):
+                        if not check_entry( dest, offset, length, crc32, preload ):
+                            raise ValueError( f'{path} in {old_chunk} is corrupted after updating' )
+
+        parts.append( ( old_dir + '.part', old_dir ) )
+        copy2( new_dir, old_dir + '.part' )
+    except Exception:
+        for part, _ in parts:
+            if os.path.exists( part ):
+                os.remove( part )
+        raise
+
+    # Swap in the new chunks, and the new index last.
+    for part, path in parts:
+        os.replace( part, path )
+    return written
@@ -0,0 +1,73 @@
+'''
+Fixtures of the tests: small made up builds (see benchmarks/synthetic.py) served by the local
+stand-in for the download server (benchmarks/server.py), and an install of the old build to update.
+Run them with python -m pytest tests
+'''
+import os
+import sys
+import shutil
+from types import SimpleNamespace
+import pytest
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' ) )
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'benchmarks' ) )
+import vars
+import server
+import synthetic
+
+OLD_VERSION = '0.7.3'
+NEW_VERSION = '0.7.4'
+# Big enough for a few files of every kind, small enough to build in a moment.
+BUILD_SIZE = 2 * 1024 * 1024
+
+@pytest.fixture( autouse=True )
+def settings( tmp_path, monkeypatch ):
+    '''
+    Put every setting back after each test, and run in a working folder of its own
+    without telemetry, the artifact cache or the background deletion of the old build.
+    '''
+    saved = { name: value for name, value in vars.__dict__.items() if name.isupper() }
+    vars.DEBUG = False
+    vars.TELEMETRY = False
+    vars.ARTIFACT_CACHE = False
+    vars.KEEP_OLD_BUILD = True
+    work_path = tmp_path / 'work'
+    work_path.mkdir()
+    monkeypatch.chdir( work_path )
+    yield
+    for name, value in saved.items():
+        setattr( vars, name, value )
+
+@pytest.fixture( scope='session' )
+def builds( tmp_path_factory ):
+    '''
+    The old and new builds (folders holding pf2/) and the server's folder with the update between them.
+    '''
+    root = tmp_path_factory.mktemp( 'builds' )
+    result = SimpleNamespace( old=str( root / 'old' ), new=str( root / 'new' ), server=str( root / 'server' ) )
+    synthetic.make_build( result.old, OLD_VERSION, BUILD_SIZE, 0 )
+    synthetic.make_build( result.new, NEW_VERSION, BUILD_SIZE, 1 )
+    synthetic.publish( result.server, result.old, result.new, OLD_VERSION, NEW_VERSION )
+    return result
+
+@pytest.fixture
+def download_server( builds ):
+    '''
+    The server's folder served on a local port, with the updater pointed at it.
+    '''
+    httpd = server.serve( builds.server )
+    url = f'http://127.0.0.1:{httpd.server_port}/'
+    vars.WEBSITE_URL = vars.PATCH_URL = url
+    vars.FILE_URL = url + vars.FILE_NAME
+    vars.DELTA_URL = url + 'deltas/{}-{}/'
+    yield httpd
+    httpd.shutdown()
+
+@pytest.fixture
+def game( builds, tmp_path ):
+    '''
+    The old build installed in a sourcemods folder, as vars.GAME_PATH.
+    '''
+    game_path = str( tmp_path / 'sourcemods' / 'pf2' )
+    shutil.copytree( os.path.join( builds.old, 'pf2' ), game_path )
+    vars.GAME_PATH = game_path
+    return game_path
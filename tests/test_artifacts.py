@@ -0,0 +1,80 @@
+'''
+The cache of downloaded files, used by one updater and by several at once.
+'''
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+import vars
+import artifacts
+import util
+
+@pytest.fixture( autouse=True )
+def cache( tmp_path ):
+    vars.ARTIFACT_CACHE = True
+    vars.ARTIFACT_CACHE_PATH = str( tmp_path / 'artifacts' )
+    vars.SHARED_CACHE_PATH = ''
+    return vars.ARTIFACT_CACHE_PATH
+
+def write( path: str, data: bytes ) -> str:
+    with open( path, 'wb' ) as file:
+        file.write( data )
+    return path
+
+def test_store_and_fetch( tmp_path ):
+    path = write( str( tmp_path / 'latest.tar.gz' ), b'build' * 1000 )
+    assert artifacts.store( 'latest.tar.gz', '0.7.4', path )
+    assert artifacts.is_cached( 'latest.tar.gz', '0.7.4' )
+    assert artifacts.fetch( 'latest.tar.gz', '0.7.4', str( tmp_path / 'fetched' ) )
+    with open( tmp_path / 'fetched', 'rb' ) as file:
+        assert file.read() == b'build' * 1000
+    assert not artifacts.fetch( 'latest.tar.gz', '0.7.5', str( tmp_path / 'other' ) )
+
+def test_damaged_object_is_forgotten( cache, tmp_path ):
+    path = write( str( tmp_path / 'patch' ), b'patch' * 1000 )
+    assert artifacts.store( 'patch', '0.7.4', path )
+    entry = artifacts.load_index( cache )[artifacts.get_key( 'patch', '0.7.4' )]
+    object_path = artifacts.get_object_path( cache, entry['sha256'] )
+    os.remove( object_path )
+    write( object_path, b'x' * entry['size'] )
+    assert not artifacts.fetch( 'patch', '0.7.4', str( tmp_path / 'fetched' ) )
+    assert not artifacts.is_cached( 'patch', '0.7.4' )
+
+def store_one( cache_path: str, folder: str, number: int ) -> bool:
+    vars.ARTIFACT_CACHE = True
+    vars.ARTIFACT_CACHE_PATH = cache_path
+    path = write( os.path.join( folder, f'file{number}' ), os.urandom( 64 * 1024 ) )
+    return artifacts.store( f'file{number}', '0.7.4', path, move=True )
+
+def test_stores_at_once_keep_each_other( cache, tmp_path ):
+    with ProcessPoolExecutor( max_workers=4 ) as pool:
+        assert all( pool.map( store_one, [ cache ] * 16, [ str( tmp_path ) ] * 16, range( 16 ) ) )
+    entries = artifacts.load_index( cache )
+    assert len( entries ) == 16
+    for entry in entries.values():
+        assert os.path.exists( artifacts.get_object_path( cache, entry['sha256'] ) )
+    assert not os.path.exists( os.path.join( cache, 'index.lock' ) )
+
+def test_lock_of_a_dead_updater_is_broken( cache, tmp_path ):
+    os.makedirs( cache )
+    lock_path = os.path.join( cache, 'index.lock' )
+    write( lock_path, b'' )
+    old = time.time() - artifacts.INDEX_LOCK_MAX_AGE - 1
+    os.utime( lock_path, ( old, old ) )
+    assert artifacts.store( 'patch', '0.7.4', write( str( tmp_path / 'patch' ), b'patch' ) )
+
+@pytest.mark.parametrize( 'cache_streamed', ( False, True ) )
+def test_streamed_build_is_only_cached_when_asked( download_server, game, cache_streamed, monkeypatch ):
+    vars.CACHE_STREAMED_BUILDS = cache_streamed
+    vars.SERVER_VERSION_STRING = '0.7.4'
+    written = []
+    open_file = open
+    def watching_open( path, *args, **kwargs ):
+        if str( path ).startswith( vars.FILE_NAME ):
+            written.append( path )
+        return open_file( path, *args, **kwargs )
+    monkeypatch.setattr( util, 'open', watching_open, raising=False )
+    assert util.download_and_extract( tee=False )
+    assert bool( written ) == cache_streamed
+    assert artifacts.is_cached( vars.FILE_NAME, '0.7.4' ) == cache_streamed
+    assert not os.path.exists( vars.FILE_NAME + '.part' )
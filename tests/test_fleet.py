@@ -0,0 +1,22 @@
+'''
+Headless mode on several installs at once.
+'''
+import os
+import shutil
+import vars
+import fleet
+import manifest
+
+def test_update_many( builds, download_server, game, tmp_path ):
+    other = str( tmp_path / 'other' / 'pf2' )
+    shutil.copytree( game, other )
+    vars.GAME_PATH = 'somewhere else'
+    work_path = str( tmp_path / 'fleet' )
+
+    assert fleet.main( [ 'check', game, other, '--work', work_path ] ) == fleet.EXIT_OUTDATED
+    assert fleet.main( [ 'update', game, other, '--work', work_path, '--workers', '2' ] ) == fleet.EXIT_OK
+    for path in ( game, other ):
+        assert not manifest.make_manifest( os.path.join( builds.new, 'pf2' ), path, '', '' ).files
+    assert fleet.main( [ 'check', game, other, '--work', work_path ] ) == fleet.EXIT_OK
+    # The settings of whatever else runs in this process are put back
+    assert ( vars.GAME_PATH, vars.KEEP_STAGING, vars.KEEP_OLD_BUILD ) == ( 'somewhere else', False, True )
@@ -0,0 +1,48 @@
+'''
+The update journal, and finding where an interrupted update stopped from it.
+'''
+import os
+import pytest
+import vars
+import util
+import manifest
+
+@pytest.fixture( autouse=True )
+def versions( game ):
+    '''
+    An update of the installed game from 0.7.3 to 0.7.4.
+    '''
+    vars.LOCAL_VERSION_STRING = '0.7.3'
+    vars.SERVER_VERSION_STRING = '0.7.4'
+
+def test_new_journal_starts_with_a_record():
+    with util.UpdateJournal( util.get_journal_path(), False, 73, 74 ):
+        # Durable before anything is written into the game
+        assert util.recover_update() == util.UpdateInfo( False, 73, 74, 0, manifest.OP_MODIFIED )
+
+def test_last_intact_record_wins():
+    with util.UpdateJournal( util.get_journal_path(), False, 73, 74 ) as journal:
+        journal.record( manifest.OP_REMOVED, 3 )
+        journal.record( manifest.OP_ADDED, 7 )
+    size = os.path.getsize( util.get_journal_path() )
+    # A crash in the middle of writing the last record
+    with open( util.get_journal_path(), 'r+b' ) as file:
+        file.truncate( size - 5 )
+    assert util.recover_update() == util.UpdateInfo( False, 73, 74, 3, manifest.OP_REMOVED )
+
+    # Continuing cuts the torn record off and appends after the intact ones
+    with util.UpdateJournal( util.get_journal_path(), False, 73, 74 ) as journal:
+        journal.record( manifest.OP_ADDED, 9 )
+    assert util.recover_update() == util.UpdateInfo( False, 73, 74, 9, manifest.OP_ADDED )
+
+def test_header_only_journal_continues_from_the_start():
+    with open( util.get_journal_path(), 'wb' ) as file:
+        file.write( util.JOURNAL_HEADER.pack( util.JOURNAL_MAGIC, util.JOURNAL_VERSION ) + b'torn' )
+    assert util.recover_update() == util.UpdateInfo( False, 73, 74, 0, manifest.OP_MODIFIED )
+
+def test_no_journal():
+    assert util.recover_update() is None
+    # Not a journal we understand
+    with open( util.get_journal_path(), 'wb' ) as file:
+        file.write( b'garbage' )
+    assert util.recover_update() is None
@@ -0,0 +1,42 @@
+'''
+Resumable downloads against the local server.
+'''
+import os
+import filecmp
+import vars
+import net
+import server
+import telemetry
+
+# Not a multiple of the chunk size, so the cut falls in the middle of one.
+SIZE = 3 * 1024 * 1024 + 12345
+
+def test_download_resumes_after_a_cut( tmp_path, capsys ):
+    root = tmp_path / 'server'
+    root.mkdir()
+    with open( root / 'latest.tar.gz', 'wb' ) as file:
+        file.write( os.urandom( SIZE ) )
+    cut = SIZE * 2 // 5
+    httpd = server.serve( str( root ), cut_after=cut )
+    url = f'http://127.0.0.1:{httpd.server_port}/latest.tar.gz'
+    path = str( tmp_path / 'latest.tar.gz' )
+    # Give up at the first cut
+    vars.HTTP_RETRIES = 0
+    try:
+        assert not net.download_file( url, path )
+        # There was no retry left to resume with
+        assert 'resuming' not in capsys.readouterr().out
+        # The last chunk read before the cut may be lost
+        kept = os.path.getsize( path + '.part' )
+        assert 0 < kept <= cut
+        assert os.path.exists( path + '.part.json' )
+
+        httpd.handler.cut_after = 0
+        with telemetry.phase( 'resume' ) as phase:
+            assert net.download_file( url, path )
+        # Only what was missing was downloaded again
+        assert phase.downloaded == SIZE - kept
+        assert filecmp.cmp( path, root / 'latest.tar.gz', shallow=False )
+        assert not os.path.exists( path + '.part' ) and not os.path.exists( path + '.part.json' )
+    finally:
+        httpd.shutdown()
@@ -0,0 +1,31 @@
+'''
+Fetching files out of the latest build's pack with Range requests.
+'''
+import os
+import filecmp
+import pack
+
+def test_fetch_members( builds, download_server, tmp_path ):
+    index = pack.fetch_index()
+    dest_path = str( tmp_path / 'staging' )
+    assert pack.fetch_members( index, [ 'pf2/maps/map1.bsp', 'pf2/cfg' ], dest_path )
+    for path in [ 'maps/map1.bsp' ] + [ f'cfg/new{number}.cfg' for number in range( 5 ) ]:
+        assert filecmp.cmp( os.path.join( builds.new, 'pf2', path ), os.path.join( dest_path, 'pf2', path ), shallow=False )
+    assert not os.path.exists( os.path.join( dest_path, 'pf2', 'maps', 'map2.bsp' ) )
+
+def test_fetch_members_refetches_stale_files( builds, download_server, tmp_path ):
+    index = pack.fetch_index()
+    dest_path = str( tmp_path / 'staging' )
+    new_path = os.path.join( builds.new, 'pf2', 'maps', 'map1.bsp' )
+    stale_path = os.path.join( dest_path, 'pf2', 'maps', 'map1.bsp' )
+    # Same size, other contents, like a file of another version left in the folder
+    os.makedirs( os.path.dirname( stale_path ) )
+    with open( stale_path, 'wb' ) as file:
+        file.write( bytes( os.path.getsize( new_path ) ) )
+    assert pack.fetch_members( index, [ 'pf2/maps/map1.bsp' ], dest_path )
+    assert filecmp.cmp( new_path, stale_path, shallow=False )
+
+def test_fetch_members_fails_on_missing_members( download_server, tmp_path ):
+    index = pack.fetch_index()
+    assert pack.get_missing( index, [ 'pf2/maps', 'pf2/maps/map1.bsp', 'pf2/maps/nope.bsp', 'pf2/nope' ] ) == [ 'pf2/maps/nope.bsp', 'pf2/nope' ]
+    assert not pack.fetch_members( index, [ 'pf2/maps/map1.bsp', 'pf2/maps/nope.bsp' ], str( tmp_path / 'staging' ) )
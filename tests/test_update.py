@@ -0,0 +1,78 @@
+'''
+Updating the old build to the new one against the local server, and continuing interrupted updates.
+'''
+import os
+import pytest
+import vars
+from vars import UpdateCode
+import util
+import manifest
+import fileops
+
+def check_new( builds, game: str ) -> None:
+    '''
+    The game is the new build.
+    '''
+    changes = manifest.make_manifest( os.path.join( builds.new, 'pf2' ), game, '', '' )
+    assert not changes.files, f'{len( changes.files )} files differ, like {changes.files[0].path}'
+
+def interrupt_before( name: str, monkeypatch ) -> None:
+    '''
+    Stop the next update when it gets to the phase called name.
+    '''
+    apply_phase = util.apply_phase
+    def interrupted_apply_phase( phase_name: str, *args ) -> None:
+        if phase_name == name:
+            raise KeyboardInterrupt
+        apply_phase( phase_name, *args )
+    monkeypatch.setattr( util, 'apply_phase', interrupted_apply_phase )
+
+@pytest.mark.parametrize( 'partial_fetch', ( True, False ) )
+def test_update( builds, download_server, game, partial_fetch ):
+    vars.PARTIAL_FETCH = partial_fetch
+    assert util.check_for_update() == UpdateCode.UPDATE_YES
+    assert util.update_to_latest()
+    check_new( builds, game )
+    assert util.check_for_update() == UpdateCode.UPDATE_NO
+    assert not os.path.exists( util.get_staging_path() )
+
+def test_continue_update( builds, download_server, game, monkeypatch ):
+    assert util.check_for_update() == UpdateCode.UPDATE_YES
+    apply_phase = util.apply_phase
+    interrupt_before( 'Added', monkeypatch )
+    with pytest.raises( KeyboardInterrupt ):
+        util.update_to_latest()
+    monkeypatch.setattr( util, 'apply_phase', apply_phase )
+    assert util.check_for_update() == UpdateCode.UPDATE_INTERRUPTED
+    assert util.recover_update().operation == manifest.OP_REMOVED
+    assert util.continue_update()
+    check_new( builds, game )
+    assert not os.path.exists( util.get_journal_path() )
+
+def test_continue_update_past_the_journal( builds, download_server, game ):
+    '''
+    Files can be moved into the game after the last record that made it to disk.
+    They're taken as done by their hash, and a staged file that's gone otherwise is downloaded again.
+    '''
+    assert util.check_for_update() == UpdateCode.UPDATE_YES
+    assert util.download_update()
+    modified = util.download_changes().get( manifest.OP_MODIFIED )
+    staging_path = os.path.join( util.get_staging_path(), 'pf2' )
+    for change in modified[:4]:
+        fileops.place_file( os.path.join( staging_path, change.path ), os.path.join( game, change.path ) )
+    os.remove( os.path.join( staging_path, modified[6].path ) )
+    with util.UpdateJournal( util.get_journal_path(), False, 73, 74 ) as journal:
+        journal.record( manifest.OP_MODIFIED, 2 )
+
+    assert util.check_for_update() == UpdateCode.UPDATE_INTERRUPTED
+    assert util.continue_update()
+    check_new( builds, game )
+
+def test_missing_staged_file_fails_the_update( download_server, game ):
+    assert util.check_for_update() == UpdateCode.UPDATE_YES
+    assert util.download_update()
+    change = util.download_changes().get( manifest.OP_MODIFIED )[0]
+    os.remove( os.path.join( util.get_staging_path(), 'pf2', change.path ) )
+    assert not util.update()
+    # The installed file is still the old one, and the update can be continued
+    assert util.recover_update()
@@ -0,0 +1,32 @@
+'''
+Checking an installed game against the manifest of its build.
+'''
+import os
+from concurrent.futures import ThreadPoolExecutor
+import manifest
+import verify
+
+def test_verify( builds, game ):
+    build = manifest.make_manifest( None, os.path.join( builds.old, 'pf2' ), '', '0.7.3' )
+    assert verify.verify( build, game, workers=2 ).ok
+    os.remove( os.path.join( game, 'maps', 'map1.bsp' ) )
+    with open( os.path.join( game, 'maps', 'map2.bsp' ), 'r+b' ) as file:
+        file.write( b'damaged' )
+    result = verify.verify( build, game, workers=2 )
+    assert [ change.path for change in result.missing ] == [ 'maps/map1.bsp' ]
+    assert [ change.path for change in result.damaged ] == [ 'maps/map2.bsp' ]
+
+def test_file_deleted_while_verifying( builds, game, monkeypatch ):
+    build = manifest.make_manifest( None, os.path.join( builds.old, 'pf2' ), '', '0.7.3' )
+    hash_file = manifest.hash_file
+    def deleting_hash_file( path: str ) -> str:
+        # Gone between looking at it and hashing it
+        if path.endswith( 'map1.bsp' ):
+            os.remove( path )
+        return hash_file( path )
+    # Threads, so the workers see the patched hash_file
+    monkeypatch.setattr( verify, 'ProcessPoolExecutor', ThreadPoolExecutor )
+    monkeypatch.setattr( manifest, 'hash_file', deleting_hash_file )
+    result = verify.verify( build, game )
+    assert [ change.path for change in result.missing ] == [ 'maps/map1.bsp' ]
+    assert not result.damaged
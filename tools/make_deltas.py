@@ -0,0 +1,54 @@
+'''
+Publishing side: make binary deltas for the .vpk, .bsp, .so, .dll and .dylib files that changed between two builds,
+so the updater can rebuild them from the installed files instead of downloading them whole.
+Writes deltas/<old version>-<new version>/ with a .pf2delta per file and a deltas.json listing them.
+Upload the deltas folder next to latest.tar.gz.
+Usage: python tools/make_deltas.py <old build folder> <new build folder> <old version> <new version> <output folder>
+'''
+import os
+import sys
+import json
+import filecmp
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' ) )
+import vars
+import delta
+
+def main() -> None:
+    if len( sys.argv ) != 6:
+        print( __doc__ )
+        sys.exit( 1 )
+    _, old_build, new_build, old_version, new_version, output_path = sys.argv
+    delta_folder = os.path.join( output_path, 'deltas', f'{old_version}-{new_version}' )
+
+    files = {}
+    for root, dirs, names in os.walk( new_build ):
+        dirs.sort()
+        for name in sorted( names ):
+            if not name.endswith( vars.DELTA_EXTENSIONS ):
+                continue
+            new_path = os.path.join( root, name )
+            path = os.path.relpath( new_path, new_build ).replace( os.sep, '/' )
+            old_path = os.path.join( old_build, *path.split( '/' ) )
+            # Only files that exist in both builds and changed
+            if not os.path.exists( old_path ):
+                continue
+            if filecmp.cmp( old_path, new_path, shallow=False ):
+                continue
+            delta_path = os.path.join( delta_folder, *path.split( '/' ) ) + '.pf2delta'
+            os.makedirs( os.path.dirname( delta_path ), exist_ok=True )
+            if delta.make_delta( old_path, new_path, delta_path ):
+                _, _, old_sha256, new_sha256 = delta.read_header( delta_path )
+                files[path] = { 'delta': path + '.pf2delta',
+                                'size': os.path.getsize( delta_path ),
+                                'old_sha256': old_sha256,
+                                'sha256': new_sha256 }
+                print( f'{path}: {os.path.getsize( delta_path ) / 1e6:.2f} MB delta for a {os.path.getsize( new_path ) / 1e6:.2f} MB file' )
+            else:
+                print( f'{path}: changed too much for a delta' )
+
+    os.makedirs( delta_folder, exist_ok=True )
+    with open( os.path.join( delta_folder, 'deltas.json' ), 'w' ) as file:
+        json.dump( { 'format': delta.FORMAT_VERSION, 'from': old_version, 'to': new_version, 'files': files }, file, indent=1 )
+
+if __name__ == '__main__':
+    main()
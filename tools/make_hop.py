@@ -0,0 +1,66 @@
+'''
+Publishing side: make the pack of one patch, so updates that skip versions can go through it,
+and list it in patches.json with what it costs to download.
+The pack holds only the files the patch modifies or adds, and goes in <output folder>/hops/.
+Its manifest is written to the output folder too, upload it next to the patches.
+If <output folder>/latest.tar.gz exists, its size is what patches.json says the full build costs.
+Usage:
+python tools/make_hop.py <old pf2 folder> <new pf2 folder> <old version> <new version> <output folder>
+'''
+import os
+import sys
+import json
+import tempfile
+from shutil import copy2
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' ) )
+import vars
+import pack
+import manifest
+import planner
+import util
+
+def main() -> None:
+    if len( sys.argv ) != 6:
+        print( __doc__ )
+        sys.exit( 1 )
+    _, old_build, new_build, old_version, new_version, output_path = sys.argv
+    name = f'{old_version}-{new_version}'
+    os.makedirs( os.path.join( output_path, 'hops' ), exist_ok=True )
+
+    changes = manifest.make_manifest( old_build, new_build, old_version, new_version )
+    # Named like the patches, pf2_0XX-0YY.manifest.json
+    hotfix_add = '1' if old_version.endswith( '-HOTFIX' ) else ''
+    manifest.save_manifest( changes, os.path.join( output_path, f'pf2_0{util.get_version_num( old_version )}{hotfix_add}-0{util.get_version_num( new_version )}.manifest.json' ) )
+
+    # Pack only the files that have a new version
+    with tempfile.TemporaryDirectory() as build_path:
+        for change in changes.get( manifest.OP_MODIFIED ) + changes.get( manifest.OP_ADDED ):
+            dest = os.path.join( build_path, 'pf2', *change.path.split( '/' ) )
+            os.makedirs( os.path.dirname( dest ), exist_ok=True )
+            copy2( os.path.join( new_build, *change.path.split( '/' ) ), dest )
+        index = pack.make_pack( build_path, os.path.join( output_path, 'hops', name + '.pack' ), new_version )
+    # The updater finds the pack relative to the download server
+    index['pack'] = f'hops/{name}.pack'
+    with open( os.path.join( output_path, 'hops', name + '.index.json' ), 'w' ) as file:
+        json.dump( index, file, separators=( ',', ':' ) )
+
+    # Add it to patches.json, replacing an older pack of the same patch
+    patches_path = os.path.join( output_path, vars.PATCH_INDEX_NAME )
+    patches = { 'format': planner.FORMAT_VERSION, 'full_size': 0, 'patches': [] }
+    if os.path.exists( patches_path ):
+        with open( patches_path, 'r' ) as file:
+            patches = json.load( file )
+    patches['patches'] = [ patch for patch in patches['patches'] if ( patch['from'], patch['to'] ) != ( old_version, new_version ) ]
+    patches['patches'].append( { 'from': old_version, 'to': new_version, 'size': index['pack_size'], 'index': f'hops/{name}.index.json' } )
+    full_path = os.path.join( output_path, vars.FILE_NAME )
+    if os.path.exists( full_path ):
+        patches['full_size'] = os.path.getsize( full_path )
+    with open( patches_path, 'w' ) as file:
+        json.dump( patches, file, indent=1 )
+
+    print( f'{len( changes.files )} changed files, {index["pack_size"] / 1e6:.1f} MB to download.' )
+    if not patches['full_size']:
+        print( f'Put latest.tar.gz in {output_path} and run this again, or set full_size in {vars.PATCH_INDEX_NAME} by hand.' )
+
+if __name__ == '__main__':
+    main()
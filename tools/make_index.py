@@ -0,0 +1,32 @@
+'''
+Publishing side: build latest.pack and latest.index.json for a release, so the updater
+can download only the files that changed. Upload both next to latest.tar.gz.
+Usage:
+python tools/make_index.py <extracted build folder holding pf2/> <version> <output folder>
+python tools/make_index.py --tar <uncompressed latest.tar> <version> <output folder>
+'''
+import os
+import sys
+import json
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' ) )
+import vars
+import pack
+
+def main() -> None:
+    if len( sys.argv ) == 5 and sys.argv[1] == '--tar':
+        # Index the tar as it is, the updater will fetch from it directly
+        _, _, tar_path, version, output_path = sys.argv
+        index = pack.make_tar_index( tar_path, version )
+    elif len( sys.argv ) == 4:
+        _, build_path, version, output_path = sys.argv
+        index = pack.make_pack( build_path, os.path.join( output_path, 'latest.pack' ), version )
+    else:
+        print( __doc__ )
+        sys.exit( 1 )
+
+    with open( os.path.join( output_path, vars.INDEX_FILE_NAME ), 'w' ) as file:
+        json.dump( index, file, separators=( ',', ':' ) )
+    print( f'Indexed {len( index["members"] )} files, {index["pack_size"] / 1e6:.1f} MB.' )
+
+if __name__ == '__main__':
+    main()
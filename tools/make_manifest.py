@@ -0,0 +1,29 @@
+'''
+Publishing side: make the manifest of an update (every file it modifies, adds or removes, with sizes and hashes)
+or of a full build. Upload update manifests next to the patches, as pf2_0XX-0YY.manifest.json,
+and the full build's manifest next to latest.tar.gz as latest.manifest.json.
+Usage:
+python tools/make_manifest.py <old pf2 folder> <new pf2 folder> <old version> <new version> <output file>
+python tools/make_manifest.py --full <pf2 folder> <version> <output file>
+'''
+import os
+import sys
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' ) )
+import manifest
+
+def main() -> None:
+    if len( sys.argv ) == 5 and sys.argv[1] == '--full':
+        _, _, new_build, new_version, output_path = sys.argv
+        result = manifest.make_manifest( None, new_build, '', new_version )
+    elif len( sys.argv ) == 6:
+        _, old_build, new_build, old_version, new_version, output_path = sys.argv
+        result = manifest.make_manifest( old_build, new_build, old_version, new_version )
+    else:
+        print( __doc__ )
+        sys.exit( 1 )
+
+    manifest.save_manifest( result, output_path )
+    print( f'{len( result.files )} files, {os.path.getsize( output_path ) / 1e3:.1f} KB.' )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+'''
+Summary of the telemetry the updater writes (see telemetry.py), for one machine's file or many put together.
+For every phase: how many times it ran, how many failed, the median and 90th percentile of its time,
+its median throughput and its retries. The phases that took the most time overall come first.
+Usage: python tools/telemetry_report.py <telemetry.jsonl> [more files...]
+'''
+import os
+import sys
+import json
+import statistics
+
+def percentile( values: list, share: float ) -> float:
+    '''
+    Value below which share of the sorted values are.
+    '''
+    return values[min( len( values ) - 1, int( len( values ) * share ) )]
+
+def load_records( paths: list ) -> list:
+    '''
+    Every record in the files. Lines that aren't JSON (like a line cut short by a crash) are skipped.
+    '''
+    records = []
+    for path in paths:
+        with open( path, 'r' ) as file:
+            for line in file:
+                try:
+                    records.append( json.loads( line ) )
+                except ValueError:
+                    continue
+    return records
+
+def main() -> None:
+    if len( sys.argv ) < 2 or not all( os.path.exists( path ) for path in sys.argv[1:] ):
+        print( __doc__ )
+        sys.exit( 1 )
+
+    phases = {}
+    for record in load_records( sys.argv[1:] ):
+        phases.setdefault( record['phase'], [] ).append( record )
+    sessions = { record['session'] for records in phases.values() for record in records }
+    print( f'{sum( len( records ) for records in phases.values() )} phases from {len( sessions )} runs of the updater.' )
+    print( f'{"phase":<22} {"runs":>6} {"failed":>6} {"total s":>9} {"median s":>9} {"p90 s":>9} {"MB/s":>8} {"dl MB/s":>8} {"files/s":>9} {"retries":>7}' )
+    for name, records in sorted( phases.items(), key=lambda item: -sum( record['seconds'] for record in item[1] ) ):
+        seconds = sorted( record['seconds'] for record in records )
+        print( f'{name:<22} {len( records ):>6} {sum( not record["ok"] for record in records ):>6} {sum( seconds ):>9.2f} '
+               f'{statistics.median( seconds ):>9.3f} {percentile( seconds, 0.9 ):>9.3f} '
+               f'{statistics.median( record["mb_per_s"] for record in records ):>8.1f} '
+               f'{statistics.median( record["download_mb_per_s"] for record in records ):>8.1f} '
+               f'{statistics.median( record["files_per_s"] for record in records ):>9.0f} '
+               f'{sum( record["retries"] for record in records ):>7}' )
+
+if __name__ == '__main__':
+    main()